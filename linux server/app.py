@@ -1,64 +1,476 @@
-from flask import Flask, request, jsonify
+import time
+_import_started = time.perf_counter()
+from flask import Flask, Request, request, jsonify, Response, stream_with_context, g
+from werkzeug.exceptions import RequestEntityTooLarge
 from flask_cors import CORS
 import os
 import json
 import traceback
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import tempfile
 from urllib.parse import urlparse
-import time
+import uuid
+import queue
+import re
+import math
+import difflib
+from functools import lru_cache
+import numpy as np
+import threading
+import signal
+import atexit
+import random
+import hashlib
+import zlib
+import sqlite3
+import io
+import pickle
+import select
+import importlib
+from contextlib import contextmanager
+import contextvars
+from collections import OrderedDict, deque
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, TimeoutError as FutureTimeoutError, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+# --- Lazy Imports ---
+class LazyModule:
+    """
+    Stands in for a heavy module and imports it on first attribute access,
+    so the server can start serving before OCR, Gemini and MongoDB are
+    loaded. The warm-up thread loads them in the background.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
 
 # OCR Imports
-import pytesseract
-from PIL import Image
-import ocrmypdf 
+pytesseract = LazyModule('pytesseract')
+Image = LazyModule('PIL.Image')
+ocrmypdf = LazyModule('ocrmypdf')
+pikepdf = LazyModule('pikepdf')
+pdfminer_high_level = LazyModule('pdfminer.high_level')
+pdfminer_layout = LazyModule('pdfminer.layout')
 
 # AI and NLP Imports
-import google.generativeai as genai
+genai = LazyModule('google.generativeai')
+google_exceptions = LazyModule('google.api_core.exceptions')
 
-# --- NEW: MongoDB Imports ---
-from pymongo import MongoClient
-from pymongo.server_api import ServerApi
+# MongoDB and career matrices
+pymongo = LazyModule('pymongo')
+sparse = LazyModule('scipy.sparse')
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
-# Increase request timeout for long OCR operations
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
-import signal
-
-class TimeoutError(Exception):
-    pass
-
-def timeout_handler(signum, frame):
-    raise TimeoutError("Request timeout")
-
-# Set longer timeout for requests
-signal.signal(signal.SIGALRM, timeout_handler)
 
 # --- Configure API Keys and Database URI from Environment Variables ---
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
 MONGO_URI = os.environ.get("MONGO_URI")
 
-# Configure Gemini
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
-else:
+# Gemini is configured when the model is first created
+if not GEMINI_API_KEY:
     print("WARNING: GEMINI_API_KEY environment variable not found.")
 
-# Configure MongoDB Client
-mongo_client = None
-if MONGO_URI:
-    try:
-        mongo_client = MongoClient(MONGO_URI, server_api=ServerApi('1'))
-        mongo_client.admin.command('ping')
-        print("Successfully connected to MongoDB!")
-    except Exception as e:
-        print(f"Error connecting to MongoDB: {e}")
-        mongo_client = None
-else:
+# --- MongoDB Configuration ---
+MONGO_DB_NAME = os.environ.get("MONGO_DB_NAME", "test")
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", 20))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", 0))
+MONGO_TIMEOUT_MS = int(os.environ.get("MONGO_TIMEOUT_MS", 5000))
+# Write-behind buffer: flushed with bulk_write every MONGO_FLUSH_SIZE
+# operations or MONGO_FLUSH_INTERVAL seconds, whichever comes first
+MONGO_FLUSH_SIZE = int(os.environ.get("MONGO_FLUSH_SIZE", 100))
+MONGO_FLUSH_INTERVAL = float(os.environ.get("MONGO_FLUSH_INTERVAL", 1.0))
+MONGO_BUFFER_MAX = int(os.environ.get("MONGO_BUFFER_MAX", 10000))
+MONGO_MAX_RETRIES = int(os.environ.get("MONGO_MAX_RETRIES", 5))
+
+# The MongoDB client is created, pinged and given its indexes by the writer
+# thread (see MongoWriter), so nothing here blocks startup
+def connect_mongo():
+    return pymongo.MongoClient(
+        MONGO_URI, server_api=pymongo.server_api.ServerApi('1'),
+        maxPoolSize=MONGO_MAX_POOL_SIZE, minPoolSize=MONGO_MIN_POOL_SIZE,
+        serverSelectionTimeoutMS=MONGO_TIMEOUT_MS, connectTimeoutMS=MONGO_TIMEOUT_MS
+    )
+
+if not MONGO_URI:
     print("WARNING: MONGO_URI environment variable not found. Database features will be disabled.")
 
+# --- Deadline Configuration ---
+# Work for a request (or async job) that outlives its deadline is abandoned:
+# queued OCR tasks are dropped, running ones have their tesseract/ghostscript
+# subprocesses killed, downloads and Gemini calls time out.
+REQUEST_TIMEOUT = float(os.environ.get("REQUEST_TIMEOUT", 120))   # seconds per synchronous request / batch item
+JOB_TIMEOUT = float(os.environ.get("JOB_TIMEOUT", 600))           # seconds from queueing to finish for async jobs
+
+# --- Async Job Configuration ---
+# OCR is CPU-bound (ocrmypdf/tesseract), the LLM and DB stages are I/O-bound,
+# so each gets its own pool. JOB_QUEUE_SIZE bounds queued + running jobs.
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", os.cpu_count() or 2))
+LLM_WORKERS = int(os.environ.get("LLM_WORKERS", 4))
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", 50))
+JOB_RESULT_TTL = int(os.environ.get("JOB_RESULT_TTL", 3600))  # seconds to keep finished jobs
+# Job records are shared by all gunicorn workers through this SQLite file
+JOB_DB_PATH = os.environ.get("JOB_DB_PATH", "jobs.sqlite3")
+# Batch endpoint: downloads get their own pool, OCR/LLM reuse the job pools
+BATCH_DOWNLOAD_WORKERS = int(os.environ.get("BATCH_DOWNLOAD_WORKERS", 8))
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", 200))
+
+# --- OCR Cache Configuration ---
+OCR_CACHE_PATH = os.environ.get("OCR_CACHE_PATH", "ocr_cache.sqlite3")
+OCR_CACHE_MAX_MB = int(os.environ.get("OCR_CACHE_MAX_MB", 256))
+OCR_CACHE_TTL = int(os.environ.get("OCR_CACHE_TTL", 30 * 24 * 3600))  # seconds
+# Image OCR drops words tesseract is less sure of than this (0-100); on
+# decorative certificates those are mostly borders and ornaments
+OCR_MIN_WORD_CONFIDENCE = int(os.environ.get("OCR_MIN_WORD_CONFIDENCE", 30))
+# Images are decoded at reduced size (JPEG draft mode) and downscaled to
+# grayscale at about OCR_TARGET_DPI for an A4 page before OCR; larger ones
+# than IMAGE_MAX_MEGAPIXELS are rejected before anything is decoded
+OCR_TARGET_DPI = int(os.environ.get("OCR_TARGET_DPI", 300))
+OCR_IMAGE_MAX_SIDE = round(OCR_TARGET_DPI * 11.7)                     # A4 long side in inches
+IMAGE_MAX_MEGAPIXELS = float(os.environ.get("IMAGE_MAX_MEGAPIXELS", 50))
+# Part of the cache key, so changing how OCR runs invalidates old entries
+IMAGE_OCR_SETTINGS = f"tesseract:words:min_conf={OCR_MIN_WORD_CONFIDENCE}:gray:max_side={OCR_IMAGE_MAX_SIDE}"
+# Born-digital PDFs: pages whose embedded text layer passes these checks are
+# used as-is and only the remaining pages go through OCR
+PDF_TEXT_LAYER = os.environ.get("PDF_TEXT_LAYER", "1") == "1"
+TEXT_LAYER_MIN_CHARS = int(os.environ.get("TEXT_LAYER_MIN_CHARS", 40))
+TEXT_LAYER_MIN_ALNUM_RATIO = 0.6
+# Server-wide OCR process pool: pages from all requests share these
+# processes round-robin. OCRMYPDF_JOBS is ocrmypdf's own per-call parallelism;
+# keep it at 1 so the pool, not each call, decides how many cores are busy.
+OCR_PROCESSES = int(os.environ.get("OCR_PROCESSES", os.cpu_count() or 2))
+OCRMYPDF_JOBS = int(os.environ.get("OCRMYPDF_JOBS", 1))
+# Scanned PDFs: only the first PDF_OCR_MAX_PAGES pages are OCRed (0 for all).
+# With PDF_OCR_EARLY_STOP the first page is OCRed alone, then the rest in
+# parallel rounds of PDF_OCR_ROUND_PAGES, stopping once the name and date are found
+PDF_OCR_MAX_PAGES = int(os.environ.get("PDF_OCR_MAX_PAGES", 3))
+PDF_OCR_ROUND_PAGES = max(1, int(os.environ.get("PDF_OCR_ROUND_PAGES", OCR_PROCESSES)))
+PDF_OCR_EARLY_STOP = os.environ.get("PDF_OCR_EARLY_STOP", "1") == "1"
+PDF_OCR_SETTINGS = (f"ocrmypdf:deskew=1:force_ocr=1:text_layer={int(PDF_TEXT_LAYER)}:min_chars={TEXT_LAYER_MIN_CHARS}"
+                    f":max_pages={PDF_OCR_MAX_PAGES}:early_stop={int(PDF_OCR_EARLY_STOP)}:first_round=1:round={PDF_OCR_ROUND_PAGES}")
+
+# --- Download Configuration ---
+DOWNLOAD_POOL_SIZE = int(os.environ.get("DOWNLOAD_POOL_SIZE", 16))     # pooled connections per host
+DOWNLOAD_TIMEOUT = int(os.environ.get("DOWNLOAD_TIMEOUT", 30))         # seconds
+MAX_DOWNLOAD_MB = int(os.environ.get("MAX_DOWNLOAD_MB", 25))
+SPOOL_MAX_KB = int(os.environ.get("SPOOL_MAX_KB", 2048))               # smaller documents stay in memory
+MAX_UPLOAD_MB = int(os.environ.get("MAX_UPLOAD_MB", MAX_DOWNLOAD_MB))
+UPLOAD_MEMORY_MB = int(os.environ.get("UPLOAD_MEMORY_MB", 16))         # smaller uploads are never written to disk
+
+# --- Student Store Configuration ---
+# Certificates, skills and roadmaps live in this SQLite file; the legacy JSON
+# files are imported into it once on first start.
+STUDENT_DB_PATH = os.environ.get("STUDENT_DB_PATH", "student_data.sqlite3")
+READ_CACHE_ENTRIES = int(os.environ.get("READ_CACHE_ENTRIES", 64))    # serialized query responses kept in memory
+READ_PAGE_SIZE_MAX = int(os.environ.get("READ_PAGE_SIZE_MAX", 500))   # students per page
+STREAM_CHUNK_STUDENTS = 200                                             # students per streamed chunk
+
+# --- Duplicate Detection Configuration ---
+# Re-uploads of a certificate the student already has (same file, re-scan,
+# screenshot, other format) return the stored result instead of being
+# processed and stored again.
+DEDUP_ENABLED = os.environ.get("DEDUP_ENABLED", "1") == "1"
+PHASH_SIZE = 32                                                          # 32x32 = 1024-bit difference hash
+PHASH_MAX_DISTANCE = int(os.environ.get("PHASH_MAX_DISTANCE", 10))       # differing bits out of 1024
+MINHASH_THRESHOLD = float(os.environ.get("MINHASH_THRESHOLD", 0.8))      # estimated Jaccard similarity
+MINHASH_PERMUTATIONS = 64
+
+# --- LLM Configuration ---
+GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "gemini-2.5-flash")
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", "llm_cache.sqlite3")
+LLM_CACHE_MAX_MB = int(os.environ.get("LLM_CACHE_MAX_MB", 64))
+LLM_CACHE_TTL = int(os.environ.get("LLM_CACHE_TTL", 90 * 24 * 3600))  # seconds
+# Bump when a prompt changes so cached responses for the old prompt are ignored
+EXTRACTION_PROMPT_VERSION = "v3"
+# Certificate text in the extraction prompt is compacted to about this many
+# tokens (~4 characters each), keeping the lines likeliest to hold the fields
+LLM_PROMPT_MAX_TOKENS = int(os.environ.get("LLM_PROMPT_MAX_TOKENS", 600))
+# Shared Gemini client: calls are paced to the API quota, rate limits and
+# transient errors are retried, and interactive requests go before bulk ones
+GEMINI_RPM = int(os.environ.get("GEMINI_RPM", 60))                        # requests per minute, 0 = no limit
+GEMINI_BURST = int(os.environ.get("GEMINI_BURST", 10))                    # requests allowed back to back
+GEMINI_MAX_CONCURRENCY = int(os.environ.get("GEMINI_MAX_CONCURRENCY", 8))
+GEMINI_MAX_RETRIES = int(os.environ.get("GEMINI_MAX_RETRIES", 4))
+GEMINI_BACKOFF_BASE = float(os.environ.get("GEMINI_BACKOFF_BASE", 1.0))   # seconds, doubled per retry
+GEMINI_BACKOFF_MAX = float(os.environ.get("GEMINI_BACKOFF_MAX", 30.0))
+GEMINI_HEDGE_AFTER = float(os.environ.get("GEMINI_HEDGE_AFTER", 0))       # seconds before a slow call is duplicated, 0 = off
+# The limits above are for the whole server. Each gunicorn worker has its own
+# client, so it enforces an equal share (gunicorn.conf.py exports WEB_WORKERS)
+SERVER_WORKERS = max(1, int(os.environ.get("WEB_WORKERS", 1)))
+# Local fast path: certificates of courses and issuers Gemini has already
+# extracted are parsed with regexes and a category classifier trained on the
+# stored Gemini results; Gemini is only called below the confidence threshold
+LOCAL_EXTRACT_ENABLED = os.environ.get("LOCAL_EXTRACT_ENABLED", "1") == "1"
+LOCAL_EXTRACT_THRESHOLD = float(os.environ.get("LOCAL_EXTRACT_THRESHOLD", 0.9))
+LOCAL_EXTRACT_MIN_SEEN = int(os.environ.get("LOCAL_EXTRACT_MIN_SEEN", 3))          # Gemini results before a course/issuer is known
+LOCAL_EXTRACT_RETRAIN_SECONDS = int(os.environ.get("LOCAL_EXTRACT_RETRAIN_SECONDS", 300))
+
+# --- Roadmap Configuration ---
+SKILLS_CATALOG_PATH = os.environ.get("SKILLS_CATALOG_PATH", "skills.json")
+ROADMAP_TOP_K = int(os.environ.get("ROADMAP_TOP_K", 3))
+
+class ProcessingError(Exception):
+    """Raised by the certificate pipeline with the HTTP status to report."""
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.status_code = status_code
+
+class DeadlineExceeded(ProcessingError):
+    """The request's deadline passed; the remaining work was cancelled."""
+    def __init__(self, stage):
+        super().__init__(f'Deadline exceeded during {stage}; processing was cancelled.', 504)
+        self.stage = stage
+
+class VersionConflict(ProcessingError):
+    """A student changed since the version the client based its patch on."""
+    def __init__(self, versions):
+        super().__init__('Student data changed since it was read; reload and retry.', 409)
+        self.versions = versions
+
+# --- Metrics ---
+class Metrics:
+    """
+    Minimal Prometheus-style registry: labelled counters and histograms
+    updated in-process, plus callbacks for values that live elsewhere (queue
+    depths, cache counters). render() produces the text exposition format.
+    """
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.help = {}
+        self.counters = {}    # name -> {labels: value}
+        self.histograms = {}  # name -> {labels: [bucket counts..., sum, count]}
+        self.callbacks = []   # (name, type, fn) with fn() -> {labels: value}
+
+    @staticmethod
+    def _labels(labels):
+        return tuple(sorted(labels.items()))
+
+    def inc(self, name, amount=1, **labels):
+        key = self._labels(labels)
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = self._labels(labels)
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            values = series.setdefault(key, [0] * (len(self.BUCKETS) + 2))
+            for i, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    values[i] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    def register(self, name, metric_type, help_text, fn):
+        self.help[name] = help_text
+        self.callbacks.append((name, metric_type, fn))
+
+    def describe(self, name, help_text):
+        self.help[name] = help_text
+
+    @staticmethod
+    def _format_labels(labels, extra=()):
+        items = list(labels) + list(extra)
+        if not items:
+            return ''
+        return '{' + ','.join(f'{k}="{v}"' for k, v in items) + '}'
+
+    def render(self):
+        lines = []
+        def header(name, metric_type):
+            if name in self.help:
+                lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+        with self.lock:
+            counters = {name: dict(series) for name, series in self.counters.items()}
+            histograms = {name: {k: list(v) for k, v in series.items()} for name, series in self.histograms.items()}
+        for name, series in sorted(counters.items()):
+            header(name, 'counter')
+            for labels, value in sorted(series.items()):
+                lines.append(f"{name}{self._format_labels(labels)} {value}")
+        for name, series in sorted(histograms.items()):
+            header(name, 'histogram')
+            for labels, values in sorted(series.items()):
+                for bound, count in zip(self.BUCKETS, values):
+                    lines.append(f"{name}_bucket{self._format_labels(labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{self._format_labels(labels, [('le', '+Inf')])} {values[-1]}")
+                lines.append(f"{name}_sum{self._format_labels(labels)} {values[-2]:.6f}")
+                lines.append(f"{name}_count{self._format_labels(labels)} {values[-1]}")
+        for name, metric_type, fn in self.callbacks:
+            try:
+                series = fn()
+            except Exception as e:
+                print(f"Error collecting metric {name}: {e}")
+                continue
+            header(name, metric_type)
+            if not isinstance(series, dict):
+                series = {(): series}
+            for labels, value in series.items():
+                lines.append(f"{name}{self._format_labels(labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+metrics.describe('certificate_stage_seconds', 'Time spent in each certificate pipeline stage.')
+metrics.describe('ocr_task_seconds', 'Run time of OCR pool tasks (one per PDF page or image).')
+metrics.describe('ocr_task_wait_seconds', 'Time OCR tasks waited for a pool process.')
+metrics.describe('http_request_seconds', 'HTTP request latency by endpoint.')
+metrics.describe('llm_prompt_chars_total', 'Certificate text characters before (raw) and after (compacted) prompt compaction.')
+metrics.describe('mongo_writes_dropped_total', 'MongoDB writes dropped because the write-behind buffer was full.')
+metrics.describe('ocr_pool_restarts_total', 'OCR pools replaced after a pool process died.')
+metrics.describe('local_extraction_total', 'Certificates extracted locally (hit) or sent to Gemini (miss).')
+
+class Warmup:
+    """
+    State of each dependency loaded in the background after startup, for
+    /readyz: pending, loading, ready, failed or disabled. The server is ready
+    once every required dependency is ready or disabled. `imports_done` is
+    set when the heavy imports are over; the OCR pool forks only after that.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.states = OrderedDict()
+        self.imports_done = threading.Event()
+
+    def update(self, name, status, required=None, **details):
+        with self.lock:
+            state = self.states.setdefault(name, {'required': True})
+            if required is not None:
+                state['required'] = required
+            if status != 'failed':
+                state.pop('error', None)
+            state.update(details, status=status)
+
+    def run(self, name, fn):
+        self.update(name, 'loading')
+        started = time.perf_counter()
+        try:
+            fn()
+        except Exception as e:
+            print(f"Warm-up of {name} failed: {e}")
+            self.update(name, 'failed', error=str(e), seconds=round(time.perf_counter() - started, 3))
+            return False
+        seconds = round(time.perf_counter() - started, 3)
+        metrics.observe('warmup_seconds', seconds, dependency=name)
+        self.update(name, 'ready', seconds=seconds)
+        return True
+
+    def snapshot(self):
+        with self.lock:
+            return {name: dict(state) for name, state in self.states.items()}
+
+warmup = Warmup()
+metrics.describe('warmup_seconds', 'Time to load each dependency in the background after startup.')
+
+# Stage timings of the current request or job, when a caller asked for them
+request_timings = contextvars.ContextVar('request_timings', default=None)
+
+# Absolute (time.time()) deadline of the current request or job, if any
+request_deadline = contextvars.ContextVar('request_deadline', default=None)
+
+# Gemini lane of the current request or job: 'interactive' or 'bulk'
+llm_priority = contextvars.ContextVar('llm_priority', default='interactive')
+
+# Set when the caller asked to store the certificate even if it looks like a duplicate
+allow_duplicate = contextvars.ContextVar('allow_duplicate', default=False)
+
+@contextmanager
+def deadline_scope(deadline):
+    token = request_deadline.set(deadline)
+    try:
+        yield
+    finally:
+        request_deadline.reset(token)
+
+def time_left(stage):
+    """
+    Seconds left before the current deadline, or None without one. Raises
+    DeadlineExceeded (504) once it has passed.
+    """
+    deadline = request_deadline.get()
+    if deadline is None:
+        return None
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        raise DeadlineExceeded(stage)
+    return remaining
+
+def stage_timeout(stage, default):
+    """Timeout for one blocking call: `default`, cut short by the deadline."""
+    remaining = time_left(stage)
+    return default if remaining is None else min(default, remaining)
+
+@contextmanager
+def llm_lane(priority):
+    token = llm_priority.set(priority)
+    try:
+        yield
+    finally:
+        llm_priority.reset(token)
+
+@contextmanager
+def allow_duplicate_scope(allow):
+    token = allow_duplicate.set(bool(allow))
+    try:
+        yield
+    finally:
+        allow_duplicate.reset(token)
+
+@contextmanager
+def timed(stage):
+    """
+    Records the duration of a pipeline stage in the stage histogram and, if
+    the current request collects timings, adds it to its breakdown.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe('certificate_stage_seconds', elapsed, stage=stage)
+        timings = request_timings.get()
+        if timings is not None:
+            timings[stage] = round(timings.get(stage, 0) + elapsed, 4)
+
+@app.before_request
+def _start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def _record_request_latency(response):
+    start = getattr(g, 'request_start', None)
+    if start is not None:
+        metrics.observe('http_request_seconds', time.perf_counter() - start,
+                        endpoint=request.endpoint or 'unknown', status=response.status_code)
+    return response
+
+@app.teardown_request
+def _clear_request_context(exc=None):
+    # Worker threads are reused between requests
+    request_timings.set(None)
+    request_deadline.set(None)
+    llm_priority.set('interactive')
+    allow_duplicate.set(False)
+
 # --- Helper & AI Functions ---
 def load_json(filename):
     if not os.path.exists(filename):
@@ -68,20 +480,815 @@ def load_json(filename):
         with open(filename, 'r') as f: return json.load(f)
     except json.JSONDecodeError: return {}
 
-def save_json(data, filename):
-    with open(filename, 'w') as f: json.dump(data, f, indent=2)
+def thread_local_connection(local, path, **kwargs):
+    """
+    sqlite3 connections can't be shared across threads, so keep one per
+    thread in `local`. WAL lets readers run alongside a writer, and the busy
+    timeout makes writers from other threads/processes wait instead of failing.
+    """
+    conn = getattr(local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=30, **kwargs)
+        conn.execute("PRAGMA journal_mode=WAL")
+        local.conn = conn
+    return conn
+
+class DiskCache:
+    """
+    Persistent LRU cache backed by a SQLite file. Entries expire after `ttl`
+    seconds and the least recently used ones are evicted once the stored
+    values exceed `max_bytes`. Values must be JSON-serializable.
+    Cache errors are logged and treated as misses, never raised.
+    """
+    def __init__(self, path, max_bytes, ttl):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        try:
+            with self._connection() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS cache ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                    "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+        except sqlite3.Error as e:
+            print(f"Error initializing cache {path}: {e}")
+
+    def _connection(self):
+        return thread_local_connection(self._local, self.path)
+
+    def get(self, key):
+        try:
+            with self._connection() as conn:
+                row = conn.execute("SELECT value, created_at FROM cache WHERE key = ?", (key,)).fetchone()
+                now = time.time()
+                if row and now - row[1] > self.ttl:
+                    conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                    row = None
+                if not row:
+                    self.misses += 1
+                    return None
+                conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return json.loads(row[0])
+        except (sqlite3.Error, ValueError) as e:
+            print(f"Error reading cache {self.path}: {e}")
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        try:
+            payload = json.dumps(value)
+            now = time.time()
+            with self._connection() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, payload, len(payload), now, now)
+                )
+                self._evict(conn, now)
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            print(f"Error writing cache {self.path}: {e}")
+
+    def _evict(self, conn, now):
+        conn.execute("DELETE FROM cache WHERE created_at < ?", (now - self.ttl,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        stale_keys = []
+        for key, size in conn.execute("SELECT key, size FROM cache ORDER BY accessed_at"):
+            if total <= self.max_bytes:
+                break
+            stale_keys.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM cache WHERE key = ?", stale_keys)
+
+
+class StudentStore:
+    """
+    Indexed storage for student certificates, skills and roadmaps in a SQLite
+    WAL database. Adding a certificate is a single small transaction and
+    per-student reads hit the student_id index, so cost no longer grows with
+    the total number of students. Safe across threads and processes.
+    """
+    LEGACY_FILES = {
+        'certificates': 'student_detailed_data.json',
+        'skills': 'student_skills.json',
+        'roadmaps': 'roadmaps.json',
+    }
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS certificates ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, student_id TEXT NOT NULL, data TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS certificates_student_id ON certificates (student_id)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS skills ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, student_id TEXT NOT NULL, skill TEXT NOT NULL, "
+                "skill_key TEXT NOT NULL, UNIQUE (student_id, skill_key))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS roadmaps (student_id TEXT PRIMARY KEY, data TEXT NOT NULL)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS student_versions (student_id TEXT PRIMARY KEY, version INTEGER NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS fingerprints ("
+                "certificate_id INTEGER PRIMARY KEY, student_id TEXT NOT NULL, "
+                "sha256 TEXT, phash TEXT, minhash BLOB)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS fingerprints_student_id ON fingerprints (student_id)")
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(fingerprints)")]
+            if 'identity' not in columns:
+                conn.execute("ALTER TABLE fingerprints ADD COLUMN identity TEXT")
+            self._create_aggregates(conn)
+            self._import_legacy_files(conn)
+            if not conn.execute("SELECT 1 FROM meta WHERE key = 'aggregates:v1'").fetchone():
+                self._rebuild_aggregates(conn)
+                conn.execute("INSERT INTO meta (key, value) VALUES ('aggregates:v1', ?)", (time.strftime('%Y-%m-%d %H:%M:%S'),))
+        self._snapshot = None
+        self._snapshot_lock = threading.Lock()
+
+    def _connection(self):
+        # Autocommit mode; writes use explicit BEGIN IMMEDIATE transactions
+        return thread_local_connection(self._local, self.path, isolation_level=None)
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _import_legacy_files(self, conn):
+        for kind, filename in self.LEGACY_FILES.items():
+            marker = f"imported:{filename}"
+            if conn.execute("SELECT 1 FROM meta WHERE key = ?", (marker,)).fetchone():
+                continue
+            data = load_json(filename) if os.path.exists(filename) else {}
+            if kind == 'certificates':
+                self._insert_certificates(conn, data)
+            elif kind == 'skills':
+                self._insert_skills(conn, data)
+            else:
+                self._insert_roadmaps(conn, data)
+            conn.execute("INSERT INTO meta (key, value) VALUES (?, ?)", (marker, time.strftime('%Y-%m-%d %H:%M:%S')))
+            if data:
+                self._touch(conn, list(data))
+                print(f"Imported {len(data)} students from {filename} into {self.path}")
+
+    # Materialized analytics, kept current by triggers on every insert and
+    # delete (certificate processing, PATCH and full replaces alike):
+    #   aggregates: kind in skill (students with it), category, issuer (certificates),
+    #               total (students, certificates, skill_entries)
+    #   student_aggregates: category and issuer counts per student
+    #   student_totals: certificates and skills per student
+    AGGREGATE_FIELDS = "SELECT 'category' AS kind, json_extract({row}.data, '$.category') AS value " \
+                       "UNION ALL SELECT 'issuer', json_extract({row}.data, '$.issuer')"
+
+    @classmethod
+    def _create_aggregates(cls, conn):
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS aggregates ("
+            "kind TEXT NOT NULL, key TEXT NOT NULL, label TEXT NOT NULL, count INTEGER NOT NULL, "
+            "PRIMARY KEY (kind, key))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS student_aggregates ("
+            "student_id TEXT NOT NULL, kind TEXT NOT NULL, key TEXT NOT NULL, label TEXT NOT NULL, "
+            "count INTEGER NOT NULL, PRIMARY KEY (student_id, kind, key))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS student_totals ("
+            "student_id TEXT PRIMARY KEY, certificates INTEGER NOT NULL, skills INTEGER NOT NULL)"
+        )
+        def bump_total(key, delta):
+            return (f"INSERT INTO aggregates (kind, key, label, count) VALUES ('total', '{key}', '{key}', {delta}) "
+                    f"ON CONFLICT (kind, key) DO UPDATE SET count = count + {delta};")
+        fields = {row: cls.AGGREGATE_FIELDS.format(row=row) for row in ('NEW', 'OLD')}
+        triggers = {
+            'certificates_aggregate_insert': f"""AFTER INSERT ON certificates BEGIN
+                INSERT INTO aggregates (kind, key, label, count)
+                    SELECT kind, lower(trim(value)), trim(value), 1 FROM ({fields['NEW']})
+                    WHERE trim(value) != '' ON CONFLICT (kind, key) DO UPDATE SET count = count + 1;
+                INSERT INTO student_aggregates (student_id, kind, key, label, count)
+                    SELECT NEW.student_id, kind, lower(trim(value)), trim(value), 1 FROM ({fields['NEW']})
+                    WHERE trim(value) != '' ON CONFLICT (student_id, kind, key) DO UPDATE SET count = count + 1;
+                INSERT INTO student_totals (student_id, certificates, skills) VALUES (NEW.student_id, 1, 0)
+                    ON CONFLICT (student_id) DO UPDATE SET certificates = certificates + 1;
+                {bump_total('certificates', 1)}
+            END""",
+            'certificates_aggregate_delete': f"""AFTER DELETE ON certificates BEGIN
+                UPDATE aggregates SET count = count - 1 WHERE (kind, key) IN (
+                    SELECT kind, lower(trim(value)) FROM ({fields['OLD']}) WHERE trim(value) != '');
+                UPDATE student_aggregates SET count = count - 1 WHERE student_id = OLD.student_id AND (kind, key) IN (
+                    SELECT kind, lower(trim(value)) FROM ({fields['OLD']}) WHERE trim(value) != '');
+                UPDATE student_totals SET certificates = certificates - 1 WHERE student_id = OLD.student_id;
+                {bump_total('certificates', -1)}
+                DELETE FROM aggregates WHERE count <= 0 AND (kind, key) IN (
+                    SELECT kind, lower(trim(value)) FROM ({fields['OLD']}) WHERE trim(value) != '');
+                DELETE FROM student_aggregates WHERE student_id = OLD.student_id AND count <= 0;
+                DELETE FROM student_totals WHERE student_id = OLD.student_id AND certificates <= 0 AND skills <= 0;
+            END""",
+            'skills_aggregate_insert': f"""AFTER INSERT ON skills BEGIN
+                INSERT INTO aggregates (kind, key, label, count) VALUES ('skill', NEW.skill_key, NEW.skill, 1)
+                    ON CONFLICT (kind, key) DO UPDATE SET count = count + 1;
+                INSERT INTO student_totals (student_id, certificates, skills) VALUES (NEW.student_id, 0, 1)
+                    ON CONFLICT (student_id) DO UPDATE SET skills = skills + 1;
+                {bump_total('skill_entries', 1)}
+            END""",
+            'skills_aggregate_delete': f"""AFTER DELETE ON skills BEGIN
+                UPDATE aggregates SET count = count - 1 WHERE kind = 'skill' AND key = OLD.skill_key;
+                UPDATE student_totals SET skills = skills - 1 WHERE student_id = OLD.student_id;
+                {bump_total('skill_entries', -1)}
+                DELETE FROM aggregates WHERE kind = 'skill' AND key = OLD.skill_key AND count <= 0;
+                DELETE FROM student_totals WHERE student_id = OLD.student_id AND certificates <= 0 AND skills <= 0;
+            END""",
+            'student_totals_insert': f"""AFTER INSERT ON student_totals BEGIN
+                {bump_total('students', 1)}
+            END""",
+            'student_totals_delete': f"""AFTER DELETE ON student_totals BEGIN
+                {bump_total('students', -1)}
+            END""",
+        }
+        for name, body in triggers.items():
+            conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+
+    @classmethod
+    def _rebuild_aggregates(cls, conn):
+        """Recomputes every aggregate from scratch (once, for stores created before they existed)."""
+        fields = ("SELECT student_id, 'category' AS kind, json_extract(data, '$.category') AS value FROM certificates "
+                  "UNION ALL SELECT student_id, 'issuer', json_extract(data, '$.issuer') FROM certificates")
+        conn.execute("DELETE FROM aggregates")
+        conn.execute("DELETE FROM student_aggregates")
+        conn.execute("DELETE FROM student_totals")
+        conn.execute(
+            "INSERT INTO aggregates (kind, key, label, count) "
+            f"SELECT kind, lower(trim(value)), min(trim(value)), count(*) FROM ({fields}) "
+            "WHERE trim(value) != '' GROUP BY kind, lower(trim(value))"
+        )
+        conn.execute(
+            "INSERT INTO student_aggregates (student_id, kind, key, label, count) "
+            f"SELECT student_id, kind, lower(trim(value)), min(trim(value)), count(*) FROM ({fields}) "
+            "WHERE trim(value) != '' GROUP BY student_id, kind, lower(trim(value))"
+        )
+        conn.execute(
+            "INSERT INTO aggregates (kind, key, label, count) "
+            "SELECT 'skill', skill_key, min(skill), count(*) FROM skills GROUP BY skill_key"
+        )
+        conn.execute(
+            "INSERT INTO student_totals (student_id, certificates, skills) "
+            "SELECT student_id, sum(certificate), sum(skill) FROM ("
+            "SELECT student_id, 1 AS certificate, 0 AS skill FROM certificates "
+            "UNION ALL SELECT student_id, 0, 1 FROM skills) GROUP BY student_id"
+        )
+        # The student_totals trigger counted the students; add the other totals
+        conn.execute(
+            "INSERT OR REPLACE INTO aggregates (kind, key, label, count) VALUES "
+            "('total', 'certificates', 'certificates', (SELECT count(*) FROM certificates)), "
+            "('total', 'skill_entries', 'skill_entries', (SELECT count(*) FROM skills)), "
+            "('total', 'students', 'students', (SELECT count(*) FROM student_totals))"
+        )
+
+    def aggregates(self, top=20, student_ids=None):
+        """
+        Skill, category and issuer distributions plus totals. Without
+        student_ids these are stored counters; for a cohort they are summed
+        from the per-student aggregates of just those students.
+        """
+        conn = self._connection()
+        if student_ids is None:
+            result = {}
+            for kind in ('skill', 'category', 'issuer'):
+                result[kind] = [
+                    {'name': label, 'count': count} for label, count in conn.execute(
+                        "SELECT label, count FROM aggregates WHERE kind = ? ORDER BY count DESC, key LIMIT ?", (kind, top))
+                ]
+            totals = dict(conn.execute("SELECT key, count FROM aggregates WHERE kind = 'total'").fetchall())
+            result['totals'] = {key: totals.get(key, 0) for key in ('students', 'certificates', 'skill_entries')}
+            return result
+
+        counts = {'skill': {}, 'category': {}, 'issuer': {}}
+        labels = {}
+        student_totals = {}
+        student_ids = list(dict.fromkeys(student_ids))
+        for start in range(0, len(student_ids), 500):
+            chunk = student_ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            rows = conn.execute(
+                f"SELECT kind, key, label, count FROM student_aggregates WHERE student_id IN ({placeholders}) "
+                f"UNION ALL SELECT 'skill', skill_key, skill, 1 FROM skills WHERE student_id IN ({placeholders})",
+                chunk + chunk
+            )
+            for kind, key, label, count in rows:
+                counts[kind][key] = counts[kind].get(key, 0) + count
+                labels.setdefault((kind, key), label)
+            for student_id, certificates, skills in conn.execute(
+                    f"SELECT student_id, certificates, skills FROM student_totals WHERE student_id IN ({placeholders})", chunk):
+                student_totals[student_id] = {'certificates': certificates, 'skills': skills}
+
+        result = {}
+        for kind, kind_counts in counts.items():
+            ranked = sorted(kind_counts.items(), key=lambda item: (-item[1], item[0]))[:top]
+            result[kind] = [{'name': labels[(kind, key)], 'count': count} for key, count in ranked]
+        result['totals'] = {
+            'students': len(student_totals),
+            'certificates': sum(totals['certificates'] for totals in student_totals.values()),
+            'skill_entries': sum(totals['skills'] for totals in student_totals.values()),
+        }
+        result['students'] = student_totals
+        return result
+
+    @staticmethod
+    def _touch(conn, student_ids=None):
+        """
+        Bumps the data version inside a write transaction and stamps it on
+        the changed students (all of them when student_ids is None). Readers
+        use these versions as ETags and to invalidate their caches, across
+        processes too.
+        """
+        row = conn.execute("SELECT value FROM meta WHERE key = 'data_version'").fetchone()
+        version = (int(row[0]) if row else 0) + 1
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('data_version', ?)", (str(version),))
+        if student_ids is None:
+            conn.execute("UPDATE student_versions SET version = ?", (version,))
+            conn.execute(
+                "INSERT OR IGNORE INTO student_versions (student_id, version) "
+                "SELECT student_id, ? FROM certificates UNION SELECT student_id, ? FROM skills",
+                (version, version)
+            )
+        else:
+            conn.executemany(
+                "INSERT OR REPLACE INTO student_versions (student_id, version) VALUES (?, ?)",
+                [(student_id, version) for student_id in set(student_ids)]
+            )
+        return version
+
+    @staticmethod
+    def _insert_certificates(conn, detailed_data):
+        conn.executemany(
+            "INSERT INTO certificates (student_id, data) VALUES (?, ?)",
+            [(student_id, json.dumps(cert)) for student_id, certs in detailed_data.items() for cert in certs]
+        )
+
+    @staticmethod
+    def _insert_skills(conn, skills_data):
+        conn.executemany(
+            "INSERT OR IGNORE INTO skills (student_id, skill, skill_key) VALUES (?, ?, ?)",
+            [(student_id, skill, skill.lower()) for student_id, skills in skills_data.items() for skill in skills]
+        )
+
+    @staticmethod
+    def _insert_roadmaps(conn, roadmaps):
+        conn.executemany(
+            "INSERT OR REPLACE INTO roadmaps (student_id, data) VALUES (?, ?)",
+            [(student_id, json.dumps(roadmap)) for student_id, roadmap in roadmaps.items()]
+        )
+
+    def add_certificate(self, student_id, parsed_data, skills, fingerprints=None):
+        """Appends one certificate and merges its skills (case-insensitive) atomically."""
+        self.add_certificates([(student_id, parsed_data, skills)], [fingerprints])
+
+    def add_certificates(self, records, fingerprints=None):
+        """
+        Appends (student_id, parsed_data, skills) records in a single
+        transaction. `fingerprints` optionally lists one duplicate-detection
+        fingerprint dict (or None) per record.
+        """
+        fingerprints = fingerprints or [None] * len(records)
+        with self._transaction() as conn:
+            for (student_id, parsed_data, skills), fingerprint in zip(records, fingerprints):
+                if fingerprint:
+                    cursor = conn.execute("INSERT INTO certificates (student_id, data) VALUES (?, ?)",
+                                          (student_id, json.dumps(parsed_data)))
+                    identity = fingerprint.get('identity')
+                    conn.execute(
+                        "INSERT INTO fingerprints (certificate_id, student_id, sha256, phash, minhash, identity) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (cursor.lastrowid, student_id, fingerprint.get('sha256'), fingerprint.get('phash'),
+                         fingerprint.get('minhash'), json.dumps(identity) if identity is not None else None)
+                    )
+                else:
+                    self._insert_certificates(conn, {student_id: [parsed_data]})
+                self._insert_skills(conn, {student_id: skills})
+            self._touch(conn, [student_id for student_id, _, _ in records])
+
+    def get_fingerprints(self, student_id):
+        """
+        Fingerprints of the student's stored certificates as (sha256, phash,
+        minhash, identity, certificate) rows; identity is None for rows stored
+        before it was recorded.
+        """
+        rows = self._connection().execute(
+            "SELECT f.sha256, f.phash, f.minhash, f.identity, c.data FROM fingerprints f "
+            "JOIN certificates c ON c.id = f.certificate_id WHERE f.student_id = ? ORDER BY f.certificate_id",
+            (student_id,)
+        )
+        return [(sha256, phash, minhash, json.loads(identity) if identity else None, json.loads(data))
+                for sha256, phash, minhash, identity, data in rows]
+
+    def get_certificates(self, student_id):
+        rows = self._connection().execute(
+            "SELECT data FROM certificates WHERE student_id = ? ORDER BY id", (student_id,)
+        )
+        return [json.loads(data) for (data,) in rows]
+
+    def get_skills(self, student_id):
+        rows = self._connection().execute(
+            "SELECT skill FROM skills WHERE student_id = ? ORDER BY id", (student_id,)
+        )
+        return [skill for (skill,) in rows]
+
+    def get_roadmap(self, student_id):
+        row = self._connection().execute(
+            "SELECT data FROM roadmaps WHERE student_id = ?", (student_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_roadmaps(self, roadmaps):
+        with self._transaction() as conn:
+            self._insert_roadmaps(conn, roadmaps)
+            self._touch(conn, list(roadmaps))
+
+    PATCH_OPERATIONS = ('add_skill', 'remove_skill', 'set_skills',
+                        'append_certificate', 'remove_certificate', 'set_certificates')
+
+    def apply_patch(self, operations, expected_versions=None):
+        """
+        Applies per-student operations in order, in one transaction:
+          {"op": "add_skill" | "remove_skill", "student_id", "skill"}
+          {"op": "set_skills", "student_id", "skills": [...] or null}
+          {"op": "append_certificate", "student_id", "certificate": {...}}
+          {"op": "remove_certificate", "student_id", "index" or "document_url"}
+          {"op": "set_certificates", "student_id", "certificates": [...] or null}
+        `expected_versions` maps student ids to the version the client read;
+        if any of them moved on, nothing is written and VersionConflict is
+        raised. Returns the new version of every student touched.
+        Raises ProcessingError (400) for malformed operations.
+        """
+        expected_versions = expected_versions or {}
+        with self._transaction() as conn:
+            if expected_versions:
+                current = {
+                    student_id: (conn.execute("SELECT version FROM student_versions WHERE student_id = ?",
+                                              (student_id,)).fetchone() or (0,))[0]
+                    for student_id in expected_versions
+                }
+                if any(current[student_id] != version for student_id, version in expected_versions.items()):
+                    raise VersionConflict(current)
+
+            touched = []
+            for position, operation in enumerate(operations):
+                self._apply_operation(conn, position, operation)
+                touched.append(operation['student_id'])
+            if not touched:
+                return {}
+            version = self._touch(conn, touched)
+        return {student_id: version for student_id in touched}
+
+    def _apply_operation(self, conn, position, operation):
+        op = operation.get('op') if isinstance(operation, dict) else None
+        student_id = operation.get('student_id') if op else None
+        if op not in self.PATCH_OPERATIONS or not isinstance(student_id, str) or not student_id:
+            raise ProcessingError(f'Operation {position}: needs an "op" from {list(self.PATCH_OPERATIONS)} '
+                                  f'and a "student_id"', 400)
+
+        if op in ('add_skill', 'remove_skill'):
+            skill = operation.get('skill')
+            if not isinstance(skill, str) or not skill.strip():
+                raise ProcessingError(f'Operation {position}: "skill" must be a non-empty string', 400)
+            if op == 'add_skill':
+                self._insert_skills(conn, {student_id: [skill.strip()]})
+            else:
+                conn.execute("DELETE FROM skills WHERE student_id = ? AND skill_key = ?",
+                             (student_id, skill.strip().lower()))
+        elif op == 'set_skills':
+            skills = operation.get('skills')
+            if skills is not None and not (isinstance(skills, list) and all(isinstance(s, str) for s in skills)):
+                raise ProcessingError(f'Operation {position}: "skills" must be a list of strings or null', 400)
+            conn.execute("DELETE FROM skills WHERE student_id = ?", (student_id,))
+            self._insert_skills(conn, {student_id: skills or []})
+        elif op == 'append_certificate':
+            certificate = operation.get('certificate')
+            if not isinstance(certificate, dict):
+                raise ProcessingError(f'Operation {position}: "certificate" must be an object', 400)
+            self._insert_certificates(conn, {student_id: [certificate]})
+        elif op == 'remove_certificate':
+            rows = conn.execute("SELECT id, data FROM certificates WHERE student_id = ? ORDER BY id",
+                                (student_id,)).fetchall()
+            if 'index' in operation:
+                index = operation['index']
+                if not isinstance(index, int) or not -len(rows) <= index < len(rows):
+                    raise ProcessingError(f'Operation {position}: no certificate at index {index}', 400)
+                row_ids = [rows[index][0]]
+            else:
+                document_url = operation.get('document_url')
+                row_ids = [row_id for row_id, data in rows if json.loads(data).get('document_url') == document_url]
+                if not document_url or not row_ids:
+                    raise ProcessingError(f'Operation {position}: no certificate with that document_url', 400)
+            conn.executemany("DELETE FROM certificates WHERE id = ?", [(row_id,) for row_id in row_ids])
+        else:
+            certificates = operation.get('certificates')
+            if certificates is not None and not (isinstance(certificates, list)
+                                                 and all(isinstance(c, dict) for c in certificates)):
+                raise ProcessingError(f'Operation {position}: "certificates" must be a list of objects or null', 400)
+            conn.execute("DELETE FROM certificates WHERE student_id = ?", (student_id,))
+            self._insert_certificates(conn, {student_id: certificates or []})
+
+    def data_version(self):
+        row = self._connection().execute("SELECT value FROM meta WHERE key = 'data_version'").fetchone()
+        return int(row[0]) if row else 0
+
+    def student_version(self, student_id):
+        row = self._connection().execute(
+            "SELECT version FROM student_versions WHERE student_id = ?", (student_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def snapshot(self):
+        """
+        Returns (version, certificates by student, skills by student) from an
+        in-memory copy that is reloaded only when the data version changed.
+        The returned dicts are shared; callers must not modify them.
+        """
+        version = self.data_version()
+        snapshot = self._snapshot
+        if snapshot and snapshot[0] == version:
+            return snapshot
+        with self._snapshot_lock:
+            if self._snapshot and self._snapshot[0] == version:
+                return self._snapshot
+            conn = self._connection()
+            conn.execute("BEGIN")
+            try:
+                version = self.data_version()
+                snapshot = (version, self.all_certificates(), self.all_skills())
+            finally:
+                conn.execute("COMMIT")
+            self._snapshot = snapshot
+            return snapshot
+
+    def gemini_extractions(self):
+        """(course, issuer, category, skills) of every stored certificate that Gemini extracted, oldest first."""
+        rows = self._connection().execute(
+            "SELECT json_extract(data, '$.course'), json_extract(data, '$.issuer'), "
+            "json_extract(data, '$.category'), json_extract(data, '$.skills') "
+            "FROM certificates WHERE json_extract(data, '$.extraction') IS NULL ORDER BY id"
+        )
+        for course, issuer, category, skills in rows:
+            try:
+                skills = json.loads(skills) if skills else []
+            except (TypeError, ValueError):
+                skills = []
+            yield course, issuer, category, skills
+
+    def all_certificates(self):
+        detailed_data = {}
+        for student_id, data in self._connection().execute("SELECT student_id, data FROM certificates ORDER BY id"):
+            detailed_data.setdefault(student_id, []).append(json.loads(data))
+        return detailed_data
+
+    def all_skills(self):
+        skills_data = {}
+        for student_id, skill in self._connection().execute("SELECT student_id, skill FROM skills ORDER BY id"):
+            skills_data.setdefault(student_id, []).append(skill)
+        return skills_data
+
+    def replace_certificates(self, detailed_data):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM certificates")
+            self._insert_certificates(conn, detailed_data)
+            self._touch(conn)
+
+    def replace_skills(self, skills_data):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM skills")
+            self._insert_skills(conn, skills_data)
+            self._touch(conn)
+
+ocr_cache = DiskCache(OCR_CACHE_PATH, OCR_CACHE_MAX_MB * 1024 * 1024, OCR_CACHE_TTL)
+llm_cache = DiskCache(LLM_CACHE_PATH, LLM_CACHE_MAX_MB * 1024 * 1024, LLM_CACHE_TTL)
+_store_opened = time.perf_counter()
+student_store = StudentStore(STUDENT_DB_PATH)
+warmup.update('student_store', 'ready', seconds=round(time.perf_counter() - _store_opened, 3))
+
+def hash_file(filepath):
+    sha256 = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+_gemini_model = None
+_gemini_model_lock = threading.Lock()
+
+def get_gemini_model():
+    """
+    Returns the shared GenerativeModel, created on first use instead of on
+    every call.
+    """
+    global _gemini_model
+    if _gemini_model is None:
+        with _gemini_model_lock:
+            if _gemini_model is None:
+                if GEMINI_API_KEY:
+                    genai.configure(api_key=GEMINI_API_KEY)
+                config = {"temperature": 0.2}
+                # Remove response_mime_type as it's not supported in this version
+                _gemini_model = genai.GenerativeModel(GEMINI_MODEL, generation_config=config)
+    return _gemini_model
+
+def retryable_gemini_errors():
+    """
+    Rate limits, overload and transient server/network errors; anything else
+    (bad request, auth, blocked prompt) fails straight away.
+    """
+    return (
+        google_exceptions.TooManyRequests, google_exceptions.ServiceUnavailable,
+        google_exceptions.InternalServerError, google_exceptions.GatewayTimeout, ConnectionError,
+    )
+
+class GeminiClient:
+    """
+    The one way the server calls Gemini. Every attempt takes a token from a
+    bucket refilled at the API quota and one of `max_concurrency` slots.
+    Interactive callers are served before bulk ones whenever both wait.
+    Retryable errors are retried with exponential backoff and full jitter;
+    a 429 also empties the bucket so other callers slow down too. With
+    `hedge_after`, a call still running after that many seconds is sent a
+    second time if a token is free, and the first answer wins.
+    """
+    PRIORITIES = ('interactive', 'bulk')
+
+    def __init__(self, requests_per_minute, burst, max_concurrency, max_retries,
+                 backoff_base, backoff_max, hedge_after=0):
+        self.rate = requests_per_minute / 60.0
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.refilled_at = time.monotonic()
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.waiting = {priority: 0 for priority in self.PRIORITIES}
+        self.cond = threading.Condition()
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after
+        self.hedge_pool = None
+        if hedge_after > 0:
+            self.hedge_pool = ThreadPoolExecutor(max_workers=4 * max_concurrency, thread_name_prefix='llm-hedge')
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+
+    def _ready(self, priority):
+        if self.in_flight >= self.max_concurrency or (self.rate and self.tokens < 1):
+            return False
+        return priority == 'interactive' or not self.waiting['interactive']
+
+    def acquire(self, priority, block=True):
+        """
+        Takes a token and a slot, waiting for both unless `block` is False.
+        Raises DeadlineExceeded if the request's deadline passes first.
+        """
+        with self.cond:
+            self._refill()
+            if not self._ready(priority):
+                if not block:
+                    return False
+                self.waiting[priority] += 1
+                try:
+                    while True:
+                        self._refill()
+                        if self._ready(priority):
+                            break
+                        timeout = time_left('llm')
+                        if self.rate and self.tokens < 1:
+                            refill = (1 - self.tokens) / self.rate
+                            timeout = refill if timeout is None else min(timeout, refill)
+                        self.cond.wait(timeout)
+                finally:
+                    self.waiting[priority] -= 1
+                    self.cond.notify_all()  # bulk callers may go once no interactive one waits
+            self.tokens -= 1
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self.cond:
+            self.in_flight -= 1
+            self.cond.notify_all()
+
+    def _throttled(self):
+        with self.cond:
+            self._refill()
+            self.tokens = min(self.tokens, 0)
+
+    def _send(self, model, prompt, priority, acquired=False):
+        if not acquired:
+            self.acquire(priority)
+        try:
+            timeout = time_left('llm')
+            if timeout is None:
+                return model.generate_content(prompt)
+            # Abandon the call when the deadline passes instead of holding the worker
+            return model.generate_content(prompt, request_options={'timeout': timeout})
+        finally:
+            self.release()
+
+    def _attempt(self, model, prompt, priority):
+        if not self.hedge_pool:
+            return self._send(model, prompt, priority)
+        # Each call runs with a copy of the caller's context, so it sees the deadline
+        futures = [self.hedge_pool.submit(contextvars.copy_context().run, self._send, model, prompt, priority)]
+        done, _ = wait(futures, timeout=self.hedge_after)
+        if not done and self.acquire(priority, block=False):
+            futures.append(self.hedge_pool.submit(contextvars.copy_context().run, self._send, model, prompt, priority, True))
+            metrics.inc('llm_hedged_calls_total')
+        pending, error = set(futures), None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    def generate(self, model, prompt, priority='interactive'):
+        """
+        Returns model.generate_content(prompt). Raises DeadlineExceeded when
+        the request's deadline passes, and ProcessingError (503) when Gemini
+        still fails after every retry.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self._attempt(model, prompt, priority)
+            except retryable_gemini_errors() as e:
+                metrics.inc('llm_retryable_errors_total', error=type(e).__name__)
+                if isinstance(e, google_exceptions.TooManyRequests):
+                    self._throttled()
+                if attempt == self.max_retries:
+                    raise ProcessingError(f'Gemini API unavailable after {attempt + 1} attempts: {e}', 503)
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                remaining = time_left('llm')
+                if remaining is not None and delay >= remaining:
+                    raise DeadlineExceeded('llm')
+                print(f"Gemini call failed ({type(e).__name__}: {e}), retry {attempt + 1} in {delay:.1f}s")
+                time.sleep(delay)
+
+gemini_client = GeminiClient(GEMINI_RPM / SERVER_WORKERS, max(1, GEMINI_BURST // SERVER_WORKERS),
+                             max(1, GEMINI_MAX_CONCURRENCY // SERVER_WORKERS), GEMINI_MAX_RETRIES,
+                             GEMINI_BACKOFF_BASE, GEMINI_BACKOFF_MAX, GEMINI_HEDGE_AFTER)
+
+def normalize_cache_text(text):
+    return ' '.join(text.split()).casefold()
+
+def llm_cache_key(kind, text):
+    digest = hashlib.sha256(normalize_cache_text(text).encode('utf-8')).hexdigest()
+    return f"{kind}:{GEMINI_MODEL}:{EXTRACTION_PROMPT_VERSION}:{digest}"
+
+def call_gemini_cached(cache_key, prompt):
+    """
+    call_gemini with a persistent response cache. Failed calls (None) are not
+    cached so they get retried next time.
+    """
+    cached = llm_cache.get(cache_key)
+    if cached is not None:
+        print(f"LLM cache hit for {cache_key.split(':')[0]}")
+        return cached
+    result = call_gemini(prompt)
+    if result is not None:
+        llm_cache.set(cache_key, result)
+    return result
 
 def call_gemini(prompt, is_json_output=True):
+    with timed('llm'):
+        return _call_gemini(prompt, is_json_output)
+
+def _call_gemini(prompt, is_json_output=True):
     try:
-        config = {"temperature": 0.2}
-        # Remove response_mime_type as it's not supported in this version
-        model = genai.GenerativeModel("gemini-2.5-flash", generation_config=config)
+        model = get_gemini_model()
         
         # Add explicit JSON request in prompt if needed
         if is_json_output:
             prompt += "\n\nPlease respond with valid JSON only."
         
-        response = model.generate_content(prompt)
+        response = gemini_client.generate(model, prompt, llm_priority.get())
         print(f"Gemini API response: {response.text[:200]}...")  # Debug log
         
         if is_json_output:
@@ -102,282 +1309,2632 @@ def call_gemini(prompt, is_json_output=True):
         print(f"Raw response: {response.text}")
         # Try to find JSON in the response
         try:
-            import re
-            json_match = re.search(r'\{.*\}', response.text, re.DOTALL)
-            if json_match:
-                return json.loads(json_match.group())
-        except:
-            pass
+            import re
+            json_match = re.search(r'\{.*\}', response.text, re.DOTALL)
+            if json_match:
+                return json.loads(json_match.group())
+        except:
+            pass
+        return None
+    except ProcessingError:
+        raise
+    except Exception as e:
+        print(f"Error calling Gemini API: {e}")
+        print(f"Error type: {type(e).__name__}")
+        traceback.print_exc()
+        return None
+
+CERTIFICATE_CATEGORIES = [
+    "Workshop", "Conference", "Hackathon", "Internship", "Course",
+    "Competition", "CommunityService", "Leadership"
+]
+
+# --- Prompt Compaction ---
+OCR_DECORATION = "|~_=*#<>[]{}\\/`^"
+FIELD_HINT_RE = re.compile(
+    r"certif|award|present|recogni|complet|particip|achiev|course|program|workshop|hackathon|intern|"
+    r"conference|competition|winner|volunteer|leader|name|date|issued|dated|signed|director|"
+    r"universit|institut|college|academy|school|foundation|society|council|ltd|inc|pvt|corp",
+    re.IGNORECASE
+)
+
+def clean_ocr_line(line):
+    """Drops tokens with no letters or digits and strips ornaments from the rest."""
+    tokens = []
+    for token in line.split():
+        if token == '&':
+            tokens.append(token)
+            continue
+        token = token.strip(OCR_DECORATION)
+        if any(c.isalnum() for c in token):
+            tokens.append(token)
+    # Tesseract noise on borders comes out as runs of one-letter "words"; a
+    # capitalized word among them means initials, as in "S K R Sharma"
+    if (len(tokens) >= 4 and sum(1 for t in tokens if len(t) == 1) / len(tokens) > 0.5
+            and not any(len(t) >= 3 and t[0].isupper() and t.isalpha() for t in tokens)):
+        return ''
+    line = ' '.join(tokens)
+    return line if sum(1 for c in line if c.isalnum()) >= 2 else ''
+
+def line_priority(index, line):
+    """Higher for lines likely to hold the name, course, issuer or date."""
+    score = 0.0
+    if FIELD_HINT_RE.search(line):
+        score += 2
+    if DATE_CANDIDATE_RE.search(line):
+        score += 2
+    if NAME_RE.match(line):
+        score += 1.5
+    score += sum(1 for c in line if c.isalpha()) / max(len(line), 1)
+    return score - index * 0.01  # the top of a certificate holds its title and issuer
+
+def compact_ocr_text(text, max_tokens=LLM_PROMPT_MAX_TOKENS):
+    """
+    OCR text for the LLM prompt: ornaments and noise lines dropped,
+    whitespace collapsed, repeated lines (borders, footers, page repeats)
+    kept once. Beyond `max_tokens` (~4 characters each) only the highest
+    priority lines are kept, in their original order.
+    """
+    lines, seen = [], set()
+    for line in text.splitlines():
+        line = clean_ocr_line(line)
+        key = line.casefold()
+        if line and key not in seen:
+            seen.add(key)
+            lines.append(line)
+
+    max_chars = max_tokens * 4
+    if sum(len(line) + 1 for line in lines) > max_chars:
+        ranked = sorted(range(len(lines)), key=lambda i: line_priority(i, lines[i]), reverse=True)
+        keep, used = set(), 0
+        for i in ranked:
+            if used + len(lines[i]) + 1 <= max_chars:
+                keep.add(i)
+                used += len(lines[i]) + 1
+        lines = [line for i, line in enumerate(lines) if i in keep]
+    compacted = '\n'.join(lines)
+    metrics.inc('llm_prompt_chars_total', len(text), text='raw')
+    metrics.inc('llm_prompt_chars_total', len(compacted), text='compacted')
+    return compacted
+
+def parse_and_classify_with_gemini(text: str) -> dict:
+    """
+    Uses the Gemini LLM to parse certificate text, classify it AND extract its
+    skills in a single round trip. Responses are cached by the compacted
+    text that goes into the prompt, so identical certificates never hit the
+    API twice and changing the compaction never reuses an older answer.
+    """
+    compacted = compact_ocr_text(text)
+    prompt = f"""
+    Analyze the following text from a certificate. Your task is to perform three actions:
+    1.  **Extract Details:** Identify the full name, course/achievement title, issuing organization, and issue date.
+    2.  **Classify Document:** Classify the document into ONE of the following categories based on its content: {json.dumps(CERTIFICATE_CATEGORIES)}. If it does not fit any of these, classify it as "Others".
+    3.  **Extract Skills:** List the specific skills covered by the course/achievement title.
+
+    Return a single, valid JSON object with keys: "name", "course", "issuer", "date", "category", and "skills".
+    "skills" must be an array of strings. If a detail cannot be found, use the value "Not found".
+
+    Text to analyze:
+    ---
+    {compacted}
+    ---
+    """
+    result = call_gemini_cached(llm_cache_key('extract', compacted), prompt)
+    return dict(result) if isinstance(result, dict) else None
+
+def extract_granular_skills(course_title):
+    prompt = f'Extract the specific skills from this course title: "{course_title}". Return a JSON object with one key, "skills", an array of strings.'
+    result = call_gemini_cached(llm_cache_key('skills', course_title), prompt)
+    return result.get('skills', []) if result else []
+
+# --- Local Extraction Fast Path ---
+NAME_ANCHOR_RE = re.compile(
+    r"(?:certify that|certifies that|presented to|awarded to|granted to|conferred upon|name\s*:)\s*(.*)",
+    re.IGNORECASE
+)
+NAME_TITLE_RE = re.compile(r"^(?:mr|ms|mrs|miss|dr|prof)\.?\s+", re.IGNORECASE)
+NAME_END_RE = re.compile(r"\s+(?:has|have|had|for|who|of|in|on|is|was)\b.*$", re.IGNORECASE)
+NAME_RE = re.compile(r"^[A-Z][A-Za-z.'-]*(?:\s+[A-Z][A-Za-z.'-]*){1,4}$")
+DATE_CANDIDATE_RE = re.compile(
+    r"\b(?:\d{4}[-/.]\d{1,2}[-/.]\d{1,2}|\d{1,2}[-/.]\d{1,2}[-/.]\d{4}"
+    r"|\d{1,2}\s+[A-Za-z]{3,9}\.?,?\s+\d{4}|[A-Za-z]{3,9}\.?\s+\d{1,2},\s*\d{4}|[A-Za-z]{3,9}\s+\d{4})\b"
+)
+DATE_LABEL_RE = re.compile(r"\b(?:date|dated|issued|awarded|completed|on)\b[\s:.-]*$", re.IGNORECASE)
+
+def classifier_tokens(text):
+    words = re.findall(r"[a-z0-9]+", text.casefold())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+class CategoryClassifier:
+    """Multinomial Naive Bayes over the words and word pairs of course + issuer."""
+    def __init__(self, examples):
+        self.class_counts = {}
+        self.token_counts = {}
+        self.token_totals = {}
+        vocabulary = set()
+        for text, category in examples:
+            tokens = classifier_tokens(text)
+            self.class_counts[category] = self.class_counts.get(category, 0) + 1
+            counts = self.token_counts.setdefault(category, {})
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            self.token_totals[category] = self.token_totals.get(category, 0) + len(tokens)
+            vocabulary.update(tokens)
+        self.vocabulary_size = len(vocabulary) + 1
+        self.example_count = sum(self.class_counts.values())
+
+    def predict(self, text):
+        """Returns (category, posterior probability), or (None, 0.0) untrained."""
+        if not self.example_count:
+            return None, 0.0
+        tokens = classifier_tokens(text)
+        scores = {}
+        for category, class_count in self.class_counts.items():
+            counts = self.token_counts[category]
+            denominator = self.token_totals[category] + self.vocabulary_size
+            scores[category] = math.log(class_count / self.example_count) + sum(
+                math.log((counts.get(token, 0) + 1) / denominator) for token in tokens
+            )
+        best = max(scores, key=scores.get)
+        total = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1.0 / total
+
+def known_terms_pattern(terms):
+    if not terms:
+        return None
+    alternatives = '|'.join(re.escape(term) for term in sorted(terms, key=len, reverse=True))
+    return re.compile(rf"(?<!\w)(?:{alternatives})(?!\w)")
+
+class LocalExtractor:
+    """
+    Extracts name, course, issuer, date and category without Gemini for
+    certificates of courses and issuers Gemini has already extracted at least
+    `min_seen` times. Course and issuer are matched against those known
+    titles, the name and date by their usual wording, and the category by a
+    classifier trained on the stored Gemini results. Skills are the ones
+    Gemini gave for the course. Returns None (use Gemini) unless every field
+    is found and the lowest field confidence reaches `threshold`.
+    The model is retrained in the background when the store has changed.
+    """
+    def __init__(self, threshold, min_seen, retrain_seconds):
+        self.threshold = threshold
+        self.min_seen = min_seen
+        self.retrain_seconds = retrain_seconds
+        self.lock = threading.Lock()
+        self.model = None
+        self.trained_version = None
+        self.trained_at = None
+        self.training = False
+
+    def train(self):
+        version = student_store.data_version()
+        courses, issuers, examples = {}, {}, []
+        for course, issuer, category, skills in student_store.gemini_extractions():
+            if not isinstance(course, str) or not isinstance(issuer, str) or not isinstance(category, str):
+                continue
+            if category not in CERTIFICATE_CATEGORIES and category != 'Others':
+                continue
+            examples.append((f"{course} {issuer}", category))
+            course_key, issuer_key = normalize_cache_text(course), normalize_cache_text(issuer)
+            if len(course_key) >= 4 and course_key != 'not found':
+                entry = courses.setdefault(course_key, {'seen': 0, 'course': course, 'skills': [], 'issuers': {}})
+                entry['seen'] += 1
+                entry['course'] = course
+                if isinstance(skills, list) and skills and all(isinstance(s, str) for s in skills):
+                    entry['skills'] = skills
+                entry['issuers'][issuer_key] = entry['issuers'].get(issuer_key, 0) + 1
+            if len(issuer_key) >= 3 and issuer_key != 'not found':
+                entry = issuers.setdefault(issuer_key, {'seen': 0, 'issuer': issuer})
+                entry['seen'] += 1
+                entry['issuer'] = issuer
+        courses = {key: entry for key, entry in courses.items() if entry['seen'] >= self.min_seen and entry['skills']}
+        issuers = {key: entry for key, entry in issuers.items() if entry['seen'] >= self.min_seen}
+        model = {
+            'courses': courses,
+            'issuers': issuers,
+            'course_pattern': known_terms_pattern(courses),
+            'issuer_pattern': known_terms_pattern(issuers),
+            'classifier': CategoryClassifier(examples),
+        }
+        with self.lock:
+            self.model = model
+            self.trained_version = version
+            self.trained_at = time.monotonic()
+        print(f"Local extractor trained on {len(examples)} Gemini results: "
+              f"{len(courses)} known courses, {len(issuers)} known issuers")
+        return model
+
+    def _refresh(self):
+        """Starts a background retrain once `retrain_seconds` have passed since the last one."""
+        with self.lock:
+            if self.training:
+                return
+            if self.trained_at is not None and time.monotonic() - self.trained_at < self.retrain_seconds:
+                return
+            self.training = True
+        threading.Thread(target=self._train_in_background, name='local-extractor-train', daemon=True).start()
+
+    def _train_in_background(self):
+        try:
+            if student_store.data_version() == self.trained_version:
+                self.trained_at = time.monotonic()
+            else:
+                self.train()
+        except Exception as e:
+            print(f"Error training local extractor: {e}")
+            self.trained_at = time.monotonic()  # retry at the next interval, not on every request
+        finally:
+            with self.lock:
+                self.training = False
+
+    @staticmethod
+    def _match_known(pattern, normalized_text):
+        if pattern is None:
+            return []
+        matches = []
+        for match in pattern.findall(normalized_text):
+            if match not in matches:
+                matches.append(match)
+        # Longest first; shorter matches contained in it don't compete
+        matches.sort(key=len, reverse=True)
+        return [match for i, match in enumerate(matches) if not any(match in longer for longer in matches[:i])]
+
+    @staticmethod
+    def _find_name(lines):
+        for i, line in enumerate(lines):
+            match = NAME_ANCHOR_RE.search(line)
+            if not match:
+                continue
+            candidate = match.group(1).strip()
+            if not candidate:
+                candidate = next((line.strip() for line in lines[i + 1:] if line.strip()), '')
+            candidate = NAME_END_RE.sub('', NAME_TITLE_RE.sub('', candidate)).strip(' ,.:;-')
+            if NAME_RE.match(candidate) and len(candidate) <= 60:
+                return candidate, 0.95
+        return None, 0.0
+
+    @staticmethod
+    def _find_date(text):
+        dates, labelled = {}, {}
+        for match in DATE_CANDIDATE_RE.finditer(text):
+            value = match.group(0)
+            parsed = parse_certificate_date(value)
+            if parsed is None:
+                continue
+            dates.setdefault(parsed, value)
+            if DATE_LABEL_RE.search(text[max(0, match.start() - 20):match.start()]):
+                labelled.setdefault(parsed, value)
+        if len(dates) == 1:
+            return next(iter(dates.values())), 1.0
+        if len(labelled) == 1:
+            return next(iter(labelled.values())), 0.95
+        return None, 0.0
+
+    def extract(self, text):
+        """The parsed certificate fields with "skills", or None when not confident."""
+        self._refresh()
+        model = self.model
+        if model is None or not model['courses'] or not model['issuers']:
+            return None
+
+        normalized = normalize_cache_text(text)
+        course_matches = self._match_known(model['course_pattern'], normalized)
+        if not course_matches:
+            return None
+        course = model['courses'][course_matches[0]]
+        course_confidence = 1.0 if len(course_matches) == 1 else 0.8
+
+        issuer_matches = self._match_known(model['issuer_pattern'], normalized)
+        issuer_matches = [key for key in issuer_matches if key not in course_matches[0]] or issuer_matches
+        if not issuer_matches:
+            return None
+        by_course = [key for key in issuer_matches if key in course['issuers']]
+        if by_course:
+            issuer_key, issuer_confidence = by_course[0], 1.0
+        else:
+            issuer_key, issuer_confidence = issuer_matches[0], 0.9 if len(issuer_matches) == 1 else 0.7
+        issuer = model['issuers'][issuer_key]['issuer']
+
+        name, name_confidence = self._find_name(text.splitlines())
+        date, date_confidence = self._find_date(text)
+        category, category_confidence = model['classifier'].predict(f"{course['course']} {issuer}")
+
+        confidence = min(course_confidence, issuer_confidence, name_confidence, date_confidence, category_confidence)
+        if confidence < self.threshold:
+            return None
+        return {
+            'name': name,
+            'course': course['course'],
+            'issuer': issuer,
+            'date': date,
+            'category': category,
+            'skills': list(course['skills']),
+            'extraction': 'local',
+        }
+
+local_extractor = LocalExtractor(LOCAL_EXTRACT_THRESHOLD, LOCAL_EXTRACT_MIN_SEEN, LOCAL_EXTRACT_RETRAIN_SECONDS)
+
+def extract_locally(text):
+    if not LOCAL_EXTRACT_ENABLED:
+        return None
+    try:
+        with timed('local_extract'):
+            parsed_data = local_extractor.extract(text)
+    except Exception as e:
+        print(f"Local extraction failed, using Gemini: {e}")
+        parsed_data = None
+    metrics.inc('local_extraction_total', outcome='hit' if parsed_data else 'miss')
+    return parsed_data
+
+def certificate_fields_found(text):
+    """True when the text already holds a recipient name and a single issue date."""
+    name, _ = LocalExtractor._find_name(text.splitlines())
+    date, _ = LocalExtractor._find_date(text)
+    return name is not None and date is not None
+
+def analyze_certificate_text(text):
+    """
+    Returns the parsed certificate fields with a "skills" list, or None if
+    the LLM call failed. Certificates the local extractor is confident about
+    never reach Gemini. Falls back to a separate skills call only when the
+    combined response has no usable skill list.
+    """
+    parsed_data = extract_locally(text)
+    if parsed_data:
+        return parsed_data
+    parsed_data = parse_and_classify_with_gemini(text)
+    if not parsed_data:
+        return None
+    skills = parsed_data.get('skills')
+    if not isinstance(skills, list) or not all(isinstance(s, str) for s in skills):
+        parsed_data['skills'] = extract_granular_skills(parsed_data.get('course', ''))
+    return parsed_data
+
+class DocumentSource:
+    """
+    A downloaded or uploaded document. Small documents are kept in memory
+    (`data`); larger ones, or any document a tool needs as a file, live in a
+    unique temp file that cleanup() removes. A document revalidated with a
+    304 has neither and is identified by its known `sha256` only.
+    """
+    def __init__(self, filename, data=None, path=None, sha256=None, document_url=None):
+        self.filename = filename
+        self.data = data
+        self.path = path
+        self.document_url = document_url
+        self._sha256 = sha256
+        self._owns_path = path is not None
+
+    @property
+    def is_pdf(self):
+        return self.filename.lower().endswith('.pdf')
+
+    @property
+    def has_content(self):
+        return self.data is not None or self.path is not None
+
+    def open(self):
+        return io.BytesIO(self.data) if self.data is not None else open(self.path, 'rb')
+
+    def sha256(self):
+        if self._sha256 is None:
+            self._sha256 = hashlib.sha256(self.data).hexdigest() if self.data is not None else hash_file(self.path)
+        return self._sha256
+
+    def ensure_path(self):
+        """Returns a file path for tools that need one, writing in-memory data to a unique temp file."""
+        if self.path is None:
+            fd, self.path = tempfile.mkstemp(suffix=os.path.splitext(self.filename)[1])
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self.data)
+            self._owns_path = True
+        return self.path
+
+    def cleanup(self):
+        try:
+            if self._owns_path and self.path and os.path.exists(self.path):
+                os.remove(self.path)
+        except:
+            pass  # Ignore cleanup errors
+
+class UploadRequest(Request):
+    """
+    Keeps uploads of up to UPLOAD_MEMORY_MB in memory instead of spooling them
+    to a temp file. MAX_UPLOAD_MB only applies to the upload endpoint, so
+    chunked uploads are cut off there too; JSON endpoints are not capped.
+    """
+    @property
+    def max_content_length(self):
+        if self.endpoint == 'process_certificate_endpoint':
+            return MAX_UPLOAD_MB * 1024 * 1024
+        return None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= UPLOAD_MEMORY_MB * 1024 * 1024:
+            return io.BytesIO()
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+app.request_class = UploadRequest
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    return jsonify({'error': f'Upload exceeds the {MAX_UPLOAD_MB} MB limit'}), 413
+
+def uploaded_document(file_storage):
+    """A DocumentSource for an uploaded file: in memory when it was received in memory, else a unique temp file."""
+    filename = file_storage.filename or 'document'
+    if isinstance(file_storage.stream, io.BytesIO):
+        return DocumentSource(filename, data=file_storage.stream.getvalue())
+    fd, filepath = tempfile.mkstemp(suffix=os.path.splitext(filename)[1])
+    os.close(fd)
+    file_storage.save(filepath)
+    return DocumentSource(filename, path=filepath)
+
+def _build_http_session():
+    session = requests.Session()
+    retries = Retry(total=2, backoff_factor=0.5, status_forcelist=[502, 503, 504], allowed_methods=['GET'])
+    adapter = HTTPAdapter(pool_connections=DOWNLOAD_POOL_SIZE, pool_maxsize=DOWNLOAD_POOL_SIZE, max_retries=retries)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+# Shared so downloads from the UploadCare CDN reuse pooled keep-alive connections
+http_session = _build_http_session()
+
+def _document_filename(document_url, content_type):
+    parsed_url = urlparse(document_url)
+    original_filename = os.path.basename(parsed_url.path) or "document"
+
+    # Get file extension from content-type if not in filename
+    if '.' not in original_filename:
+        if 'pdf' in content_type:
+            original_filename += '.pdf'
+        elif 'image' in content_type:
+            if 'jpeg' in content_type or 'jpg' in content_type:
+                original_filename += '.jpg'
+            elif 'png' in content_type:
+                original_filename += '.png'
+            else:
+                original_filename += '.jpg'  # default
+    return original_filename
+
+def download_document_from_url(document_url, conditional=True):
+    """
+    Downloads a document with the shared session. Enforces MAX_DOWNLOAD_MB
+    (from Content-Length up front, then while streaming) and keeps documents
+    under SPOOL_MAX_KB in memory, spilling bigger ones to a unique temp file.
+
+    With `conditional`, the ETag/Last-Modified seen last time are sent; on a
+    304 whose OCR text is still cached, no bytes are transferred and the
+    returned DocumentSource only carries the known hash.
+    Raises ProcessingError on failure.
+    """
+    with timed('download'):
+        return _download_document(document_url, conditional)
+
+def _download_document(document_url, conditional):
+    validators_key = f"url:{document_url}"
+    validators = ocr_cache.get(validators_key) if conditional else None
+    headers = {}
+    if validators:
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+
+    max_bytes = MAX_DOWNLOAD_MB * 1024 * 1024
+    try:
+        with http_session.get(document_url, stream=True, timeout=stage_timeout('download', DOWNLOAD_TIMEOUT),
+                              headers=headers) as response:
+            if response.status_code == 304 and validators:
+                document = DocumentSource(validators['filename'], sha256=validators['sha256'], document_url=document_url)
+                if ocr_cache.get(ocr_cache_key(document)) is not None:
+                    print(f"Document not modified since last download: {document_url}")
+                    return document
+                # OCR text was evicted, fetch the bytes again
+                return _download_document(document_url, conditional=False)
+            response.raise_for_status()
+
+            content_length = response.headers.get('content-length')
+            if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+                raise ProcessingError(f'Document exceeds the {MAX_DOWNLOAD_MB} MB download limit', 413)
+
+            filename = _document_filename(document_url, response.headers.get('content-type', ''))
+            with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_KB * 1024) as spool:
+                size = 0
+                sha256 = hashlib.sha256()
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    time_left('download')
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise ProcessingError(f'Document exceeds the {MAX_DOWNLOAD_MB} MB download limit', 413)
+                    sha256.update(chunk)
+                    spool.write(chunk)
+
+                if size <= SPOOL_MAX_KB * 1024:
+                    spool.seek(0)
+                    document = DocumentSource(filename, data=spool.read(), sha256=sha256.hexdigest(), document_url=document_url)
+                else:
+                    fd, path = tempfile.mkstemp(suffix=os.path.splitext(filename)[1])
+                    spool.seek(0)
+                    with os.fdopen(fd, 'wb') as f:
+                        for block in iter(lambda: spool.read(1024 * 1024), b''):
+                            f.write(block)
+                    document = DocumentSource(filename, path=path, sha256=sha256.hexdigest(), document_url=document_url)
+
+            etag = response.headers.get('etag')
+            last_modified = response.headers.get('last-modified')
+            if etag or last_modified:
+                ocr_cache.set(validators_key, {'etag': etag, 'last_modified': last_modified,
+                                               'filename': filename, 'sha256': document.sha256()})
+            return document
+
+    except ProcessingError:
+        raise
+    except Exception as e:
+        print(f"Error downloading document from URL: {e}")
+        traceback.print_exc()
+        time_left('download')  # report a timeout caused by the deadline as such
+        raise ProcessingError(f'Failed to download document from URL: {e}')
+
+class MongoWriter:
+    """
+    Write-behind buffer for MongoDB. Requests only enqueue operations; a
+    background thread groups them per collection and sends them with
+    bulk_write when MONGO_FLUSH_SIZE operations are waiting or
+    MONGO_FLUSH_INTERVAL has passed. Transient errors are retried with
+    exponential backoff. Before the first flush the thread pings the server
+    and ensures the lookup indexes exist.
+    """
+    INDEXES = {
+        'ocroutput': [['student_id'], ['student_id', 'document_url']],
+        'roadmap': [['student_id']],
+    }
+    DUPLICATE_KEY = 11000
+
+    def __init__(self, connect, db_name):
+        # `connect` creates the client; it runs in the writer thread
+        self.connect = connect
+        self.client = None
+        self.db_name = db_name
+        self.buffer = queue.Queue(maxsize=MONGO_BUFFER_MAX)
+        self.ready = False
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='mongo-writer', daemon=True)
+        self._thread.start()
+
+    def enqueue(self, collection_name, operation):
+        try:
+            # Never block the request: when Atlas is down long enough to
+            # fill the buffer, the write is dropped and counted instead
+            self.buffer.put_nowait((collection_name, operation))
+            return True
+        except queue.Full:
+            metrics.inc('mongo_writes_dropped_total', collection=collection_name)
+            print(f"MongoDB write buffer full, dropping write to {collection_name}.")
+            return False
+
+    def pending(self):
+        return self.buffer.qsize()
+
+    def ensure_indexes(self):
+        if self.client is None:
+            self.client = self.connect()
+        self.client.admin.command('ping')
+        print("Successfully connected to MongoDB!")
+        db = self.client[self.db_name]
+        for collection_name, indexes in self.INDEXES.items():
+            for keys in indexes:
+                db[collection_name].create_index([(key, pymongo.ASCENDING) for key in keys])
+        self.ready = True
+        print("MongoDB indexes ensured.")
+
+    def _run(self):
+        warmup.imports_done.wait()
+        delay = 1
+        started = time.perf_counter()
+        warmup.update('mongodb', 'loading', required=False)
+        while not self.ready and not self._stopping:
+            try:
+                self.ensure_indexes()
+                warmup.update('mongodb', 'ready', seconds=round(time.perf_counter() - started, 3))
+            except Exception as e:
+                print(f"Error preparing MongoDB (retrying in {delay}s): {e}")
+                warmup.update('mongodb', 'failed', error=str(e))
+                time.sleep(delay)
+                delay = min(delay * 2, 60)
+
+        while True:
+            batch = self._collect()
+            if batch:
+                self._flush(batch)
+            elif self._stopping:
+                return
+
+    def _collect(self):
+        # Block for the first operation, then gather more until the batch is
+        # full or the flush interval is over
+        batch = []
+        deadline = None
+        while len(batch) < MONGO_FLUSH_SIZE:
+            timeout = MONGO_FLUSH_INTERVAL if deadline is None else deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.buffer.get(timeout=timeout))
+            except queue.Empty:
+                break
+            if deadline is None:
+                deadline = time.time() + MONGO_FLUSH_INTERVAL
+        return batch
+
+    def _flush(self, batch):
+        if self.client is None:
+            print(f"MongoDB never connected, dropping {len(batch)} writes.")
+            return
+        by_collection = {}
+        for collection_name, operation in batch:
+            by_collection.setdefault(collection_name, []).append(operation)
+        for collection_name, operations in by_collection.items():
+            self._bulk_write_with_retry(collection_name, operations)
+
+    def _bulk_write_with_retry(self, collection_name, operations):
+        collection = self.client[self.db_name][collection_name]
+        for attempt in range(MONGO_MAX_RETRIES + 1):
+            try:
+                with timed('mongo_write'):
+                    result = collection.bulk_write(operations, ordered=False)
+                print(f"Flushed {len(operations)} writes to MongoDB '{collection_name}' "
+                      f"({result.inserted_count} inserted, {result.upserted_count} upserted, {result.modified_count} updated).")
+                return True
+            except pymongo.errors.BulkWriteError as e:
+                # Inserts that already landed on an earlier attempt come back as duplicate keys
+                errors = [err for err in e.details.get('writeErrors', []) if err.get('code') != self.DUPLICATE_KEY]
+                if errors:
+                    print(f"MongoDB bulk write to '{collection_name}' had {len(errors)} failed operations: {errors[:3]}")
+                return not errors
+            except (pymongo.errors.AutoReconnect, pymongo.errors.ConnectionFailure, pymongo.errors.NetworkTimeout) as e:
+                if attempt == MONGO_MAX_RETRIES:
+                    print(f"Giving up on {len(operations)} MongoDB writes to '{collection_name}': {e}")
+                    return False
+                backoff = min(2 ** attempt, 30) * (0.5 + random.random() / 2)
+                print(f"Transient MongoDB error, retrying in {backoff:.1f}s: {e}")
+                time.sleep(backoff)
+            except Exception as e:
+                print(f"Error writing to MongoDB '{collection_name}': {e}")
+                traceback.print_exc()
+                return False
+
+    def close(self, timeout=10):
+        """Flushes what is buffered; called at interpreter exit."""
+        self._stopping = True
+        self._thread.join(timeout)
+
+mongo_writer = MongoWriter(connect_mongo, MONGO_DB_NAME) if MONGO_URI else None
+if mongo_writer:
+    atexit.register(mongo_writer.close)
+else:
+    warmup.update('mongodb', 'disabled', required=False)
+
+def save_to_mongodb(data_to_save):
+    """
+    Queues a parsed certificate for the 'ocroutput' collection; the actual
+    insert happens in the MongoDB writer thread.
+    """
+    if not mongo_writer:
+        print("MongoDB client not available. Skipping database save.")
+        return False
+    return mongo_writer.enqueue('ocroutput', pymongo.InsertOne(data_to_save))
+
+def save_many_to_mongodb(documents):
+    """
+    Queues several parsed certificates; they are flushed together with
+    other buffered writes.
+    """
+    if not mongo_writer:
+        print("MongoDB client not available. Skipping database save.")
+        return False
+    return all([mongo_writer.enqueue('ocroutput', pymongo.InsertOne(document)) for document in documents])
+
+# --- Career Matching ---
+# Common abbreviations, applied to single tokens on both the catalog and the
+# student side so either spelling matches
+SKILL_ALIASES = {
+    'js': 'javascript', 'ts': 'typescript', 'py': 'python', 'k8s': 'kubernetes',
+    'ml': 'machine learning', 'dl': 'deep learning', 'ai': 'artificial intelligence',
+    'nlp': 'natural language processing', 'cv': 'computer vision',
+    'db': 'database', 'dbms': 'database management', 'ui': 'user interface', 'ux': 'user experience',
+    'oop': 'object oriented programming', 'dsa': 'data structures algorithms',
+    'reactjs': 'react', 'nodejs': 'node.js', 'node': 'node.js', 'golang': 'go',
+    'postgres': 'postgresql', 'cybersecurity': 'cyber security', 'devsecops': 'devops security',
+}
+SKILL_STOPWORDS = {'and', 'or', 'of', 'for', 'the', 'in', 'to', 'with', 'a', 'an', 'on', 'using', 'e.g', 'etc'}
+
+def skill_tokens(skill):
+    """
+    Normalizes a skill name into a tuple of lowercase tokens, keeping the
+    characters that matter in tech names (C++, C#, .NET, Node.js).
+    """
+    words = re.sub(r'[^a-z0-9+#.]+', ' ', skill.lower()).split()
+    tokens = []
+    for word in words:
+        word = word.strip('.')
+        if not word or word in SKILL_STOPWORDS:
+            continue
+        tokens.extend(SKILL_ALIASES.get(word, word).split())
+    return tuple(dict.fromkeys(tokens))
+
+class CareerMatcher:
+    """
+    Inverted index over the career paths in skills.json, built once at
+    startup. Each catalog skill is indexed by its normalized tokens; a student
+    skill covers a catalog skill when their IDF-weighted token overlap (Dice)
+    reaches MATCH_THRESHOLD, so "Python" covers "Python Programming" but the
+    generic "Design" doesn't cover "Circuit Design". Unknown tokens are
+    snapped to the closest catalog token to absorb typos. Careers are ranked
+    by the share of their skills the student covers; the uncovered ones form
+    the roadmap.
+    """
+    MATCH_THRESHOLD = 0.5
+    FUZZY_CUTOFF = 0.8
+
+    def __init__(self, career_paths):
+        self.careers = []         # [(title, [skill, ...])]
+        self.variant_tokens = []  # per career, per skill: token tuples of the skill and its alternatives
+        self.postings = {}        # token -> {(career_index, skill_index, variant_index), ...}
+        document_frequency = {}
+        for career in career_paths:
+            title = career.get('title', '').strip()
+            skills = [s.strip() for s in career.get('skills', []) if s and s.strip()]
+            if not title or not skills:
+                continue
+            career_index = len(self.careers)
+            self.careers.append((title, skills))
+            variants_per_skill = [self._skill_variants(skill) for skill in skills]
+            self.variant_tokens.append(variants_per_skill)
+            for skill_index, variants in enumerate(variants_per_skill):
+                for variant_index, tokens in enumerate(variants):
+                    for token in tokens:
+                        self.postings.setdefault(token, set()).add((career_index, skill_index, variant_index))
+                for token in set(token for tokens in variants for token in tokens):
+                    document_frequency[token] = document_frequency.get(token, 0) + 1
+
+        total = sum(len(skills) for _, skills in self.careers) or 1
+        self.idf = {token: math.log(1 + total / df) for token, df in document_frequency.items()}
+        self.default_idf = math.log(1 + total)
+        self.variant_weights = [
+            [[self._weight(tokens) for tokens in variants] for variants in variants_per_skill]
+            for variants_per_skill in self.variant_tokens
+        ]
+        # Fuzzy lookups only scan tokens sharing the first character
+        self.vocabulary = {}
+        for token in self.postings:
+            self.vocabulary.setdefault(token[0], []).append(token)
+        self._closest_token = lru_cache(maxsize=10000)(self._find_closest_token)
+
+    @staticmethod
+    def _skill_variants(skill):
+        """
+        Token tuples for a catalog skill plus each alternative it lists, so
+        "TensorFlow/PyTorch" or "Cloud platforms (AWS SageMaker, GCP AI
+        Platform)" can be covered by any one of the named tools.
+        """
+        variants = [skill_tokens(skill)]
+        segments = [s for s in re.split(r'[/,;()]', skill) if s.strip()]
+        if len(segments) > 1:
+            variants.extend(skill_tokens(segment) for segment in segments)
+        return [tokens for tokens in dict.fromkeys(variants) if tokens]
+
+    @classmethod
+    def from_file(cls, path):
+        if not os.path.exists(path):
+            print(f"WARNING: Skills catalog {path} not found. Roadmaps will use generic suggestions.")
+            return cls([])
+        try:
+            with open(path, 'r') as f:
+                career_paths = json.load(f).get('career_paths', [])
+        except (json.JSONDecodeError, AttributeError) as e:
+            print(f"Error loading skills catalog {path}: {e}")
+            career_paths = []
+        matcher = cls(career_paths)
+        print(f"Loaded {len(matcher.careers)} career paths from {path}")
+        return matcher
+
+    def _find_closest_token(self, token):
+        if token in self.postings or len(token) < 5:
+            return token
+        candidates = self.vocabulary.get(token[0], [])
+        matches = difflib.get_close_matches(token, candidates, n=1, cutoff=self.FUZZY_CUTOFF)
+        return matches[0] if matches else token
+
+    def _weight(self, tokens):
+        return sum(self.idf.get(token, self.default_idf) for token in tokens)
+
+    def match(self, skills, top_k=ROADMAP_TOP_K):
+        """
+        Returns up to top_k dicts with career_title, coverage, existing_skills
+        (the student's skills that matched) and missing_skills (catalog order).
+        """
+        covered = {}   # (career_index, skill_index) -> set of student skills
+        for skill in skills:
+            tokens = tuple(dict.fromkeys(self._closest_token(t) for t in skill_tokens(skill)))
+            if not tokens:
+                continue
+            skill_weight = self._weight(tokens)
+            overlaps = {}
+            for token in tokens:
+                for posting in self.postings.get(token, ()):
+                    overlaps[posting] = overlaps.get(posting, 0.0) + self.idf[token]
+            for (career_index, skill_index, variant_index), overlap in overlaps.items():
+                catalog_weight = self.variant_weights[career_index][skill_index][variant_index]
+                if 2 * overlap / (skill_weight + catalog_weight) >= self.MATCH_THRESHOLD:
+                    covered.setdefault((career_index, skill_index), set()).add(skill)
+
+        by_career = {}
+        for (career_index, skill_index), matched_by in covered.items():
+            entry = by_career.setdefault(career_index, {'skills': set(), 'matched_by': set()})
+            entry['skills'].add(skill_index)
+            entry['matched_by'].update(matched_by)
+
+        ranked = sorted(
+            by_career.items(),
+            key=lambda item: (-len(item[1]['skills']) / len(self.careers[item[0]][1]),
+                              -len(item[1]['skills']), self.careers[item[0]][0])
+        )
+        results = []
+        for career_index, entry in ranked[:top_k]:
+            title, career_skills = self.careers[career_index]
+            results.append({
+                'career_title': title,
+                'coverage': round(len(entry['skills']) / len(career_skills), 3),
+                'existing_skills': [s for s in skills if s in entry['matched_by']],
+                'missing_skills': [s for i, s in enumerate(career_skills) if i not in entry['skills']],
+            })
+        return results
+
+_career_matcher = None
+_career_matcher_lock = threading.Lock()
+
+def get_career_matcher():
+    # Loaded by the warm-up thread, or on first use
+    global _career_matcher
+    if _career_matcher is None:
+        with _career_matcher_lock:
+            if _career_matcher is None:
+                _career_matcher = CareerMatcher.from_file(SKILLS_CATALOG_PATH)
+    return _career_matcher
+
+class CohortScorer:
+    """
+    Vectorized version of the career matcher for whole cohorts, with the same
+    coverage rule. Every (student, skill) pair becomes a sparse column of IDF
+    weights over the catalog's token vocabulary, and the catalog becomes
+    sparse matrices (variant x token, skill x variant, career x skill). One
+    product gives each pair's token overlap with every variant; the
+    matcher's Dice threshold is applied per pair, and the covered skills of
+    a student are the union over their pairs. Scoring N students is a few
+    sparse matrix products instead of N x careers Python loops, and careers
+    are ranked as the matcher ranks them. Students are processed in chunks
+    to keep memory flat.
+    """
+    CHUNK_SIZE = 2000
+
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.token_index = {token: i for i, token in enumerate(matcher.postings)}
+        self.skill_names = []       # flat list of catalog skills, grouped by career
+        self.career_offsets = []    # first flat skill index of each career
+        variant_rows, variant_cols, variant_weights = [], [], []
+        skill_rows, skill_cols = [], []
+        career_rows, career_cols = [], []
+        for career_index, variants_per_skill in enumerate(matcher.variant_tokens):
+            self.career_offsets.append(len(self.skill_names))
+            career_skills = matcher.careers[career_index][1]
+            for position, variants in enumerate(variants_per_skill):
+                skill_index = len(self.skill_names)
+                self.skill_names.append(career_skills[position])
+                career_rows.append(career_index)
+                career_cols.append(skill_index)
+                for variant_index, tokens in enumerate(variants):
+                    variant = len(variant_weights)
+                    variant_weights.append(matcher.variant_weights[career_index][position][variant_index])
+                    for token in tokens:
+                        variant_rows.append(variant)
+                        variant_cols.append(self.token_index[token])
+                    skill_rows.append(skill_index)
+                    skill_cols.append(variant)
+
+        self.variant_weights = np.array(variant_weights, dtype=np.float64)
+        self.variant_matrix = sparse.csr_matrix(
+            (np.ones(len(variant_rows)), (variant_rows, variant_cols)),
+            shape=(len(variant_weights), len(self.token_index)))
+        self.skill_matrix = sparse.csr_matrix(
+            (np.ones(len(skill_rows)), (skill_rows, skill_cols)),
+            shape=(len(self.skill_names), len(variant_weights)))
+        self.career_matrix = sparse.csr_matrix(
+            (np.ones(len(career_rows)), (career_rows, career_cols)),
+            shape=(len(self.career_offsets), len(self.skill_names)))
+        self.career_offsets.append(len(self.skill_names))
+        self.career_sizes = np.diff(self.career_offsets).astype(np.float64)
+        # The matcher breaks coverage ties by covered count (the bigger career), then title
+        tie_order = sorted(range(len(matcher.careers)),
+                           key=lambda c: (-len(matcher.careers[c][1]), matcher.careers[c][0]))
+        self.tie_rank = np.empty(len(tie_order), dtype=np.int64)
+        self.tie_rank[tie_order] = np.arange(len(tie_order))
+
+    def _covered_skills(self, skill_lists):
+        """(catalog skills x students) boolean matrix of the skills each student covers."""
+        rows, cols, values = [], [], []
+        pair_weights, pair_students = [], []
+        for column, skills in enumerate(skill_lists):
+            for skill in skills:
+                tokens = tuple(dict.fromkeys(self.matcher._closest_token(t) for t in skill_tokens(skill)))
+                if not tokens:
+                    continue
+                pair = len(pair_weights)
+                pair_weights.append(self.matcher._weight(tokens))
+                pair_students.append(column)
+                for token in tokens:
+                    row = self.token_index.get(token)
+                    if row is not None:
+                        rows.append(row)
+                        cols.append(pair)
+                        values.append(self.matcher.idf[token])
+        pair_count = len(pair_weights)
+        pairs = sparse.csr_matrix((values, (rows, cols)), shape=(len(self.token_index), pair_count))
+
+        # token overlap per (variant, pair) -> matcher's Dice threshold -> union per student
+        overlap = (self.variant_matrix @ pairs).tocoo()
+        dice = 2 * overlap.data / (self.variant_weights[overlap.row] + np.asarray(pair_weights)[overlap.col])
+        keep = dice >= self.matcher.MATCH_THRESHOLD
+        variant_covered = sparse.csr_matrix(
+            (np.ones(int(keep.sum())), (overlap.row[keep], overlap.col[keep])),
+            shape=(len(self.variant_weights), pair_count))
+        pair_owner = sparse.csr_matrix(
+            (np.ones(pair_count), (np.arange(pair_count), pair_students)),
+            shape=(pair_count, len(skill_lists)))
+        return (self.skill_matrix @ variant_covered @ pair_owner) > 0
+
+    def score(self, skills_by_student, top_k=ROADMAP_TOP_K):
+        """
+        Takes {student_id: [skill, ...]} and returns (per-student results,
+        cohort-wide top missing skills). Each student gets the top_k careers
+        with their score and the missing skills of the best one.
+        """
+        results = {}
+        missing_counts = {}
+        if not self.skill_names:
+            return results, []
+        student_ids = list(skills_by_student)
+        for start in range(0, len(student_ids), self.CHUNK_SIZE):
+            chunk_ids = student_ids[start:start + self.CHUNK_SIZE]
+            covered = self._covered_skills([skills_by_student[sid] for sid in chunk_ids]).tocsc()
+            scores = (self.career_matrix @ covered.astype(np.float64)).toarray().T / self.career_sizes
+
+            ranked = np.lexsort((np.broadcast_to(self.tie_rank, scores.shape), -scores), axis=-1)[:, :top_k]
+            for column, student_id in enumerate(chunk_ids):
+                careers = [
+                    {'career_title': self.matcher.careers[c][0], 'match_score': round(float(scores[column, c]), 3)}
+                    for c in ranked[column] if scores[column, c] > 0
+                ]
+                missing = []
+                if careers:
+                    student_covered = set(covered.indices[covered.indptr[column]:covered.indptr[column + 1]])
+                    best = ranked[column][0]
+                    missing = [self.skill_names[i]
+                               for i in range(self.career_offsets[best], self.career_offsets[best + 1])
+                               if i not in student_covered]
+                    for skill in missing:
+                        missing_counts[skill] = missing_counts.get(skill, 0) + 1
+                results[student_id] = {'best_fit_careers': careers, 'missing_skills': missing}
+
+        top_missing = sorted(missing_counts.items(), key=lambda item: (-item[1], item[0]))[:20]
+        return results, [{'skill': skill, 'students': count} for skill, count in top_missing]
+
+_cohort_scorer = None
+_cohort_scorer_lock = threading.Lock()
+
+def get_cohort_scorer():
+    # Built on first use; the matrices aren't needed by the request path
+    global _cohort_scorer
+    if _cohort_scorer is None:
+        with _cohort_scorer_lock:
+            if _cohort_scorer is None:
+                _cohort_scorer = CohortScorer(get_career_matcher())
+    return _cohort_scorer
+
+def score_cohort(student_ids=None, top_k=ROADMAP_TOP_K):
+    """
+    Ranks careers for the given students (all stored students when None)
+    in one vectorized pass.
+    """
+    if student_ids is None:
+        skills_by_student = student_store.all_skills()
+    else:
+        skills_by_student = {student_id: student_store.get_skills(student_id) for student_id in student_ids}
+    start = time.time()
+    results, top_missing = get_cohort_scorer().score(skills_by_student, top_k)
+    return {
+        'generated_date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'student_count': len(results),
+        'elapsed_seconds': round(time.time() - start, 3),
+        'top_missing_skills': top_missing,
+        'students': results
+    }
+
+def generate_roadmap_for_student(student_id, parsed_data, skills):
+    """
+    Generate a learning roadmap from the student's aggregated skills: the
+    best-covered career paths in skills.json, with their missing skills as
+    the sequenced roadmap. Falls back to a generic roadmap when nothing in the
+    catalog matches.
+    """
+    try:
+        category = parsed_data.get('category', 'Others')
+        course = parsed_data.get('course', '')
+        current_skills = skills
+
+        career_roadmaps = [
+            {
+                "career_title": match['career_title'],
+                "match_score": match['coverage'],
+                "existing_skills": [skill.lower() for skill in match['existing_skills']],
+                "sequenced_roadmap": [skill.lower() for skill in match['missing_skills']]
+            }
+            for match in get_career_matcher().match(current_skills)
+        ]
+
+        if not career_roadmaps:
+            # Generic technology roadmap
+            career_roadmaps.append({
+                "career_title": f"{category} Specialist",
+                "existing_skills": [skill.lower() for skill in current_skills[:4]],
+                "sequenced_roadmap": [
+                    f"advanced {course.lower() if course else 'technical'} concepts",
+                    "industry best practices and standards",
+                    "project management and collaboration",
+                    "continuous learning and certification"
+                ]
+            })
+        
+        # Create the roadmap structure matching the specified format
+        roadmap = {
+            'student_id': student_id,
+            'generated_date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'potential_roadmaps': career_roadmaps
+        }
+        
+        return roadmap
+        
+    except Exception as e:
+        print(f"Error generating roadmap: {e}")
+        return None
+
+def save_roadmap_to_mongodb(roadmap_data):
+    """
+    Queues a roadmap for the 'roadmap' collection: an upsert on student_id
+    (served by its index), or a plain insert without a student_id.
+    """
+    if not mongo_writer:
+        print("MongoDB client not available. Skipping roadmap save.")
+        return False
+    student_id = roadmap_data.get('student_id')
+    if student_id:
+        operation = pymongo.ReplaceOne({'student_id': student_id}, roadmap_data, upsert=True)
+    else:
+        operation = pymongo.InsertOne(roadmap_data)
+    return mongo_writer.enqueue('roadmap', operation)
+
+def save_roadmaps_to_mongodb(roadmaps):
+    """
+    Queues several roadmaps (one per student).
+    """
+    return all([save_roadmap_to_mongodb(roadmap_data) for roadmap_data in roadmaps])
+
+# --- Certificate Processing Pipeline ---
+def ocr_cache_key(document):
+    return f"{document.sha256()}:{PDF_OCR_SETTINGS if document.is_pdf else IMAGE_OCR_SETTINGS}"
+
+def extract_text_from_document(document):
+    """
+    Returns the OCR text for a PDF or image document. Results are cached by
+    the SHA-256 of the file contents plus the OCR settings, so re-submitting
+    the same document skips OCR entirely.
+    """
+    cache_key = ocr_cache_key(document)
+    cached = ocr_cache.get(cache_key)
+    if cached is not None:
+        print(f"OCR cache hit for {cache_key[:16]}...")
+        return cached['text']
+
+    if not document.has_content:
+        # Revalidated (304) document whose cached text expired in the meantime
+        refreshed = download_document_from_url(document.document_url, conditional=False)
+        try:
+            return extract_text_from_document(refreshed)
+        finally:
+            refreshed.cleanup()
+
+    with timed('ocr'):
+        extracted_text = run_ocr(document)
+    ocr_cache.set(cache_key, {'text': extracted_text})
+    return extracted_text
+
+# --- Near-Duplicate Detection ---
+class DuplicateCertificate(Exception):
+    """The student already has this certificate; carries the stored result."""
+    def __init__(self, certificate, match, similarity):
+        super().__init__(f'Duplicate certificate ({match} match, similarity {similarity:.2f})')
+        self.certificate = certificate
+        self.match = match
+        self.similarity = similarity
+
+_MINHASH_PRIME = (1 << 31) - 1
+_minhash_rng = np.random.RandomState(20240115)
+_MINHASH_A = _minhash_rng.randint(1, _MINHASH_PRIME, MINHASH_PERMUTATIONS).astype(np.uint64)
+_MINHASH_B = _minhash_rng.randint(0, _MINHASH_PRIME, MINHASH_PERMUTATIONS).astype(np.uint64)
+
+def image_dhash(image):
+    """
+    Difference hash of a PIL image (PHASH_SIZE^2 bits, as hex). Fine enough
+    that certificates sharing a template but naming another course differ;
+    re-encoded, resized or converted copies stay within a few bits.
+    """
+    image.draft('L', (256, 256))  # lets large JPEGs decode at reduced size
+    pixels = np.asarray(image.convert('L').resize((PHASH_SIZE + 1, PHASH_SIZE), Image.LANCZOS), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return f"{int(''.join('1' if bit else '0' for bit in bits), 2):0{PHASH_SIZE * PHASH_SIZE // 4}x}"
+
+def document_phash(document):
+    """
+    Perceptual hash of an image, or of the first image on the first page of
+    a PDF (a scan). None for born-digital PDFs and unreadable documents.
+    """
+    if not document.has_content:
+        return None
+    try:
+        if not document.is_pdf:
+            with open_image(document.open()) as image:
+                return image_dhash(image)
+        with pikepdf.open(document.open()) as pdf:
+            images = pdf.pages[0].images if len(pdf.pages) else {}
+            for name in images:
+                return image_dhash(pikepdf.PdfImage(images[name]).as_pil_image())
+    except Exception as e:
+        print(f"Could not compute perceptual hash: {e}")
+    return None
+
+def text_minhash(text):
+    """
+    MinHash signature (bytes) of the character 5-gram shingles of the
+    normalized text, or None if it has no words. Character shingles keep a
+    few OCR misreads from hiding a re-scan.
+    """
+    normalized = ' '.join(re.findall(r'[a-z0-9]+', text.lower()))
+    if not normalized:
+        return None
+    shingles = {normalized[i:i + 5] for i in range(max(1, len(normalized) - 4))}
+    hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles), dtype=np.uint64, count=len(shingles))
+    permuted = (hashes[:, None] * _MINHASH_A + _MINHASH_B) % _MINHASH_PRIME
+    return permuted.min(axis=0).astype(np.uint32).tobytes()
+
+def minhash_similarity(a, b):
+    return float(np.mean(np.frombuffer(a, dtype=np.uint32) == np.frombuffer(b, dtype=np.uint32)))
+
+CERTIFICATE_ID_RE = re.compile(
+    r"\b(?:certificate|credential|verification|serial|licen[cs]e|reference|registration|enrol?lment|cert)"
+    r"\s*(?:id|no|number|code|#)?\s*[.:#-]?\s*([A-Za-z0-9][A-Za-z0-9-]{4,})",
+    re.IGNORECASE
+)
+VERIFY_URL_ID_RE = re.compile(
+    r"/(?:verify|verification|certificates?|credentials?|accomplishments?|share)/(?:[a-z-]+/)?([A-Za-z0-9-]{6,})",
+    re.IGNORECASE
+)
+
+def certificate_identity(text):
+    """
+    What tells two certificates built from the same template apart: the
+    certificate/credential IDs (labelled, or in a verification URL) and
+    the dates printed on it, as {"ids": [...], "dates": [...]}.
+    """
+    ids = {match.upper() for match in CERTIFICATE_ID_RE.findall(text) + VERIFY_URL_ID_RE.findall(text)
+           if any(c.isdigit() for c in match)}
+    dates = {parse_certificate_date(match.group(0)) for match in DATE_CANDIDATE_RE.finditer(text)}
+    return {'ids': sorted(ids), 'dates': sorted(date.isoformat() for date in dates if date)}
+
+def stored_identity(identity, certificate):
+    # Fingerprints stored before identities were recorded fall back on the parsed date
+    if identity is not None:
+        return identity
+    date = parse_certificate_date(certificate.get('date'))
+    return {'ids': [], 'dates': [date.isoformat()] if date else []}
+
+def same_certificate(a, b):
+    """
+    True when two near-identical texts are the same certificate: they share
+    an ID, or (when either has none) they carry the same dates. Without IDs
+    or dates they can't be told apart from a sibling certificate, so no.
+    """
+    if a['ids'] and b['ids']:
+        return bool(set(a['ids']) & set(b['ids']))
+    return bool(a['dates']) and a['dates'] == b['dates']
+
+def screen_document(document, student_id):
+    """
+    Dedup stage before OCR: compares the file hash and perceptual hash with
+    the student's stored certificates. An identical file raises
+    DuplicateCertificate (unless the caller allowed duplicates). A close
+    image hash is only a candidate, since certificates from one template
+    hash alike; screen_text confirms it by ID or date. Returns the
+    fingerprint dict to keep with the result.
+    """
+    if not DEDUP_ENABLED or not student_id:
+        return None
+    with timed('dedup'):
+        fingerprints = {'sha256': document.sha256(), 'phash': document_phash(document), 'candidates': []}
+        if allow_duplicate.get():
+            return fingerprints
+        for sha256, phash, _, identity, certificate in student_store.get_fingerprints(student_id):
+            if sha256 == fingerprints['sha256']:
+                raise DuplicateCertificate(certificate, 'file', 1.0)
+            if phash and fingerprints['phash']:
+                distance = bin(int(phash, 16) ^ int(fingerprints['phash'], 16)).count('1')
+                if distance <= PHASH_MAX_DISTANCE:
+                    fingerprints['candidates'].append(
+                        (1 - distance / (PHASH_SIZE * PHASH_SIZE), stored_identity(identity, certificate), certificate))
+    return fingerprints
+
+def screen_text(extracted_text, student_id, fingerprints):
+    """
+    Dedup stage before the LLM: compares the MinHash of the OCR text with
+    the student's stored certificates. A near-identical text or image only
+    counts as a duplicate when its certificate IDs or dates match too, so
+    siblings from one template (another course, date or ID) are kept.
+    Raises DuplicateCertificate on a duplicate, otherwise adds the
+    signature and identity to `fingerprints`.
+    """
+    if fingerprints is None:
+        return None
+    with timed('dedup'):
+        fingerprints['minhash'] = text_minhash(extracted_text)
+        fingerprints['identity'] = certificate_identity(extracted_text)
+        if allow_duplicate.get():
+            return fingerprints
+        for similarity, identity, certificate in fingerprints.pop('candidates', None) or []:
+            if same_certificate(fingerprints['identity'], identity):
+                raise DuplicateCertificate(certificate, 'image', similarity)
+        if fingerprints['minhash']:
+            for _, _, minhash, identity, certificate in student_store.get_fingerprints(student_id):
+                if minhash:
+                    similarity = minhash_similarity(minhash, fingerprints['minhash'])
+                    if (similarity >= MINHASH_THRESHOLD
+                            and same_certificate(fingerprints['identity'], stored_identity(identity, certificate))):
+                        raise DuplicateCertificate(certificate, 'text', similarity)
+    return fingerprints
+
+def duplicate_response(duplicate, student_id, document_url=None):
+    metrics.inc('certificate_duplicates_total', match=duplicate.match)
+    print(f"Skipping duplicate certificate for student {student_id}: {duplicate}")
+    response = {
+        'status': 'duplicate',
+        'message': (f'Certificate is already stored for student {student_id}; returning the stored result. '
+                    'Pass allow_duplicate=true to store it again.'),
+        'parsed_data': duplicate.certificate,
+        'duplicate': {'match': duplicate.match, 'similarity': round(duplicate.similarity, 3)},
+    }
+    if document_url:
+        response['document_url'] = document_url
+    return response
+
+# --- OCR Process Pool ---
+class FairOCRScheduler:
+    """
+    Feeds OCR tasks to a fixed-size process pool, taking them round-robin
+    from per-request queues, so a 30-page upload can't starve a 1-page one.
+    At most `processes` tasks are handed to the pool at once; the rest wait
+    here. The pool is created on first use (after any reloader/worker fork).
+    If a pool process dies (OOM kill, tesseract crash) the pool is replaced:
+    only the tasks that were running fail, queued ones run on the new pool.
+
+    The pool is forked rather than spawned: a spawned process would import
+    app.py and start its writer and warm-up threads. The fork waits until
+    the warm-up imports are done, and the tasks only use their own state.
+    """
+    def __init__(self, processes):
+        self.processes = processes
+        self.pool = None
+        self.queues = OrderedDict()  # request key -> deque of (fn, args, future, submitted_at, deadline)
+        self.in_flight = 0
+        self.cond = threading.Condition()
+        self.dispatcher = None
+
+    def submit(self, request_key, fn, *args, deadline=None):
+        future = Future()
+        with self.cond:
+            if self.dispatcher is None:
+                # Forking while another thread is importing could deadlock the children
+                warmup.imports_done.wait()
+                self.pool = ProcessPoolExecutor(max_workers=self.processes)
+                self.dispatcher = threading.Thread(target=self._dispatch, name='ocr-dispatcher', daemon=True)
+                self.dispatcher.start()
+            self.queues.setdefault(request_key, deque()).append((fn, args, future, time.perf_counter(), deadline))
+            self.cond.notify_all()
+        return future
+
+    def map(self, request_key, fn, args_list, deadline=None):
+        """
+        Runs fn over args_list and returns the results in order. When
+        `deadline` passes first, tasks still queued are cancelled, running
+        ones are interrupted in their process, and DeadlineExceeded is raised.
+        """
+        futures = [self.submit(request_key, fn, *args, deadline=deadline) for args in args_list]
+        try:
+            return [future.result(timeout=None if deadline is None else max(0, deadline - time.time()))
+                    for future in futures]
+        except (FutureTimeoutError, OCRDeadlineExceeded):
+            raise DeadlineExceeded('ocr')
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def queued(self):
+        with self.cond:
+            return sum(len(tasks) for tasks in self.queues.values())
+
+    def _dispatch(self):
+        while True:
+            with self.cond:
+                while not self.queues or self.in_flight >= self.processes:
+                    self.cond.wait()
+                # Take one task from the request at the front, then move it to the back
+                request_key, tasks = next(iter(self.queues.items()))
+                fn, args, future, submitted_at, deadline = tasks.popleft()
+                if tasks:
+                    self.queues.move_to_end(request_key)
+                else:
+                    del self.queues[request_key]
+                if not future.set_running_or_notify_cancel():
+                    continue  # the request gave up on it
+                if deadline is not None and time.time() >= deadline:
+                    future.set_exception(OCRDeadlineExceeded('OCR deadline passed while queued'))
+                    continue
+                self.in_flight += 1
+                pool = self.pool
+            started_at = time.perf_counter()
+            metrics.observe('ocr_task_wait_seconds', started_at - submitted_at, task=fn.__name__)
+            try:
+                try:
+                    pool_future = pool.submit(run_ocr_task, deadline, fn, *args)
+                except BrokenProcessPool:
+                    pool = self._replace_broken_pool(pool)
+                    pool_future = pool.submit(run_ocr_task, deadline, fn, *args)
+            except Exception as e:
+                self._task_done(future, error=e)
+                continue
+            pool_future.add_done_callback(
+                lambda f, future=future, task=fn.__name__, started_at=started_at, pool=pool:
+                    self._task_done(future, pool_future=f, task=task, started_at=started_at, pool=pool)
+            )
+
+    def _replace_broken_pool(self, broken):
+        """Swaps in a new pool for `broken` (once, however many tasks notice) and returns the current pool."""
+        with self.cond:
+            if self.pool is broken:
+                print("An OCR pool process died; starting a new OCR pool")
+                metrics.inc('ocr_pool_restarts_total')
+                self.pool = ProcessPoolExecutor(max_workers=self.processes)
+                broken.shutdown(wait=False, cancel_futures=True)
+            return self.pool
+
+    def _task_done(self, future, pool_future=None, error=None, task=None, started_at=None, pool=None):
+        if started_at is not None:
+            metrics.observe('ocr_task_seconds', time.perf_counter() - started_at, task=task)
+        if pool_future is not None:
+            error = pool_future.exception()
+        if isinstance(error, BrokenProcessPool):
+            self._replace_broken_pool(pool)
+            error = ProcessingError('An OCR process crashed while reading this document; retry the request.', 503)
+        with self.cond:
+            self.in_flight -= 1
+            self.cond.notify_all()
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(pool_future.result())
+
+ocr_scheduler = FairOCRScheduler(OCR_PROCESSES)
+
+class OCRDeadlineExceeded(Exception):
+    """Raised inside an OCR pool process when its task's deadline passes."""
+
+# Deadline of the task running in this OCR pool process (None: no deadline)
+_ocr_task_deadline = None
+
+def ocr_task_time_left():
+    """Seconds left for the running OCR task, None without a deadline; raises once it has passed."""
+    if _ocr_task_deadline is None:
+        return None
+    remaining = _ocr_task_deadline - time.time()
+    if remaining <= 0:
+        raise OCRDeadlineExceeded('OCR task interrupted at its deadline')
+    return remaining
+
+# Seconds after the deadline before the timer signal interrupts a task that
+# is still running Python code
+OCR_ALARM_GRACE = 2
+
+def _ocr_deadline_alarm(signum, frame):
+    raise OCRDeadlineExceeded('OCR task interrupted at its deadline')
+
+def run_ocr_task(deadline, fn, *args):
+    """
+    Runs in an OCR pool process: calls fn(*args) with `deadline` as the
+    task's deadline. The OCR functions bound their subprocesses by it:
+    tesseract through pytesseract's own timeout, ocrmypdf through
+    run_in_process_group. Either way the subprocesses are killed, temp files
+    are removed and OCRDeadlineExceeded is raised. A timer signal
+    OCR_ALARM_GRACE seconds later interrupts anything still running in
+    Python (tasks run on the process's main thread). The process stays in the pool.
+    """
+    global _ocr_task_deadline
+    if deadline is None:
+        return fn(*args)
+    _ocr_task_deadline = deadline
+    previous = signal.signal(signal.SIGALRM, _ocr_deadline_alarm)
+    try:
+        signal.setitimer(signal.ITIMER_REAL, ocr_task_time_left() + OCR_ALARM_GRACE)
+        return fn(*args)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+        _ocr_task_deadline = None
+
+def run_in_process_group(fn, *args, **kwargs):
+    """
+    Runs in an OCR pool process: returns fn(*args, **kwargs), computed in a
+    forked child that leads its own process group. Everything the child
+    starts (ocrmypdf's workers, tesseract, ghostscript) stays in that group,
+    so when the task's deadline passes the whole group is killed at once.
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        os.setpgid(0, 0)
+        try:
+            outcome = (True, fn(*args, **kwargs))
+        except BaseException as e:
+            outcome = (False, e)
+        try:
+            payload = pickle.dumps(outcome)
+        except Exception:
+            payload = pickle.dumps((False, RuntimeError(str(outcome[1]))))
+        with os.fdopen(write_fd, 'wb') as f:
+            f.write(payload)
+        os._exit(0)
+
+    os.close(write_fd)
+    try:
+        os.setpgid(pid, pid)  # also set here, in case the child hasn't yet
+    except OSError:
+        pass
+    chunks = []
+    try:
+        while True:
+            ready, _, _ = select.select([read_fd], [], [], ocr_task_time_left())
+            if not ready:
+                continue  # ocr_task_time_left() raises on the next pass
+            chunk = os.read(read_fd, 65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    except BaseException:
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        raise
+    finally:
+        os.close(read_fd)
+        _, status = os.waitpid(pid, 0)
+    if not chunks:
+        raise RuntimeError(f'OCR process exited without a result (status {status})')
+    ok, result = pickle.loads(b''.join(chunks))
+    if not ok:
+        raise result
+    return result
+
+def open_image(source):
+    """
+    Opens an image from bytes, a path or a file object without decoding it,
+    and rejects images above IMAGE_MAX_MEGAPIXELS with a 413.
+    """
+    try:
+        image = Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+    except Image.DecompressionBombError as e:
+        raise ProcessingError(f'Image is too large to process: {e}', 413)
+    width, height = image.size
+    if width * height > IMAGE_MAX_MEGAPIXELS * 1_000_000:
+        image.close()
+        raise ProcessingError(f'Image is {width}x{height}; the limit is {IMAGE_MAX_MEGAPIXELS:g} megapixels', 413)
+    return image
+
+def prepare_ocr_image(image):
+    """
+    Grayscale copy of an image no larger than OCR_IMAGE_MAX_SIDE. JPEGs are
+    decoded in draft mode at the smallest scale that still covers that size,
+    so a 40-megapixel photo is never held in memory at full resolution.
+    """
+    image.draft('L', (OCR_IMAGE_MAX_SIDE, OCR_IMAGE_MAX_SIDE))
+    image = image.convert('L')
+    image.thumbnail((OCR_IMAGE_MAX_SIDE, OCR_IMAGE_MAX_SIDE), Image.LANCZOS)
+    return image
+
+def ocr_image_file(source):
+    """
+    Runs in an OCR pool process on the image's bytes or path. Reads
+    tesseract's word-level results on the downscaled grayscale image and
+    keeps the words with at least OCR_MIN_WORD_CONFIDENCE, one line of text
+    per line tesseract found.
+    """
+    with open_image(source) as image:
+        image = prepare_ocr_image(image)
+    # Tells tesseract the resolution, assuming the image is an A4 page
+    dpi = max(70, round(max(image.size) / 11.7))
+    try:
+        # pytesseract kills tesseract when the timeout expires (0: none)
+        data = pytesseract.image_to_data(image, config=f'--dpi {dpi}', output_type=pytesseract.Output.DICT,
+                                         timeout=ocr_task_time_left() or 0)
+    except RuntimeError as e:
+        if 'timeout' not in str(e):
+            raise
+        raise OCRDeadlineExceeded('OCR task interrupted at its deadline')
+    lines = OrderedDict()
+    for i, word in enumerate(data['text']):
+        word = word.strip()
+        if not word or float(data['conf'][i]) < OCR_MIN_WORD_CONFIDENCE:
+            continue
+        key = (data['page_num'][i], data['block_num'][i], data['par_num'][i], data['line_num'][i])
+        lines.setdefault(key, []).append(word)
+    return '\n'.join(' '.join(words) for words in lines.values())
+
+def ocr_pdf_pages(filepath, pages=None):
+    """
+    Runs in an OCR pool process: OCRs the given zero-based pages (all when
+    None) and returns their text, one form-feed separated chunk per OCRed
+    page. No output PDF is built; only the sidecar text is used.
+    """
+    fd, text_output_path = tempfile.mkstemp(suffix='.txt')
+    os.close(fd)
+    options = {}
+    if pages is not None:
+        options['pages'] = ','.join(str(i + 1) for i in pages)
+    try:
+        run_in_process_group(ocrmypdf.ocr, filepath, os.devnull, output_type='none', deskew=True,
+                             sidecar=text_output_path, progress_bar=False, force_ocr=True,
+                             jobs=OCRMYPDF_JOBS, **options)
+        with open(text_output_path, 'r') as f:
+            return sidecar_page_texts(f.read())
+    finally:
+        if os.path.exists(text_output_path):
+            os.remove(text_output_path)
+
+def sidecar_page_texts(sidecar):
+    # ocrmypdf writes one "[OCR skipped on page(s) a-b]" chunk per run of
+    # skipped pages, so chunks don't line up with page numbers; drop them
+    return '\f'.join(chunk for chunk in sidecar.split('\f') if not chunk.startswith('[OCR skipped on page'))
+
+def ocr_pdf_page(filepath, page):
+    # Runs in an OCR pool process
+    return ocr_pdf_pages(filepath, [page])
+
+def count_pdf_pages(document):
+    try:
+        with pikepdf.open(document.open()) as pdf:
+            return len(pdf.pages)
+    except Exception as e:
+        print(f"Could not count PDF pages: {e}")
+        return None
+
+def run_ocr(document):
+    """
+    Runs OCR on a PDF or image document and returns the extracted text.
+    """
+    if document.is_pdf:
+        return extract_pdf_text(document)
+    time_left('ocr')
+    source = document.data if document.data is not None else document.path
+    open_image(source).close()  # rejects oversized images before they reach the pool
+    return ocr_scheduler.map(uuid.uuid4().hex, ocr_image_file, [(source,)], request_deadline.get())[0]
+
+def is_usable_text_layer(text):
+    """
+    True when an embedded page text looks like real text rather than an
+    empty/scanned page or unmapped glyphs.
+    """
+    compact = ''.join(text.split())
+    if len(compact) < TEXT_LAYER_MIN_CHARS or '(cid:' in text:
+        return False
+    alnum = sum(1 for c in compact if c.isalnum())
+    return alnum / len(compact) >= TEXT_LAYER_MIN_ALNUM_RATIO
+
+def read_pdf_text_layer(document):
+    """
+    Returns the embedded text of the first PDF_OCR_MAX_PAGES pages (all pages
+    when 0), or None if the PDF can't be parsed.
+    """
+    try:
+        with document.open() as f:
+            return [
+                ''.join(element.get_text() for element in page if isinstance(element, pdfminer_layout.LTTextContainer))
+                for page in pdfminer_high_level.extract_pages(f, maxpages=PDF_OCR_MAX_PAGES)
+            ]
+    except Exception as e:
+        print(f"Could not read PDF text layer: {e}")
+        return None
+
+def extract_pdf_text(document):
+    """
+    Uses the embedded text layer for pages that have a usable one and OCRs
+    the rest page by page on the shared OCR pool, so the pages of one round
+    run in parallel. Only the first PDF_OCR_MAX_PAGES pages are OCRed. With
+    PDF_OCR_EARLY_STOP the first page needing OCR runs alone (it usually
+    holds everything) and the remaining rounds are skipped once the text
+    holds the name and date. Falls back to a single OCR task over the first
+    pages when the page count can't be read.
+    """
+    page_texts = read_pdf_text_layer(document) if PDF_TEXT_LAYER else None
+    if page_texts:
+        ocr_pages = [i for i, text in enumerate(page_texts) if not is_usable_text_layer(text)]
+        if not ocr_pages:
+            print(f"Using embedded text layer for all {len(page_texts)} pages, skipping OCR")
+            return '\f'.join(page_texts)
+        print(f"Embedded text usable on {len(page_texts) - len(ocr_pages)}/{len(page_texts)} pages, OCR on the rest")
+    else:
+        page_count = count_pdf_pages(document)
+        if not page_count:
+            pages = list(range(PDF_OCR_MAX_PAGES)) if PDF_OCR_MAX_PAGES else None
+            return ocr_scheduler.map(uuid.uuid4().hex, ocr_pdf_pages, [(document.ensure_path(), pages)],
+                                     request_deadline.get())[0]
+        page_texts = [''] * page_count
+        ocr_pages = list(range(page_count))
+
+    needed = len(ocr_pages)
+    if PDF_OCR_MAX_PAGES:
+        ocr_pages = [page for page in ocr_pages if page < PDF_OCR_MAX_PAGES]
+    request_key = uuid.uuid4().hex
+    done = 0
+    while done < len(ocr_pages):
+        if PDF_OCR_EARLY_STOP and certificate_fields_found('\n'.join(page_texts)):
+            break
+        time_left('ocr')
+        filepath = document.ensure_path()
+        round_size = 1 if PDF_OCR_EARLY_STOP and done == 0 else PDF_OCR_ROUND_PAGES
+        round_pages = ocr_pages[done:done + round_size]
+        ocr_texts = ocr_scheduler.map(request_key, ocr_pdf_page, [(filepath, page) for page in round_pages],
+                                      request_deadline.get())
+        for page, text in zip(round_pages, ocr_texts):
+            page_texts[page] = text
+        done += len(round_pages)
+    if done < needed:
+        print(f"OCRed {done}/{needed} scanned pages, skipped the rest")
+    metrics.inc('pdf_ocr_pages_total', done, outcome='ocr')
+    metrics.inc('pdf_ocr_pages_total', needed - done, outcome='skipped')
+    return '\f'.join(page_texts)
+
+def download_and_extract_text(document_url, student_id=None):
+    """
+    Download + OCR stage: fetches the document, extracts its text and
+    always removes the temporary file. Returns (text, fingerprints).
+    Raises ProcessingError on failure and DuplicateCertificate when the
+    student already has the document.
+    """
+    return ocr_downloaded_document(download_document_from_url(document_url), student_id)
+
+def ocr_downloaded_document(document, student_id=None):
+    """
+    OCR stage for an already downloaded document, whose temp file (if any)
+    is removed afterwards. With a student_id the document is screened for
+    duplicates before OCR and its text before the LLM. Returns (text,
+    fingerprints). Raises ProcessingError when OCR fails or finds no text.
+    """
+    try:
+        fingerprints = screen_document(document, student_id)
+        extracted_text = extract_text_from_document(document)
+    except (ProcessingError, DuplicateCertificate):
+        raise
+    except Exception as e:
+        traceback.print_exc()
+        raise ProcessingError(f'OCR failed: {e}')
+    finally:
+        document.cleanup()
+
+    print(f"=== DEBUG: OCR COMPLETE ===")
+    print(f"Extracted text length: {len(extracted_text)}")
+    print(f"Extracted text preview: {extracted_text[:300]}...")
+
+    if len(extracted_text.strip()) == 0:
+        raise ProcessingError('OCR extracted no text from the document')
+    return extracted_text, screen_text(extracted_text, student_id, fingerprints)
+
+def store_certificate_data(student_id, parsed_data, granular_skills, fingerprints=None):
+    """
+    Appends the parsed certificate to the student store and returns this
+    student's updated (certificates, skills).
+    """
+    with timed('store'):
+        student_store.add_certificate(student_id, parsed_data, granular_skills, fingerprints)
+        return student_store.get_certificates(student_id), student_store.get_skills(student_id)
+
+def analyze_certificate(extracted_text, student_id, document_url):
+    """
+    LLM stage: parses and classifies the OCR text and extracts skills.
+    Returns parsed_data tagged with the student and source URL.
+    """
+    print(f"=== CALLING GEMINI API ===")
+    parsed_data = analyze_certificate_text(extracted_text)
+    print(f"=== GEMINI API RESULT: {parsed_data} ===")
+
+    if not parsed_data:
+        time_left('llm')  # a call cut short by the deadline is a timeout, not a parse failure
+        raise ProcessingError('AI parsing and classification failed. Check server logs for Gemini API details.')
+
+    parsed_data['student_id'] = student_id
+    parsed_data['document_url'] = document_url  # Store original URL
+    return parsed_data
+
+def persist_certificates(certificates, fingerprints=None):
+    """
+    Persistence stage for one or more parsed certificates: one student store
+    transaction per group, with the MongoDB certificate and roadmap writes
+    queued to the write-behind writer. `fingerprints` (one per certificate) are stored
+    for duplicate detection.
+    """
+    if not certificates:
+        return
+
+    # Save COPIES to MongoDB so the originals don't pick up ObjectIds
+    save_many_to_mongodb([parsed_data.copy() for parsed_data in certificates])
+
+    # Save to the local student store
+    with timed('store'):
+        student_store.add_certificates(
+            [(parsed_data['student_id'], parsed_data, parsed_data['skills']) for parsed_data in certificates],
+            fingerprints
+        )
+
+    # Regenerate each student's roadmap from all of their stored skills
+    latest_by_student = {parsed_data['student_id']: parsed_data for parsed_data in certificates}
+
+    roadmaps = {}
+    with timed('roadmap'):
+        for student_id, parsed_data in latest_by_student.items():
+            roadmap_data = generate_roadmap_for_student(student_id, parsed_data, student_store.get_skills(student_id))
+            if roadmap_data:
+                roadmaps[student_id] = roadmap_data
+    if roadmaps:
+        student_store.set_roadmaps(roadmaps)
+        save_roadmaps_to_mongodb(list(roadmaps.values()))
+
+def text_preview(extracted_text):
+    return extracted_text[:200] + '...' if len(extracted_text) > 200 else extracted_text
+
+def certificate_url_response(parsed_data, extracted_text):
+    student_id = parsed_data['student_id']
+    return {
+        'status': 'success',
+        'message': f'Certificate from URL processed, classified, and stored for student {student_id}.',
+        'parsed_data': parsed_data,
+        'document_url': parsed_data['document_url'],
+        'extracted_text_preview': text_preview(extracted_text)
+    }
+
+def analyze_and_store_certificate(extracted_text, student_id, document_url, fingerprints=None):
+    """
+    LLM + persistence stage for a single document. Returns the JSON response
+    body for the URL endpoints.
+    """
+    parsed_data = analyze_certificate(extracted_text, student_id, document_url)
+    persist_certificates([parsed_data], [fingerprints])
+    return certificate_url_response(parsed_data, extracted_text)
+
+def process_certificate_from_url(document_url, student_id):
+    try:
+        extracted_text, fingerprints = download_and_extract_text(document_url, student_id)
+    except DuplicateCertificate as e:
+        return duplicate_response(e, student_id, document_url)
+    return analyze_and_store_certificate(extracted_text, student_id, document_url, fingerprints)
+
+# --- Async Job Queue ---
+ocr_executor = ThreadPoolExecutor(max_workers=OCR_WORKERS, thread_name_prefix='ocr-worker')
+llm_executor = ThreadPoolExecutor(max_workers=LLM_WORKERS, thread_name_prefix='llm-worker')
+job_slots = threading.BoundedSemaphore(JOB_QUEUE_SIZE)
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class JobStore:
+    """
+    Async job records in a SQLite file shared by every gunicorn worker, so
+    a status poll can land on any of them. Each job remembers the pid of the
+    worker running it: a job left unfinished by a worker that exited
+    (recycled or crashed) is reported as failed instead of staying queued.
+    """
+    LOST_ERROR = 'The worker running this job stopped before it finished; submit it again.'
+
+    def __init__(self, path, result_ttl):
+        self.path = path
+        self.result_ttl = result_ttl
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "job_id TEXT PRIMARY KEY, owner_pid INTEGER NOT NULL, "
+                "finished_at REAL, job TEXT NOT NULL)"
+            )
+
+    def _connection(self):
+        return thread_local_connection(self._local, self.path, isolation_level=None)
+
+    def create(self, job):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM jobs WHERE finished_at < ?", (time.time() - self.result_ttl,))
+            conn.execute("INSERT INTO jobs (job_id, owner_pid, job) VALUES (?, ?, ?)",
+                         (job['job_id'], os.getpid(), json.dumps(job)))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def update(self, job_id, **fields):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT job FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row:
+                job = json.loads(row[0])
+                job.update(fields)
+                conn.execute("UPDATE jobs SET job = ?, finished_at = ? WHERE job_id = ?",
+                             (json.dumps(job), job.get('finished_at'), job_id))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get(self, job_id):
+        row = self._connection().execute(
+            "SELECT job, owner_pid, finished_at FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        if not row:
+            return None
+        job, owner_pid, finished_at = json.loads(row[0]), row[1], row[2]
+        if finished_at is None and owner_pid != os.getpid() and not pid_alive(owner_pid):
+            self._mark_lost("job_id = ?", (job_id,))
+            return self.get(job_id)
+        return job
+
+    def abandon_own(self):
+        """Marks this worker's unfinished jobs as failed; runs when the worker exits."""
+        try:
+            self._mark_lost("owner_pid = ?", (os.getpid(),))
+        except sqlite3.Error as e:
+            print(f"Error marking unfinished jobs as failed: {e}")
+
+    def _mark_lost(self, where, params):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            rows = conn.execute(f"SELECT job_id, job FROM jobs WHERE finished_at IS NULL AND {where}", params).fetchall()
+            for job_id, payload in rows:
+                job = json.loads(payload)
+                job.update(status='failed', error=self.LOST_ERROR, error_status=503, finished_at=now)
+                conn.execute("UPDATE jobs SET job = ?, finished_at = ? WHERE job_id = ?", (json.dumps(job), now, job_id))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+job_store = JobStore(JOB_DB_PATH, JOB_RESULT_TTL)
+atexit.register(job_store.abandon_own)
+# Stage timings of the jobs running in this worker, written to the store with each update
+job_timings = {}
+job_timings_lock = threading.Lock()
+
+def _update_job(job_id, **fields):
+    with job_timings_lock:
+        if job_id in job_timings:
+            fields['timings'] = dict(job_timings[job_id])
+    try:
+        job_store.update(job_id, **fields)
+    except sqlite3.Error as e:
+        print(f"Error updating job {job_id}: {e}")
+
+def _finish_job(job_id, result=None, error=None, status_code=None):
+    if error:
+        _update_job(job_id, status='failed', error=error, error_status=status_code or 500, finished_at=time.time())
+    else:
+        _update_job(job_id, status='completed', result=result, finished_at=time.time())
+    with job_timings_lock:
+        job_timings.pop(job_id, None)
+    job_slots.release()
+
+def submit_certificate_job(document_url, student_id, duplicates_allowed=False):
+    """
+    Queues a certificate for background processing. Returns the job id, or
+    None when the queue is full so the caller can answer with 429.
+    """
+    if not job_slots.acquire(blocking=False):
+        return None
+
+    job_id = uuid.uuid4().hex
+    try:
+        job_store.create({
+            'job_id': job_id,
+            'status': 'queued',
+            'student_id': student_id,
+            'document_url': document_url,
+            'created_at': time.time(),
+            'deadline': time.time() + JOB_TIMEOUT,
+            'allow_duplicate': bool(duplicates_allowed),
+        })
+    except sqlite3.Error as e:
+        job_slots.release()
+        raise ProcessingError(f'Could not queue the job: {e}', 503)
+    with job_timings_lock:
+        job_timings[job_id] = {}
+    try:
+        ocr_executor.submit(_run_job_ocr_stage, job_id, document_url, student_id)
+    except Exception as e:
+        _finish_job(job_id, error=f'Failed to schedule job: {e}')
+    return job_id
+
+@contextmanager
+def job_context(job_id):
+    """
+    Runs a job stage under the job's deadline and in the bulk Gemini lane,
+    collecting its stage timings into the job's own record.
+    """
+    job = job_store.get(job_id) or {}
+    with job_timings_lock:
+        timings = job_timings.setdefault(job_id, {})
+    token = request_timings.set(timings)
+    try:
+        with deadline_scope(job.get('deadline')), llm_lane('bulk'), allow_duplicate_scope(job.get('allow_duplicate')):
+            yield
+    finally:
+        request_timings.reset(token)
+
+def _run_job_ocr_stage(job_id, document_url, student_id):
+    _update_job(job_id, status='ocr', started_at=time.time())
+    try:
+        with job_context(job_id):
+            extracted_text, fingerprints = download_and_extract_text(document_url, student_id)
+    except DuplicateCertificate as e:
+        _finish_job(job_id, result=duplicate_response(e, student_id, document_url))
+        return
+    except ProcessingError as e:
+        _finish_job(job_id, error=str(e), status_code=e.status_code)
+        return
+    except Exception as e:
+        traceback.print_exc()
+        _finish_job(job_id, error=f'Processing failed: {str(e)}')
+        return
+
+    _update_job(job_id, status='queued_llm')
+    try:
+        llm_executor.submit(_run_job_llm_stage, job_id, extracted_text, student_id, document_url, fingerprints)
+    except Exception as e:
+        _finish_job(job_id, error=f'Failed to schedule job: {e}')
+
+def _run_job_llm_stage(job_id, extracted_text, student_id, document_url, fingerprints=None):
+    _update_job(job_id, status='analyzing')
+    try:
+        with job_context(job_id):
+            result = analyze_and_store_certificate(extracted_text, student_id, document_url, fingerprints)
+    except ProcessingError as e:
+        _finish_job(job_id, error=str(e), status_code=e.status_code)
+        return
+    except Exception as e:
+        traceback.print_exc()
+        _finish_job(job_id, error=f'Processing failed: {str(e)}')
+        return
+    _finish_job(job_id, result=result)
+
+def get_job(job_id):
+    job = job_store.get(job_id)
+    if job and not job.get('finished_at'):
+        with job_timings_lock:
+            if job_id in job_timings:
+                job['timings'] = dict(job_timings[job_id])
+    return job
+
+# --- Batch Pipeline ---
+download_executor = ThreadPoolExecutor(max_workers=BATCH_DOWNLOAD_WORKERS, thread_name_prefix='download-worker')
+
+class CertificateBatch:
+    """
+    Runs a list of {document_url, student_id} items through overlapping
+    download -> OCR -> LLM stages, each on its own bounded pool, and emits one
+    event per item as it finishes ("processed", not yet stored). Once every
+    item is done, the processed ones are persisted in a single grouped write
+    and a summary event reports what was stored, followed by None.
+    """
+    def __init__(self, items):
+        self.items = items
+        self.events = queue.Queue()
+        self.completed = []
+        self.fingerprints = []
+        self.duplicates = 0
+        self.remaining = len(items)
+        self.lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self._admit, name='certificate-batch', daemon=True).start()
+
+    def _admit(self):
+        # Batch items share the JOB_QUEUE_SIZE slots with async jobs, so a big
+        # batch waits for room instead of flooding the stage pools. Each item
+        # gets REQUEST_TIMEOUT from when it is admitted.
+        for index, item in enumerate(self.items):
+            job_slots.acquire()
+            item['deadline'] = time.time() + REQUEST_TIMEOUT
+            self._submit(download_executor, self._download, index, item)
+
+    def _submit(self, executor, stage, index, item, *args):
+        try:
+            executor.submit(self._run_stage, stage, index, item, *args)
+        except Exception as e:
+            self._finish(index, item, error=f'Failed to schedule batch item: {e}')
+
+    def _run_stage(self, stage, index, item, *args):
+        try:
+            with deadline_scope(item.get('deadline')), llm_lane('bulk'), allow_duplicate_scope(item.get('allow_duplicate')):
+                stage(index, item, *args)
+        except DuplicateCertificate as e:
+            self._finish(index, item, duplicate=e)
+        except ProcessingError as e:
+            self._finish(index, item, error=str(e), status_code=e.status_code)
+        except Exception as e:
+            traceback.print_exc()
+            self._finish(index, item, error=f'Processing failed: {str(e)}')
+
+    def _download(self, index, item):
+        document = download_document_from_url(item['document_url'])
+        self._submit(ocr_executor, self._ocr, index, item, document)
+
+    def _ocr(self, index, item, document):
+        extracted_text, fingerprints = ocr_downloaded_document(document, item['student_id'])
+        self._submit(llm_executor, self._analyze, index, item, extracted_text, fingerprints)
+
+    def _analyze(self, index, item, extracted_text, fingerprints):
+        parsed_data = analyze_certificate(extracted_text, item['student_id'], item['document_url'])
+        self._finish(index, item, parsed_data=parsed_data, extracted_text=extracted_text, fingerprints=fingerprints)
+
+    def _finish(self, index, item, parsed_data=None, extracted_text='', error=None, status_code=500,
+                fingerprints=None, duplicate=None):
+        if duplicate:
+            event = duplicate_response(duplicate, item['student_id'], item['document_url'])
+        elif parsed_data:
+            # Nothing is stored until the whole batch is; the summary reports that
+            event = certificate_url_response(parsed_data, extracted_text)
+            event['status'] = 'processed'
+            event['message'] = (f"Certificate from URL processed and classified for student {item['student_id']}; "
+                                'it is stored with the rest of the batch.')
+        else:
+            event = {'status': 'error', 'error': error, 'error_status': status_code,
+                     'document_url': item['document_url'], 'student_id': item['student_id']}
+        event['index'] = index
+        job_slots.release()
+
+        with self.lock:
+            if parsed_data:
+                self.completed.append(parsed_data)
+                self.fingerprints.append(fingerprints)
+            elif duplicate:
+                self.duplicates += 1
+            self.remaining -= 1
+            done = self.remaining == 0
+        self.events.put(event)
+        if done:
+            self._persist()
+
+    def _persist(self):
+        summary = {'status': 'complete', 'total': len(self.items), 'succeeded': len(self.completed),
+                   'duplicates': self.duplicates,
+                   'failed': len(self.items) - len(self.completed) - self.duplicates}
+        try:
+            persist_certificates(self.completed, self.fingerprints)
+            summary['stored'] = len(self.completed)
+        except Exception as e:
+            traceback.print_exc()
+            summary['stored'] = 0
+            summary['error'] = f'Persisting batch failed: {str(e)}'
+        self.events.put(summary)
+        self.events.put(None)
+
+    def stream(self):
+        while True:
+            event = self.events.get()
+            if event is None:
+                return
+            yield json.dumps(event) + '\n'
+
+class CertificateProgress:
+    """
+    Runs one certificate through the pipeline in a background thread and
+    emits an event as each stage completes: downloaded, ocr_text, parsed,
+    skills and roadmap, then "result" with the usual response body (or
+    "error"), followed by None. The work carries on if the client goes away.
+    """
+    KEEPALIVE_SECONDS = 15
+
+    def __init__(self, document_url, student_id, include_timings=False, duplicates_allowed=False):
+        self.document_url = document_url
+        self.student_id = student_id
+        self.include_timings = include_timings
+        self.duplicates_allowed = duplicates_allowed
+        self.events = queue.Queue()
+
+    def start(self):
+        threading.Thread(target=self._run, name='certificate-progress', daemon=True).start()
+
+    def _emit(self, event, **fields):
+        self.events.put({'event': event, **fields})
+
+    def _run(self):
+        timings = {}
+        request_timings.set(timings)
+        try:
+            with deadline_scope(time.time() + REQUEST_TIMEOUT), allow_duplicate_scope(self.duplicates_allowed):
+                result = self._process()
+            if self.include_timings:
+                result['timings'] = timings
+            self._emit('result', **result)
+        except ProcessingError as e:
+            self._emit('error', error=str(e), error_status=e.status_code)
+        except Exception as e:
+            traceback.print_exc()
+            self._emit('error', error=f'Processing failed: {str(e)}', error_status=500)
+        finally:
+            self.events.put(None)
+
+    def _process(self):
+        document = download_document_from_url(self.document_url)
+        self._emit('downloaded', document_url=self.document_url, is_pdf=document.is_pdf)
+        try:
+            extracted_text, fingerprints = ocr_downloaded_document(document, self.student_id)
+        except DuplicateCertificate as e:
+            return duplicate_response(e, self.student_id, self.document_url)
+        self._emit('ocr_text', characters=len(extracted_text), extracted_text_preview=text_preview(extracted_text))
+
+        parsed_data = analyze_certificate(extracted_text, self.student_id, self.document_url)
+        self._emit('parsed', parsed_data={key: value for key, value in parsed_data.items() if key != 'skills'})
+        self._emit('skills', skills=parsed_data['skills'])
+
+        persist_certificates([parsed_data], [fingerprints])
+        self._emit('roadmap', roadmap=student_store.get_roadmap(self.student_id))
+        return certificate_url_response(parsed_data, extracted_text)
+
+    def stream(self, stream_format):
+        while True:
+            try:
+                event = self.events.get(timeout=self.KEEPALIVE_SECONDS)
+            except queue.Empty:
+                if stream_format == 'sse':
+                    yield ': keep-alive\n\n'  # keeps proxies from closing an idle stream
+                continue
+            if event is None:
+                return
+            if stream_format == 'sse':
+                yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+            else:
+                yield json.dumps(event) + '\n'
+
+def stream_format(data=None):
+    """
+    'ndjson' or 'sse' when the caller asked for a progress stream with
+    "stream" (or ?stream=) or an Accept header, else None.
+    """
+    value = request.args.get('stream')
+    if value is None and data:
+        value = data.get('stream')
+    value = str(value).lower() if value is not None else ''
+    accept = request.headers.get('Accept', '')
+    if value in ('ndjson', 'sse'):
+        return value
+    if value in ('0', 'false', 'no'):
         return None
+    if 'text/event-stream' in accept:
+        return 'sse'
+    if 'application/x-ndjson' in accept or value in ('1', 'true', 'yes'):
+        return 'ndjson'
+    return None
+
+def is_async_request(data=None):
+    value = request.args.get('async')
+    if value is None and data:
+        value = data.get('async')
+    return str(value).lower() in ('1', 'true', 'yes')
+
+def wants_timings(data=None):
+    value = request.args.get('timings')
+    if value is None and data:
+        value = data.get('timings')
+    return str(value).lower() in ('1', 'true', 'yes')
+
+def allows_duplicate(data=None):
+    value = request.args.get('allow_duplicate')
+    if value is None and data:
+        value = data.get('allow_duplicate')
+    return str(value).lower() in ('1', 'true', 'yes')
+
+def run_certificate_request(document_url, student_id, run_async=False, include_timings=False, stream=None,
+                            duplicates_allowed=False):
+    """
+    Shared handler for the URL endpoints: either queues a job (202), streams
+    progress events as NDJSON or SSE (`stream`), or runs the whole pipeline
+    in the request thread. With `include_timings` the response carries the
+    per-stage breakdown under "timings" (jobs always record it). A duplicate
+    returns the stored result unless `duplicates_allowed`.
+    """
+    if run_async:
+        try:
+            job_id = submit_certificate_job(document_url, student_id, duplicates_allowed)
+        except ProcessingError as e:
+            return jsonify({'error': str(e)}), e.status_code
+        if not job_id:
+            response = jsonify({'error': 'Job queue is full, retry later.'})
+            response.headers['Retry-After'] = '5'
+            return response, 429
+        return jsonify({
+            'status': 'accepted',
+            'job_id': job_id,
+            'status_url': f'/jobs/{job_id}'
+        }), 202
+
+    if stream:
+        progress = CertificateProgress(document_url, student_id, include_timings, duplicates_allowed)
+        progress.start()
+        mimetype = 'text/event-stream' if stream == 'sse' else 'application/x-ndjson'
+        response = Response(stream_with_context(progress.stream(stream)), mimetype=mimetype)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'  # don't let nginx hold events back
+        return response
+
+    timings = {}
+    token = request_timings.set(timings)
+    try:
+        with deadline_scope(time.time() + REQUEST_TIMEOUT), allow_duplicate_scope(duplicates_allowed):
+            result = process_certificate_from_url(document_url, student_id)
+        if include_timings:
+            result['timings'] = timings
+        return jsonify(result)
+    except ProcessingError as e:
+        return jsonify({'error': str(e)}), e.status_code
     except Exception as e:
-        print(f"Error calling Gemini API: {e}")
-        print(f"Error type: {type(e).__name__}")
         traceback.print_exc()
+        return jsonify({'error': f'Processing failed: {str(e)}'}), 500
+    finally:
+        request_timings.reset(token)
+
+# --- Student Data Queries ---
+CERTIFICATE_DATE_FORMATS = (
+    '%Y-%m-%d', '%d-%m-%Y', '%d/%m/%Y', '%Y/%m/%d', '%d.%m.%Y',
+    '%B %d, %Y', '%b %d, %Y', '%d %B %Y', '%d %b %Y', '%B %Y', '%b %Y', '%Y',
+)
+
+@lru_cache(maxsize=4096)
+def parse_certificate_date(value):
+    """Best-effort parse of the free-text date Gemini extracted; None if unknown."""
+    if not isinstance(value, str):
         return None
+    value = value.strip().replace('Sept ', 'Sep ')
+    for date_format in CERTIFICATE_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).date()
+        except ValueError:
+            continue
+    return None
 
-def parse_and_classify_with_gemini(text: str) -> dict:
+def parse_student_query(args):
     """
-    Uses the Gemini LLM to parse certificate text AND classify it.
+    Reads the filters and paging of a /get_student_data request. Raises
+    ValueError with a message for the client on bad input.
     """
-    categories = [
-        "Workshop", "Conference", "Hackathon", "Internship", "Course",
-        "Competition", "CommunityService", "Leadership"
-    ]
-    
-    prompt = f"""
-    Analyze the following text from a certificate. Your task is to perform two actions:
-    1.  **Extract Details:** Identify the full name, course/achievement title, issuing organization, and issue date.
-    2.  **Classify Document:** Classify the document into ONE of the following categories based on its content: {json.dumps(categories)}. If it does not fit any of these, classify it as "Others".
+    query = {
+        'student_id': args.get('student_id') or None,
+        'category': (args.get('category') or '').strip().lower() or None,
+        'skill': (args.get('skill') or '').strip().lower() or None,
+        'date_from': None,
+        'date_to': None,
+        'page': None,
+        'page_size': None,
+    }
+    for key in ('date_from', 'date_to'):
+        if args.get(key):
+            try:
+                query[key] = datetime.strptime(args[key], '%Y-%m-%d').date()
+            except ValueError:
+                raise ValueError(f'{key} must be a YYYY-MM-DD date')
+    if args.get('page') or args.get('page_size'):
+        try:
+            query['page'] = int(args.get('page', 1))
+            query['page_size'] = int(args.get('page_size', 50))
+        except ValueError:
+            raise ValueError('page and page_size must be integers')
+        if query['page'] < 1 or not 1 <= query['page_size'] <= READ_PAGE_SIZE_MAX:
+            raise ValueError(f'page must be >= 1 and page_size between 1 and {READ_PAGE_SIZE_MAX}')
+    return query
 
-    Return a single, valid JSON object with keys: "name", "course", "issuer", "date", and "category".
-    If a detail cannot be found, use the value "Not found".
+def filter_certificates(certificates, query):
+    if not query['category'] and not query['date_from'] and not query['date_to']:
+        return certificates
+    matches = []
+    for cert in certificates:
+        if query['category'] and str(cert.get('category', '')).lower() != query['category']:
+            continue
+        if query['date_from'] or query['date_to']:
+            issued = parse_certificate_date(cert.get('date'))
+            if issued is None:
+                continue
+            if query['date_from'] and issued < query['date_from']:
+                continue
+            if query['date_to'] and issued > query['date_to']:
+                continue
+        matches.append(cert)
+    return matches
 
-    Text to analyze:
-    ---
-    {text}
-    ---
+def select_students(certificates_by_student, skills_by_student, query):
+    """
+    Yields (student_id, certificates, skills) for the students matching the
+    query, in student id order. With a certificate filter only the matching
+    certificates are returned and students without any are skipped; the skill
+    filter keeps students that have the skill.
     """
-    return call_gemini(prompt)
+    filters_certificates = query['category'] or query['date_from'] or query['date_to']
+    if query['student_id']:
+        student_ids = [query['student_id']]
+    else:
+        student_ids = sorted(set(certificates_by_student) | set(skills_by_student))
+    for student_id in student_ids:
+        skills = skills_by_student.get(student_id, [])
+        if query['skill'] and query['skill'] not in (skill.lower() for skill in skills):
+            continue
+        certificates = filter_certificates(certificates_by_student.get(student_id, []), query)
+        if filters_certificates and not certificates:
+            continue
+        if student_id not in certificates_by_student and student_id not in skills_by_student:
+            continue
+        yield student_id, certificates, skills
 
-def extract_granular_skills(course_title):
-    prompt = f'Extract the specific skills from this course title: "{course_title}". Return a JSON object with one key, "skills", an array of strings.'
-    result = call_gemini(prompt)
-    return result.get('skills', []) if result else []
+def query_etag(version, query):
+    key = json.dumps({k: str(v) for k, v in query.items() if v is not None}, sort_keys=True)
+    return f"{version}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]}"
 
-def download_document_from_url(document_url):
+def stream_student_data(select):
     """
-    Downloads a document from the given URL and saves it to a temporary file.
-    Returns the file path and original filename.
+    Streams {"detailed_data": ..., "skills_data": ...} a chunk of students at
+    a time. `select` returns a fresh (student_id, certificates, skills)
+    iterator for each of the two objects.
     """
-    try:
-        # Parse URL to get filename
-        parsed_url = urlparse(document_url)
-        original_filename = os.path.basename(parsed_url.path)
-        if not original_filename:
-            original_filename = "document"
-        
-        # Download the file
-        response = requests.get(document_url, stream=True, timeout=30)
-        response.raise_for_status()
-        
-        # Use system temp directory instead of creating our own
-        temp_dir = tempfile.gettempdir()
-        print(f"Using temp directory: {temp_dir}")
-        
-        # Get file extension from content-type if not in filename
-        if '.' not in original_filename:
-            content_type = response.headers.get('content-type', '')
-            if 'pdf' in content_type:
-                original_filename += '.pdf'
-            elif 'image' in content_type:
-                if 'jpeg' in content_type or 'jpg' in content_type:
-                    original_filename += '.jpg'
-                elif 'png' in content_type:
-                    original_filename += '.png'
-                else:
-                    original_filename += '.jpg'  # default
-        
-        temp_filepath = os.path.join(temp_dir, original_filename)
-        
-        # Save the downloaded content
-        with open(temp_filepath, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        
-        return temp_filepath, original_filename
-    
-    except Exception as e:
-        print(f"Error downloading document from URL: {e}")
-        traceback.print_exc()
-        return None, None
+    for opening, index in (('{"detailed_data": {', 1), ('}, "skills_data": {', 2)):
+        yield opening
+        chunk = []
+        first = True
+        for selected in select():
+            chunk.append(f'{json.dumps(selected[0])}: {json.dumps(selected[index])}')
+            if len(chunk) >= STREAM_CHUNK_STUDENTS:
+                yield ('' if first else ', ') + ', '.join(chunk)
+                first = False
+                chunk = []
+        if chunk:
+            yield ('' if first else ', ') + ', '.join(chunk)
+    yield '}}'
 
-def save_to_mongodb(data_to_save):
-    if not mongo_client:
-        print("MongoDB client not available. Skipping database save.")
-        return False
-    try:
-        # --- CHANGE: Point to the 'test' database ---
-        db = mongo_client['test']          
-        collection = db['ocroutput']      # Collection name remains the same
-        collection.insert_one(data_to_save)
-        print("Successfully saved parsed data to MongoDB in 'SIH' database.")
-        return True
-    except Exception as e:
-        print(f"Error saving to MongoDB: {e}")
-        traceback.print_exc()
-        return False
+class ResponseCache:
+    """Small LRU of serialized JSON bodies keyed by ETag."""
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
 
-def generate_roadmap_for_student(student_id, parsed_data, skills):
+    def get(self, key):
+        with self.lock:
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+            return body
+
+    def set(self, key, body):
+        with self.lock:
+            self.entries[key] = body
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+read_cache = ResponseCache(READ_CACHE_ENTRIES)
+
+def conditional_json(etag, build_body):
     """
-    Generate a learning roadmap based on student's current skills and certificate data
+    304 when the client already has `etag`, otherwise the JSON body from the
+    read cache (built and cached on a miss) with the ETag attached.
     """
-    try:
-        category = parsed_data.get('category', 'Others')
-        course = parsed_data.get('course', '')
-        current_skills = skills
-        
-        # Generate career titles based on category and skills
-        career_roadmaps = []
-        
-        if category.lower() in ['course', 'workshop'] and any('security' in skill.lower() or 'ethical' in skill.lower() or 'cyber' in skill.lower() for skill in current_skills):
-            # Cybersecurity focused roadmaps
-            career_roadmaps.extend([
-                {
-                    "career_title": "Cybersecurity Analyst",
-                    "existing_skills": [skill.lower() for skill in current_skills[:4]],
-                    "sequenced_roadmap": [
-                        "network security fundamentals",
-                        "incident response and forensics",
-                        "security information and event management (siem)",
-                        "threat intelligence and analysis"
-                    ]
-                },
-                {
-                    "career_title": "Penetration Tester",
-                    "existing_skills": [skill.lower() for skill in current_skills[:4]],
-                    "sequenced_roadmap": [
-                        "advanced penetration testing methodologies",
-                        "web application security testing",
-                        "network penetration testing",
-                        "mobile application security testing"
-                    ]
-                }
-            ])
-        elif category.lower() in ['course', 'workshop'] and any('web' in skill.lower() or 'development' in skill.lower() or 'programming' in skill.lower() for skill in current_skills):
-            # Web development focused roadmaps
-            career_roadmaps.extend([
-                {
-                    "career_title": "Full Stack Developer",
-                    "existing_skills": [skill.lower() for skill in current_skills[:4]],
-                    "sequenced_roadmap": [
-                        "advanced javascript frameworks (react/vue/angular)",
-                        "backend api development (node.js/python/java)",
-                        "database design and optimization",
-                        "cloud deployment and devops"
-                    ]
-                },
-                {
-                    "career_title": "Frontend Developer",
-                    "existing_skills": [skill.lower() for skill in current_skills[:4]],
-                    "sequenced_roadmap": [
-                        "advanced css and responsive design",
-                        "modern javascript frameworks",
-                        "web performance optimization",
-                        "progressive web applications (pwa)"
-                    ]
-                }
-            ])
-        else:
-            # Generic technology roadmap
-            career_roadmaps.append({
-                "career_title": f"{category} Specialist",
-                "existing_skills": [skill.lower() for skill in current_skills[:4]],
-                "sequenced_roadmap": [
-                    f"advanced {course.lower() if course else 'technical'} concepts",
-                    "industry best practices and standards",
-                    "project management and collaboration",
-                    "continuous learning and certification"
-                ]
-            })
-        
-        # Create the roadmap structure matching the specified format
-        roadmap = {
-            'student_id': student_id,
-            'generated_date': time.strftime('%Y-%m-%d %H:%M:%S'),
-            'potential_roadmaps': career_roadmaps
-        }
-        
-        return roadmap
-        
-    except Exception as e:
-        print(f"Error generating roadmap: {e}")
-        return None
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        body = read_cache.get(etag)
+        if body is None:
+            body = json.dumps(build_body())
+            read_cache.set(etag, body)
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag, weak=True)
+    return response
 
-def save_roadmap_to_mongodb(roadmap_data):
+# --- API Endpoints (remain the same) ---
+@app.route('/get_student_data', methods=['GET'])
+def get_student_data():
     """
-    Save roadmap data to MongoDB 'roadmap' collection in 'SIH' database
+    All students' certificates and skills, or a slice of them:
+    ?student_id=, ?category=, ?skill=, ?date_from=/?date_to= (YYYY-MM-DD) and
+    ?page=/?page_size=. Responses carry an ETag; If-None-Match returns 304.
     """
-    if not mongo_client:
-        print("MongoDB client not available. Skipping roadmap save.")
-        return False
     try:
-        db = mongo_client['test']
-        collection = db['roadmap']
-        
-        # Check if roadmap already exists for this student
-        student_id = roadmap_data.get('student_id')
-        if student_id:
-            # Update existing roadmap or insert new one
-            result = collection.replace_one(
-                {'student_id': student_id}, 
-                roadmap_data, 
-                upsert=True
-            )
-            if result.upserted_id:
-                print(f"Successfully created new roadmap for student {student_id} in MongoDB.")
-            else:
-                print(f"Successfully updated roadmap for student {student_id} in MongoDB.")
+        query = parse_student_query(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if query['student_id']:
+        # One student: indexed reads, versioned by that student only
+        student_id = query['student_id']
+        version = student_store.student_version(student_id)
+        etag = query_etag(f"s{version}", query)
+        def build_student():
+            certificates = student_store.get_certificates(student_id)
+            skills = student_store.get_skills(student_id)
+            selected = list(select_students({student_id: certificates} if certificates else {},
+                                            {student_id: skills} if skills else {}, query))
+            return {'detailed_data': {s: certs for s, certs, _ in selected},
+                    'skills_data': {s: skills for s, _, skills in selected},
+                    'version': version}
+        return conditional_json(etag, build_student)
+
+    version, certificates_by_student, skills_by_student = student_store.snapshot()
+    etag = query_etag(version, query)
+
+    if query['page'] is None:
+        # Whole (filtered) dataset: streamed instead of serialized in one piece
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
         else:
-            collection.insert_one(roadmap_data)
-            print("Successfully saved roadmap to MongoDB.")
-        return True
-    except Exception as e:
-        print(f"Error saving roadmap to MongoDB: {e}")
-        traceback.print_exc()
-        return False
+            select = lambda: select_students(certificates_by_student, skills_by_student, query)
+            response = Response(stream_with_context(stream_student_data(select)), mimetype='application/json')
+        response.set_etag(etag, weak=True)
+        return response
 
-# --- API Endpoints (remain the same) ---
-@app.route('/get_student_data', methods=['GET'])
-def get_student_data():
-    detailed_data = load_json('student_detailed_data.json')
-    skills_data = load_json('student_skills.json')
-    return jsonify({'detailed_data': detailed_data, 'skills_data': skills_data})
+    def build_page():
+        selected = list(select_students(certificates_by_student, skills_by_student, query))
+        start = (query['page'] - 1) * query['page_size']
+        page = selected[start:start + query['page_size']]
+        return {
+            'detailed_data': {student_id: certs for student_id, certs, _ in page},
+            'skills_data': {student_id: skills for student_id, _, skills in page},
+            'total_students': len(selected),
+            'page': query['page'],
+            'page_size': query['page_size'],
+            'has_more': start + query['page_size'] < len(selected),
+        }
+    return conditional_json(etag, build_page)
+
+def merge_patch_operations(patch):
+    """
+    Turns a JSON Merge Patch (RFC 7396) of {"detailed_data": {...},
+    "skills_data": {...}} into store operations: each listed student's list is
+    replaced, and null removes it.
+    """
+    operations = []
+    for key, op, field in (('detailed_data', 'set_certificates', 'certificates'), ('skills_data', 'set_skills', 'skills')):
+        students = patch.get(key) or {}
+        if not isinstance(students, dict):
+            raise ProcessingError(f'"{key}" must be an object keyed by student_id', 400)
+        operations.extend({'op': op, 'student_id': student_id, field: value} for student_id, value in students.items())
+    return operations
 
-@app.route('/update_student_data', methods=['POST'])
+@app.route('/update_student_data', methods=['POST', 'PATCH'])
 def update_student_data():
-    data = request.get_json()
-    if 'detailed_data' in data: save_json(data['detailed_data'], 'student_detailed_data.json')
-    if 'skills_data' in data: save_json(data['skills_data'], 'student_skills.json')
-    return jsonify({'status': 'success', 'message': 'Data files updated.'})
+    """
+    POST replaces the whole dataset. PATCH changes only the students it
+    names, atomically: either {"operations": [...], "expected_versions":
+    {...}} (see StudentStore.apply_patch) or, with Content-Type
+    application/merge-patch+json, a merge patch of detailed_data/skills_data.
+    """
+    data = request.get_json(force=request.method == 'PATCH', silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+
+    if request.method == 'POST':
+        if 'detailed_data' in data: student_store.replace_certificates(data['detailed_data'])
+        if 'skills_data' in data: student_store.replace_skills(data['skills_data'])
+        return jsonify({'status': 'success', 'message': 'Data files updated.'})
+
+    expected_versions = data.pop('expected_versions', None) or {}
+    try:
+        if request.mimetype == 'application/merge-patch+json':
+            operations = merge_patch_operations(data)
+        else:
+            operations = data.get('operations')
+            if not isinstance(operations, list) or not operations:
+                return jsonify({'error': 'Expected a non-empty "operations" list'}), 400
+        if not isinstance(expected_versions, dict):
+            return jsonify({'error': 'expected_versions must map student_id to a version'}), 400
+        versions = student_store.apply_patch(operations, expected_versions)
+    except VersionConflict as e:
+        return jsonify({'error': str(e), 'versions': e.versions}), e.status_code
+    except ProcessingError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    return jsonify({'status': 'success', 'message': f'Updated {len(versions)} students.', 'versions': versions})
 
 @app.route('/get_roadmap/<student_id>', methods=['GET'])
 def get_roadmap(student_id):
-    roadmaps = load_json('roadmaps.json')
-    student_roadmap = roadmaps.get(student_id)
+    etag = f"r{student_store.student_version(student_id)}-{hashlib.sha1(student_id.encode('utf-8')).hexdigest()[:12]}"
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+    student_roadmap = student_store.get_roadmap(student_id)
     if not student_roadmap: return jsonify({'error': 'Roadmap not found.'}), 404
-    return jsonify(student_roadmap)
+    response = jsonify(student_roadmap)
+    response.set_etag(etag, weak=True)
+    return response
 
 # --- Main Processing Endpoint (Updated) ---
 @app.route('/process_certificate', methods=['POST'])
 def process_certificate_endpoint():
+    if request.content_length and request.content_length > MAX_UPLOAD_MB * 1024 * 1024:
+        return upload_too_large(None)
     if 'certificate' not in request.files or 'student_id' not in request.form:
         return jsonify({'error': 'Missing certificate file or student_id'}), 400
     
     cert_file = request.files['certificate']
     student_id = request.form['student_id']
 
-    # 1. OCR - save to temp directory
-    temp_dir = tempfile.gettempdir()
-    filepath = os.path.join(temp_dir, f"{student_id}_{cert_file.filename}")
-    cert_file.save(filepath)
+    # 1. OCR - small uploads stay in memory, larger ones go to a unique temp file
+    document = uploaded_document(cert_file)
+    timings = {}
+    request_timings.set(timings)
+    request_deadline.set(time.time() + REQUEST_TIMEOUT)
+    allow_duplicate.set(allows_duplicate(request.form))
 
     try:
-        if filepath.lower().endswith('.pdf'):
-            text_output_path = filepath + ".txt"
-            ocrmypdf.ocr(filepath, filepath, deskew=True, sidecar=text_output_path, progress_bar=False, force_ocr=True)
-            with open(text_output_path, 'r') as f: extracted_text = f.read()
-            os.remove(text_output_path)
-        else:
-            extracted_text = pytesseract.image_to_string(Image.open(filepath))
+        fingerprints = screen_document(document, student_id)
+        extracted_text = extract_text_from_document(document)
+        fingerprints = screen_text(extracted_text, student_id, fingerprints)
+    except DuplicateCertificate as e:
+        return jsonify(duplicate_response(e, student_id))
+    except ProcessingError as e:
+        return jsonify({'error': str(e)}), e.status_code
     except Exception as e:
         traceback.print_exc(); return jsonify({'error': f'OCR failed: {e}'}), 500
+    finally:
+        document.cleanup()
 
     # 2. AI Parsing and Classification
-    parsed_data = parse_and_classify_with_gemini(extracted_text)
+    try:
+        parsed_data = analyze_certificate_text(extracted_text)
+        if not parsed_data: time_left('llm')
+    except ProcessingError as e:
+        return jsonify({'error': str(e)}), e.status_code
     if not parsed_data: return jsonify({'error': 'AI parsing and classification failed.'}), 500
         
-    granular_skills = extract_granular_skills(parsed_data.get('course', ''))
-    parsed_data['skills'] = granular_skills
+    granular_skills = parsed_data['skills']
     parsed_data['student_id'] = student_id 
 
     # --- FIX: Send a COPY of the data to MongoDB ---
@@ -386,34 +3943,29 @@ def process_certificate_endpoint():
     data_for_mongo = parsed_data.copy()
     save_to_mongodb(data_for_mongo)
 
-    # 4. Save to local JSON files (using the original, clean 'parsed_data')
-    detailed_data = load_json('student_detailed_data.json')
-    student_skills = load_json('student_skills.json')
-    if student_id not in detailed_data: detailed_data[student_id] = []
-    detailed_data[student_id].append(parsed_data)
-    if student_id not in student_skills: student_skills[student_id] = []
-    for skill in granular_skills:
-        if skill.lower() not in [s.lower() for s in student_skills[student_id]]:
-            student_skills[student_id].append(skill)
-    save_json(detailed_data, 'student_detailed_data.json')
-    save_json(student_skills, 'student_skills.json')
+    # 4. Save to the local student store (using the original, clean 'parsed_data')
+    certificates, skills = store_certificate_data(student_id, parsed_data, granular_skills, fingerprints)
     
     # 5. Roadmap Generation Logic (remains the same)
     # ...
 
-    return jsonify({
+    response = {
         'status': 'success',
         'message': f'Certificate processed, classified, and stored for student {student_id}.',
         'parsed_data': parsed_data,
-        'updated_detailed_data': detailed_data,
-        'updated_skills_data': student_skills
-    })
+        'updated_detailed_data': {student_id: certificates},
+        'updated_skills_data': {student_id: skills}
+    }
+    if wants_timings(request.form):
+        response['timings'] = timings
+    return jsonify(response)
 
 # --- New API Endpoint for URL-based Document Processing ---
 @app.route('/process_certificate_url', methods=['POST'])
 def process_certificate_url_endpoint():
     """
-    Process a certificate from a URL with JSON payload containing document_url and student_id
+    Process a certificate from a URL with JSON payload containing document_url and student_id.
+    Pass "async": true (or ?async=1) to queue the work and poll /jobs/<job_id> instead.
     """
     try:
         data = request.get_json()
@@ -438,110 +3990,8 @@ def process_certificate_url_endpoint():
         traceback.print_exc()
         return jsonify({'error': f'Request processing failed: {str(e)}'}), 500
     
-    # 1. Download document from URL
-    temp_filepath, original_filename = download_document_from_url(document_url)
-    if not temp_filepath:
-        return jsonify({'error': 'Failed to download document from URL'}), 500
-    
-    try:
-        # 2. OCR Processing - keep file in temp directory
-        final_filepath = temp_filepath  # Use the temp file directly, no need to move it
-        
-        # Extract text based on file type
-        try:
-            if final_filepath.lower().endswith('.pdf'):
-                text_output_path = final_filepath + ".txt"
-                ocrmypdf.ocr(final_filepath, final_filepath, deskew=True, sidecar=text_output_path, progress_bar=False, force_ocr=True)
-                with open(text_output_path, 'r') as f: 
-                    extracted_text = f.read()
-                os.remove(text_output_path)
-            else:
-                extracted_text = pytesseract.image_to_string(Image.open(final_filepath))
-        except Exception as e:
-            traceback.print_exc()
-            return jsonify({'error': f'OCR failed: {e}'}), 500
-        
-        # 3. AI Parsing and Classification
-        print(f"=== DEBUG: OCR COMPLETE ===")
-        print(f"Extracted text length: {len(extracted_text)}")
-        print(f"Extracted text preview: {extracted_text[:300]}...")
-        print(f"=== CALLING GEMINI API ===")
-        
-        if len(extracted_text.strip()) == 0:
-            return jsonify({'error': 'OCR extracted no text from the document'}), 500
-        
-        parsed_data = parse_and_classify_with_gemini(extracted_text)
-        print(f"=== GEMINI API RESULT: {parsed_data} ===")
-        
-        if not parsed_data:
-            return jsonify({'error': 'AI parsing and classification failed. Check server logs for Gemini API details.'}), 500
-        
-        # 4. Extract granular skills
-        granular_skills = extract_granular_skills(parsed_data.get('course', ''))
-        parsed_data['skills'] = granular_skills
-        parsed_data['student_id'] = student_id
-        parsed_data['document_url'] = document_url  # Store original URL
-        
-        # 5. Save to MongoDB
-        data_for_mongo = parsed_data.copy()
-        save_to_mongodb(data_for_mongo)
-        
-        # 6. Save to local JSON files
-        detailed_data = load_json('student_detailed_data.json')
-        student_skills = load_json('student_skills.json')
-        
-        if student_id not in detailed_data:
-            detailed_data[student_id] = []
-        detailed_data[student_id].append(parsed_data)
-        
-        if student_id not in student_skills:
-            student_skills[student_id] = []
-        
-        for skill in granular_skills:
-            if skill.lower() not in [s.lower() for s in student_skills[student_id]]:
-                student_skills[student_id].append(skill)
-        
-        save_json(detailed_data, 'student_detailed_data.json')
-        save_json(student_skills, 'student_skills.json')
-        
-        # 7. Generate and save roadmap
-        roadmap_data = generate_roadmap_for_student(student_id, parsed_data, granular_skills)
-        if roadmap_data:
-            # Save to local JSON file
-            roadmaps = load_json('roadmaps.json')
-            roadmaps[student_id] = roadmap_data
-            save_json(roadmaps, 'roadmaps.json')
-            
-            # Save to MongoDB roadmap collection
-            save_roadmap_to_mongodb(roadmap_data)
-        
-        # 8. Clean up temporary files
-        try:
-            if os.path.exists(temp_filepath):
-                os.remove(temp_filepath)
-        except:
-            pass  # Ignore cleanup errors
-        
-        return jsonify({
-            'status': 'success',
-            'message': f'Certificate from URL processed, classified, and stored for student {student_id}.',
-            'parsed_data': parsed_data,
-            'document_url': document_url,
-            'extracted_text_preview': extracted_text[:200] + '...' if len(extracted_text) > 200 else extracted_text
-        })
-    
-    except Exception as e:
-        # Clean up on error
-        try:
-            if temp_filepath and os.path.exists(temp_filepath):
-                os.remove(temp_filepath)
-            if 'final_filepath' in locals() and os.path.exists(final_filepath):
-                os.remove(final_filepath)
-        except:
-            pass
-        
-        traceback.print_exc()
-        return jsonify({'error': f'Processing failed: {str(e)}'}), 500
+    return run_certificate_request(document_url, student_id, is_async_request(data), wants_timings(data),
+                                   stream_format(data), allows_duplicate(data))
 
 # --- GET Endpoint for URL-based Document Processing (for easy CMD testing) ---
 @app.route('/process_certificate_get', methods=['GET'])
@@ -555,133 +4005,175 @@ def process_certificate_get_endpoint():
     if not document_url or not student_id:
         return jsonify({'error': 'Missing document_url or student_id parameters'}), 400
     
-    # Call the existing POST endpoint logic
-    try:
-        # Simulate the POST request data
-        fake_request_data = {
-            'document_url': document_url,
-            'student_id': student_id
-        }
-        
-        # Use the same processing logic as the POST endpoint
-        print(f"Processing document from URL: {document_url} for student: {student_id}")
-        
-        # Check if required environment variables are set
-        if not GEMINI_API_KEY:
-            return jsonify({'error': 'GEMINI_API_KEY environment variable not set'}), 500
-        
-        if not MONGO_URI:
-            print("WARNING: MONGO_URI not set, will skip MongoDB storage")
+    print(f"Processing document from URL: {document_url} for student: {student_id}")
     
-        # Download document from URL
-        temp_filepath, original_filename = download_document_from_url(document_url)
-        if not temp_filepath:
-            return jsonify({'error': 'Failed to download document from URL'}), 500
-        
-        try:
-            # OCR Processing - keep file in temp directory
-            final_filepath = temp_filepath  # Use the temp file directly, no need to move it
-            
-            # Extract text based on file type
-            try:
-                if final_filepath.lower().endswith('.pdf'):
-                    text_output_path = final_filepath + ".txt"
-                    ocrmypdf.ocr(final_filepath, final_filepath, deskew=True, sidecar=text_output_path, progress_bar=False, force_ocr=True)
-                    with open(text_output_path, 'r') as f: 
-                        extracted_text = f.read()
-                    os.remove(text_output_path)
-                else:
-                    extracted_text = pytesseract.image_to_string(Image.open(final_filepath))
-            except Exception as e:
-                traceback.print_exc()
-                return jsonify({'error': f'OCR failed: {e}'}), 500
-            
-            # AI Parsing and Classification
-            print(f"=== DEBUG: OCR COMPLETE ===")
-            print(f"Extracted text length: {len(extracted_text)}")
-            print(f"Extracted text preview: {extracted_text[:300]}...")
-            print(f"=== CALLING GEMINI API ===")
-            
-            if len(extracted_text.strip()) == 0:
-                return jsonify({'error': 'OCR extracted no text from the document'}), 500
-            
-            parsed_data = parse_and_classify_with_gemini(extracted_text)
-            print(f"=== GEMINI API RESULT: {parsed_data} ===")
-            
-            if not parsed_data:
-                return jsonify({'error': 'AI parsing and classification failed. Check server logs for Gemini API details.'}), 500
-            
-            # Extract granular skills
-            granular_skills = extract_granular_skills(parsed_data.get('course', ''))
-            parsed_data['skills'] = granular_skills
-            parsed_data['student_id'] = student_id
-            parsed_data['document_url'] = document_url
-            
-            # Save to MongoDB
-            data_for_mongo = parsed_data.copy()
-            save_to_mongodb(data_for_mongo)
-            
-            # Save to local JSON files
-            detailed_data = load_json('student_detailed_data.json')
-            student_skills = load_json('student_skills.json')
-            
-            if student_id not in detailed_data:
-                detailed_data[student_id] = []
-            detailed_data[student_id].append(parsed_data)
-            
-            if student_id not in student_skills:
-                student_skills[student_id] = []
-            
-            for skill in granular_skills:
-                if skill.lower() not in [s.lower() for s in student_skills[student_id]]:
-                    student_skills[student_id].append(skill)
-            
-            save_json(detailed_data, 'student_detailed_data.json')
-            save_json(student_skills, 'student_skills.json')
-            
-            # Generate and save roadmap
-            roadmap_data = generate_roadmap_for_student(student_id, parsed_data, granular_skills)
-            if roadmap_data:
-                # Save to local JSON file
-                roadmaps = load_json('roadmaps.json')
-                roadmaps[student_id] = roadmap_data
-                save_json(roadmaps, 'roadmaps.json')
-                
-                # Save to MongoDB roadmap collection
-                save_roadmap_to_mongodb(roadmap_data)
-            
-            # Clean up temporary files
-            try:
-                if os.path.exists(temp_filepath):
-                    os.remove(temp_filepath)
-            except:
-                pass
-            
-            return jsonify({
-                'status': 'success',
-                'message': f'Certificate from URL processed, classified, and stored for student {student_id}.',
-                'parsed_data': parsed_data,
-                'document_url': document_url,
-                'extracted_text_preview': extracted_text[:200] + '...' if len(extracted_text) > 200 else extracted_text
-            })
-        
-        except Exception as e:
-            # Clean up on error
-            try:
-                if temp_filepath and os.path.exists(temp_filepath):
-                    os.remove(temp_filepath)
-                if 'final_filepath' in locals() and os.path.exists(final_filepath):
-                    os.remove(final_filepath)
-            except:
-                pass
-            
-            traceback.print_exc()
-            return jsonify({'error': f'Processing failed: {str(e)}'}), 500
-            
-    except Exception as e:
-        print(f"Error in initial request processing: {e}")
-        traceback.print_exc()
-        return jsonify({'error': f'Request processing failed: {str(e)}'}), 500
+    # Check if required environment variables are set
+    if not GEMINI_API_KEY:
+        return jsonify({'error': 'GEMINI_API_KEY environment variable not set'}), 500
+    
+    if not MONGO_URI:
+        print("WARNING: MONGO_URI not set, will skip MongoDB storage")
+
+    return run_certificate_request(document_url, student_id, is_async_request(), wants_timings(), stream_format(),
+                                   allows_duplicate())
+
+# --- Batch Endpoint ---
+@app.route('/process_certificates_batch', methods=['POST'])
+def process_certificates_batch_endpoint():
+    """
+    Processes a list of certificates: {"documents": [{"document_url": ..., "student_id": ...}, ...]}.
+    Streams one NDJSON line per document as it finishes (with its "index" in
+    the request), then a final summary line once the batch has been stored.
+    """
+    data = request.get_json(silent=True)
+    items = data.get('documents') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Expected a non-empty "documents" list in JSON payload'}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({'error': f'Batch too large, at most {BATCH_MAX_ITEMS} documents per request'}), 400
+    for item in items:
+        if not isinstance(item, dict) or not item.get('document_url') or not item.get('student_id'):
+            return jsonify({'error': 'Every document needs a document_url and student_id'}), 400
+
+    if not GEMINI_API_KEY:
+        return jsonify({'error': 'GEMINI_API_KEY environment variable not set'}), 500
+
+    print(f"Processing batch of {len(items)} documents")
+    # allow_duplicate can be set per document or for the whole batch
+    allow_all = allows_duplicate(data if isinstance(data, dict) else None)
+    batch = CertificateBatch([
+        {'document_url': item['document_url'], 'student_id': item['student_id'],
+         'allow_duplicate': str(item.get('allow_duplicate', allow_all)).lower() in ('1', 'true', 'yes')}
+        for item in items
+    ])
+    batch.start()
+    return Response(stream_with_context(batch.stream()), mimetype='application/x-ndjson')
+
+# --- Cohort Career Scoring Endpoint ---
+@app.route('/cohort_career_scores', methods=['POST'])
+def cohort_career_scores_endpoint():
+    """
+    Best-fit careers and missing skills for a cohort in one pass.
+    Body: {"student_ids": [...], "top_k": 3}; omit student_ids to score every stored student.
+    """
+    data = request.get_json(silent=True) or {}
+    student_ids = data.get('student_ids')
+    if student_ids is not None and not isinstance(student_ids, list):
+        return jsonify({'error': 'student_ids must be a list'}), 400
+    try:
+        top_k = int(data.get('top_k', ROADMAP_TOP_K))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'top_k must be an integer'}), 400
+    if top_k < 1:
+        return jsonify({'error': 'top_k must be at least 1'}), 400
+    return jsonify(score_cohort(student_ids, top_k))
+
+# --- Skill Aggregates Endpoint ---
+@app.route('/skill_aggregates', methods=['GET', 'POST'])
+def skill_aggregates_endpoint():
+    """
+    Skill, category and issuer distributions and totals, read from counters
+    maintained on every write. GET ?top=20 covers everyone; POST
+    {"student_ids": [...], "top": 20} covers a department or other cohort
+    and adds per-student certificate and skill totals.
+    """
+    data = {}
+    student_ids = None
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        student_ids = data.get('student_ids')
+        if not isinstance(student_ids, list):
+            return jsonify({'error': 'student_ids must be a list'}), 400
+    try:
+        top = int(data.get('top', request.args.get('top', 20)))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'top must be an integer'}), 400
+    if top < 1:
+        return jsonify({'error': 'top must be at least 1'}), 400
+
+    if student_ids is not None:
+        return jsonify(student_store.aggregates(top, student_ids))
+    etag = query_etag(student_store.data_version(), {'aggregates': True, 'top': top})
+    return conditional_json(etag, lambda: student_store.aggregates(top))
+
+# --- Job Status Endpoint ---
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    job = get_job(job_id)
+    if not job: return jsonify({'error': 'Job not found.'}), 404
+    return jsonify(job)
+
+# --- Metrics Endpoint ---
+def _cache_counters(attr):
+    return {(('cache', 'ocr'),): getattr(ocr_cache, attr), (('cache', 'llm'),): getattr(llm_cache, attr)}
+
+def _active_jobs():
+    with job_timings_lock:
+        return len(job_timings)
+
+metrics.register('job_queue_depth', 'gauge', 'Async certificate jobs queued or running.', _active_jobs)
+metrics.register('ocr_tasks_queued', 'gauge', 'OCR tasks waiting for a pool process.', ocr_scheduler.queued)
+metrics.register('ocr_tasks_in_flight', 'gauge', 'OCR tasks running in the pool.', lambda: ocr_scheduler.in_flight)
+metrics.register('mongo_writes_pending', 'gauge', 'MongoDB writes buffered for the next bulk flush.',
+                 lambda: mongo_writer.pending() if mongo_writer else 0)
+metrics.register('llm_calls_waiting', 'gauge', 'Gemini calls waiting for quota, by lane.',
+                 lambda: {(('priority', priority),): count for priority, count in gemini_client.waiting.items()})
+metrics.register('llm_calls_in_flight', 'gauge', 'Gemini calls running.', lambda: gemini_client.in_flight)
+metrics.register('cache_hits_total', 'counter', 'OCR and LLM cache hits.', lambda: _cache_counters('hits'))
+metrics.register('cache_misses_total', 'counter', 'OCR and LLM cache misses.', lambda: _cache_counters('misses'))
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# --- Warm-up and Health Endpoints ---
+def _load_ocr():
+    for module in (Image, pytesseract, ocrmypdf, pikepdf, pdfminer_high_level, pdfminer_layout):
+        module.load()
+    pytesseract.get_tesseract_version()  # fails early if the tesseract binary is missing
+
+def _warm_up():
+    """
+    Loads the heavy dependencies after startup. Imports come first and in
+    this thread only; the OCR pool and the MongoDB writer wait for them.
+    """
+    try:
+        warmup.run('ocr', _load_ocr)
+        if GEMINI_API_KEY:
+            warmup.run('gemini', lambda: (google_exceptions.load(), get_gemini_model()))
+        if MONGO_URI:
+            pymongo.load()
+        warmup.run('skills_catalog', get_career_matcher)
+    finally:
+        warmup.imports_done.set()
+    warmup.run('local_extractor', local_extractor.train)
+
+for _name, _required in (('ocr', True), ('gemini', True), ('skills_catalog', True), ('local_extractor', False)):
+    warmup.update(_name, 'pending', required=_required)
+if not GEMINI_API_KEY:
+    warmup.update('gemini', 'disabled')
+threading.Thread(target=_warm_up, name='warm-up', daemon=True).start()
+
+startup_seconds = round(time.perf_counter() - _import_started, 3)
+metrics.register('startup_seconds', 'gauge', 'Time to import the app, before the warm-up.', lambda: startup_seconds)
+print(f"App imported in {startup_seconds}s; dependencies are warming up in the background.")
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: the process is up and serving requests."""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: 200 once every required dependency has warmed up, else 503."""
+    dependencies = warmup.snapshot()
+    ready = all(state['status'] in ('ready', 'disabled') for state in dependencies.values() if state['required'])
+    failed = any(state['required'] and state['status'] == 'failed' for state in dependencies.values())
+    return jsonify({
+        'status': 'ready' if ready else 'failed' if failed else 'starting',
+        'startup_seconds': startup_seconds,
+        'dependencies': dependencies,
+    }), 200 if ready else 503
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5003, debug=True)
@@ -0,0 +1,527 @@
+"""
+Offline throughput benchmark for the certificate pipeline.
+
+Generates synthetic certificates (PNG images, scanned and born-digital PDFs,
+single and multi-page), serves them from a local HTTP server and sends them
+through the real endpoints and the real OCR path. Gemini and MongoDB are
+replaced by deterministic local stand-ins with a configurable latency, and
+the student store and caches live in a temporary directory, so no API key,
+Atlas cluster or existing data is touched.
+
+Usage:
+    python3 benchmark.py --output bench_results.json
+    python3 benchmark.py --concurrency 1,4,8 --requests 40 --endpoints url,batch
+    python3 benchmark.py --baseline bench_main.json --output bench_branch.json
+
+Every document carries a unique serial number, so neither the OCR cache nor
+the LLM cache can hide the work. Reports p50/p95/p99 latency and docs/sec per
+endpoint and per stage for each concurrency level.
+
+Cold start is measured first: the server is started --startup-runs times in
+a fresh process, timing how long until /healthz answers (live) and until
+/readyz reports every dependency warmed up (ready).
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import requests
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+KINDS = ['image', 'scanned_pdf', 'scanned_multipage_pdf', 'born_digital_pdf', 'born_digital_multipage_pdf']
+ENDPOINTS = ['upload', 'url', 'batch']
+COURSES = [
+    ('Python Programming', 'Coursera', 'Course'),
+    ('Machine Learning Foundations', 'NPTEL', 'Course'),
+    ('Full Stack Web Development', 'Udemy', 'Workshop'),
+    ('Smart India Hackathon', 'AICTE', 'Hackathon'),
+    ('Cloud Computing Internship', 'Infosys', 'Internship'),
+    ('Data Structures and Algorithms', 'GeeksforGeeks', 'Competition'),
+]
+SKILLS = {
+    'Python Programming': ['Python', 'Programming'],
+    'Machine Learning Foundations': ['Machine Learning', 'Python', 'Statistics'],
+    'Full Stack Web Development': ['HTML', 'CSS', 'JavaScript', 'React', 'Node.js'],
+    'Smart India Hackathon': ['Problem Solving', 'Teamwork'],
+    'Cloud Computing Internship': ['AWS', 'Cloud Computing', 'Linux'],
+    'Data Structures and Algorithms': ['Data Structures', 'Algorithms', 'C++'],
+}
+
+
+# --- Synthetic documents ---
+def certificate_lines(serial, page=0):
+    course, issuer, _ = COURSES[serial % len(COURSES)]
+    lines = [
+        'CERTIFICATE OF COMPLETION',
+        'This is to certify that',
+        f'Student Number {serial:06d}',
+        'has successfully completed',
+        course,
+        f'Issued by {issuer}',
+        f'Date 2024-{serial % 12 + 1:02d}-15',
+        f'Certificate ID BENCH-{serial:06d}-{page + 1}',
+    ]
+    if page:
+        lines[0] = f'CERTIFICATE OF COMPLETION - PAGE {page + 1}'
+    return lines
+
+
+def load_font(size):
+    for name in ('DejaVuSans.ttf', 'LiberationSans-Regular.ttf', 'Arial.ttf'):
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        return ImageFont.load_default()
+
+
+def render_page(lines, scanned):
+    image = Image.new('L', (1654, 1169), 255)
+    draw = ImageDraw.Draw(image)
+    font = load_font(44)
+    y = 160
+    for line in lines:
+        draw.text((160, y), line, fill=0, font=font)
+        y += 110
+    if scanned:
+        # Slight skew, blur and noise, like a phone scan
+        image = image.rotate(0.7, fillcolor=255, expand=False).filter(ImageFilter.GaussianBlur(0.8))
+        noise = Image.effect_noise(image.size, 24)
+        image = Image.blend(image, noise, 0.08)
+    return image
+
+
+def text_pdf(pages):
+    """Builds a minimal born-digital PDF with one Helvetica text block per page."""
+    objects = ['<< /Type /Catalog /Pages 2 0 R >>', None, '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>']
+    page_refs = []
+    for lines in pages:
+        commands = ['BT', '/F1 18 Tf', '24 TL', '72 520 Td']
+        for line in lines:
+            escaped = line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+            commands.append(f'({escaped}) Tj T*')
+        commands.append('ET')
+        stream = '\n'.join(commands)
+        objects.append(f'<< /Length {len(stream)} >>\nstream\n{stream}\nendstream')
+        content_ref = len(objects)
+        objects.append(f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 842 595] '
+                       f'/Resources << /Font << /F1 3 0 R >> >> /Contents {content_ref} 0 R >>')
+        page_refs.append(f'{len(objects)} 0 R')
+    objects[1] = f'<< /Type /Pages /Kids [{" ".join(page_refs)}] /Count {len(page_refs)} >>'
+
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f'{number} 0 obj\n{body}\nendobj\n'.encode('latin-1')
+    xref = len(out)
+    out += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode('latin-1')
+    for offset in offsets:
+        out += f'{offset:010d} 00000 n \n'.encode('latin-1')
+    out += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode('latin-1')
+    return bytes(out)
+
+
+def generate_document(directory, kind, serial, pages):
+    """Writes one synthetic certificate and returns its file name."""
+    page_count = pages if 'multipage' in kind else 1
+    page_lines = [certificate_lines(serial, page) for page in range(page_count)]
+    if kind == 'image':
+        filename = f'cert_{serial:06d}.png'
+        render_page(page_lines[0], scanned=True).save(os.path.join(directory, filename))
+    elif kind.startswith('scanned'):
+        filename = f'cert_{serial:06d}.pdf'
+        images = [render_page(lines, scanned=True) for lines in page_lines]
+        images[0].save(os.path.join(directory, filename), save_all=True, append_images=images[1:], resolution=150)
+    else:
+        filename = f'cert_{serial:06d}.pdf'
+        with open(os.path.join(directory, filename), 'wb') as f:
+            f.write(text_pdf(page_lines))
+    return filename
+
+
+# --- Local stand-ins for Gemini and MongoDB ---
+class GeminiStandIn:
+    """Deterministic replacement for the Gemini call: parses the certificate
+    text it is given and answers after `latency` seconds."""
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, prompt, is_json_output=True):
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        course = next((c for c in COURSES if c[0].lower() in prompt.lower()), None)
+        if 'Extract the specific skills' in prompt:
+            return {'skills': SKILLS[course[0]] if course else []}
+        number = next((word for word in prompt.split() if word.isdigit() and len(word) == 6), 'Not found')
+        if not course:
+            return {'name': 'Not found', 'course': 'Not found', 'issuer': 'Not found',
+                    'date': 'Not found', 'category': 'Others', 'skills': []}
+        return {'name': f'Student {number}', 'course': course[0], 'issuer': course[1],
+                'date': '2024-01-15', 'category': course[2], 'skills': SKILLS[course[0]]}
+
+
+class _BulkWriteResult:
+    def __init__(self, inserted, upserted):
+        self.inserted_count = inserted
+        self.upserted_count = upserted
+        self.modified_count = 0
+
+
+class _CollectionStandIn:
+    def __init__(self, latency):
+        self.latency = latency
+        self.documents = 0
+
+    def create_index(self, keys):
+        return '_'.join(key for key, _ in keys)
+
+    def bulk_write(self, operations, ordered=True):
+        time.sleep(self.latency)
+        self.documents += len(operations)
+        inserted = sum(1 for op in operations if type(op).__name__ == 'InsertOne')
+        return _BulkWriteResult(inserted, len(operations) - inserted)
+
+
+class _AdminStandIn:
+    def command(self, name):
+        return {'ok': 1}
+
+
+class MongoStandIn:
+    """In-memory MongoClient replacement; every database shares one set of
+    collections that only count bulk-written operations."""
+    def __init__(self, latency):
+        self.admin = _AdminStandIn()
+        self.collections = {}
+        self.latency = latency
+
+    def __getitem__(self, db_name):
+        return _DatabaseStandIn(self.collections, self.latency)
+
+
+class _DatabaseStandIn:
+    def __init__(self, collections, latency):
+        self.collections = collections
+        self.latency = latency
+
+    def __getitem__(self, name):
+        return self.collections.setdefault(name, _CollectionStandIn(self.latency))
+
+
+# --- Harness ---
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def start_servers(app_module, document_dir):
+    from werkzeug.serving import make_server
+
+    file_server = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory=document_dir))
+    threading.Thread(target=file_server.serve_forever, daemon=True).start()
+    api_server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+    threading.Thread(target=api_server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{file_server.server_port}', f'http://127.0.0.1:{api_server.server_port}', (file_server, api_server)
+
+
+STARTUP_SCRIPT = """
+import sys
+sys.path.insert(0, sys.argv[1])
+import app
+app.app.run(host='127.0.0.1', port=int(sys.argv[2]), use_reloader=False)
+"""
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def measure_startup(here, workdir, timeout=60):
+    """Starts the server in a fresh process; returns seconds until live and ready."""
+    port = free_port()
+    url = f'http://127.0.0.1:{port}'
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-c', STARTUP_SCRIPT, here, str(port)], cwd=workdir,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    result = {'live_seconds': None, 'ready_seconds': None, 'startup_seconds': None, 'dependencies': None}
+    try:
+        while time.perf_counter() - started < timeout and process.poll() is None:
+            try:
+                if result['live_seconds'] is None:
+                    if requests.get(f'{url}/healthz', timeout=1).status_code == 200:
+                        result['live_seconds'] = round(time.perf_counter() - started, 3)
+                    continue
+                response = requests.get(f'{url}/readyz', timeout=1)
+                body = response.json()
+                result['startup_seconds'] = body.get('startup_seconds')
+                result['dependencies'] = body.get('dependencies')
+                if response.status_code == 200:
+                    result['ready_seconds'] = round(time.perf_counter() - started, 3)
+                    break
+                if body.get('status') == 'failed':
+                    break
+            except requests.RequestException:
+                pass
+            finally:
+                time.sleep(0.02)
+    finally:
+        process.terminate()
+        process.wait()
+    return result
+
+
+def summarize(values):
+    if not values:
+        return None
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'p50': round(float(p50), 4), 'p95': round(float(p95), 4), 'p99': round(float(p99), 4),
+            'mean': round(float(np.mean(values)), 4), 'max': round(float(np.max(values)), 4)}
+
+
+class Runner:
+    def __init__(self, api_url, files_url, document_dir, kinds, args):
+        self.kinds = kinds
+        self.api_url = api_url
+        self.files_url = files_url
+        self.document_dir = document_dir
+        self.args = args
+        self.serial = 0
+        self.local = threading.local()
+
+    def session(self):
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def make_documents(self, count):
+        documents = []
+        for _ in range(count):
+            self.serial += 1
+            kind = self.kinds[self.serial % len(self.kinds)]
+            filename = generate_document(self.document_dir, kind, self.serial, self.args.pages)
+            documents.append({'kind': kind, 'filename': filename,
+                              'student_id': f'BENCH-{self.serial % self.args.students:04d}'})
+        return documents
+
+    def send(self, endpoint, group):
+        session = self.session()
+        start = time.perf_counter()
+        if endpoint == 'upload':
+            document = group[0]
+            with open(os.path.join(self.document_dir, document['filename']), 'rb') as f:
+                response = session.post(f'{self.api_url}/process_certificate',
+                                        files={'certificate': (document['filename'], f)},
+                                        data={'student_id': document['student_id'], 'timings': '1'})
+        elif endpoint == 'url':
+            document = group[0]
+            response = session.post(f'{self.api_url}/process_certificate_url', json={
+                'document_url': f"{self.files_url}/{document['filename']}",
+                'student_id': document['student_id'], 'timings': True})
+        else:
+            response = session.post(f'{self.api_url}/process_certificates_batch', json={'documents': [
+                {'document_url': f"{self.files_url}/{document['filename']}", 'student_id': document['student_id']}
+                for document in group]})
+        elapsed = time.perf_counter() - start
+
+        errors = 0
+        timings = {}
+        if endpoint == 'batch':
+            events = [json.loads(line) for line in response.text.splitlines() if line.strip()]
+            errors = sum(1 for event in events if event.get('status') == 'error')
+            if response.status_code != 200 or not events or events[-1].get('status') != 'complete':
+                errors = len(group)
+        else:
+            body = response.json() if response.headers.get('content-type', '').startswith('application/json') else {}
+            if response.status_code != 200:
+                errors = 1
+            timings = body.get('timings', {})
+        return {'elapsed': elapsed, 'errors': errors, 'timings': timings, 'kinds': [d['kind'] for d in group]}
+
+    def run(self, endpoint, concurrency):
+        group_size = self.args.batch_size if endpoint == 'batch' else 1
+        groups = [self.make_documents(group_size) for _ in range(max(1, self.args.requests // group_size))]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            samples = list(pool.map(lambda group: self.send(endpoint, group), groups))
+        wall = time.perf_counter() - start
+
+        documents = sum(len(sample['kinds']) for sample in samples)
+        stages = {}
+        by_kind = {}
+        for sample in samples:
+            for stage, seconds in sample['timings'].items():
+                stages.setdefault(stage, []).append(seconds)
+            if endpoint != 'batch':
+                by_kind.setdefault(sample['kinds'][0], []).append(sample['elapsed'])
+        return {
+            'endpoint': endpoint,
+            'concurrency': concurrency,
+            'requests': len(samples),
+            'documents': documents,
+            'errors': sum(sample['errors'] for sample in samples),
+            'wall_seconds': round(wall, 3),
+            'docs_per_sec': round(documents / wall, 3) if wall else None,
+            'latency': summarize([sample['elapsed'] for sample in samples]),
+            'stages': {stage: summarize(values) for stage, values in sorted(stages.items())},
+            'by_kind': {kind: summarize(values) for kind, values in sorted(by_kind.items())},
+        }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, startup, baseline_path):
+    with open(baseline_path, 'r') as f:
+        baseline = json.load(f)
+    previous = {(r['endpoint'], r['concurrency']): r for r in baseline.get('results', [])}
+    print(f"\nCompared with {baseline_path} (commit {baseline.get('commit')}):")
+    old_startup = baseline.get('startup') or {}
+    for key in ('live_seconds', 'ready_seconds'):
+        old, new = (old_startup.get(key) or {}).get('p50'), ((startup or {}).get(key) or {}).get('p50')
+        if old and new:
+            print(f"  startup {key.split('_')[0]:>5} p50 {old:.3f}s -> {new:.3f}s ({(new / old - 1) * 100:+.1f}%)")
+    for result in results:
+        old = previous.get((result['endpoint'], result['concurrency']))
+        if not old or not old.get('latency') or not result.get('latency'):
+            continue
+        p95_change = (result['latency']['p95'] / old['latency']['p95'] - 1) * 100 if old['latency']['p95'] else 0
+        rate_change = (result['docs_per_sec'] / old['docs_per_sec'] - 1) * 100 if old['docs_per_sec'] else 0
+        print(f"  {result['endpoint']:>6} c={result['concurrency']:<3} "
+              f"p95 {old['latency']['p95']:.3f}s -> {result['latency']['p95']:.3f}s ({p95_change:+.1f}%), "
+              f"docs/sec {old['docs_per_sec']:.2f} -> {result['docs_per_sec']:.2f} ({rate_change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the certificate pipeline offline.")
+    parser.add_argument('--concurrency', default='1,4,8', help="Comma-separated concurrency levels")
+    parser.add_argument('--requests', type=int, default=24, help="Documents per endpoint and concurrency level")
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help=f"Comma-separated subset of {ENDPOINTS}")
+    parser.add_argument('--kinds', default=','.join(KINDS), help=f"Comma-separated subset of {KINDS}")
+    parser.add_argument('--pages', type=int, default=3, help="Pages in the multi-page documents")
+    parser.add_argument('--batch-size', type=int, default=8, help="Documents per /process_certificates_batch call")
+    parser.add_argument('--students', type=int, default=50, help="Distinct student ids to spread documents over")
+    parser.add_argument('--llm-latency', type=float, default=0.8, help="Seconds the Gemini stand-in takes per call")
+    parser.add_argument('--mongo-latency', type=float, default=0.02, help="Seconds the MongoDB stand-in takes per bulk write")
+    parser.add_argument('--startup-runs', type=int, default=3, help="Cold starts to time (0 to skip)")
+    parser.add_argument('--output', default='bench_results.json', help="Where to write the results")
+    parser.add_argument('--baseline', help="Earlier results file to compare against")
+    parser.add_argument('--verbose', action='store_true', help="Show the server's own logging")
+    args = parser.parse_args()
+
+    kinds = [kind for kind in args.kinds.split(',') if kind]
+    endpoints = [endpoint for endpoint in args.endpoints.split(',') if endpoint]
+    unknown = [k for k in kinds if k not in KINDS] + [e for e in endpoints if e not in ENDPOINTS]
+    if unknown:
+        parser.error(f"Unknown kinds/endpoints: {unknown}")
+    levels = [int(level) for level in args.concurrency.split(',') if level]
+    output = os.path.abspath(args.output)
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+
+    workdir = tempfile.mkdtemp(prefix='certbench-')
+    document_dir = os.path.join(workdir, 'documents')
+    os.makedirs(document_dir)
+
+    # Keep the real store, caches and Atlas out of the benchmark
+    here = os.path.dirname(os.path.abspath(__file__))
+    os.environ.pop('MONGO_URI', None)
+    os.environ.setdefault('GEMINI_API_KEY', 'benchmark')
+    os.environ['STUDENT_DB_PATH'] = os.path.join(workdir, 'student_data.sqlite3')
+    os.environ['OCR_CACHE_PATH'] = os.path.join(workdir, 'ocr_cache.sqlite3')
+    os.environ['LLM_CACHE_PATH'] = os.path.join(workdir, 'llm_cache.sqlite3')
+    os.environ.setdefault('SKILLS_CATALOG_PATH', os.path.join(here, 'skills.json'))
+    os.chdir(workdir)
+
+    startup = None
+    if args.startup_runs:
+        runs = [measure_startup(here, workdir) for _ in range(args.startup_runs)]
+        startup = {
+            'runs': len(runs),
+            'live_seconds': summarize([run['live_seconds'] for run in runs if run['live_seconds'] is not None]),
+            'ready_seconds': summarize([run['ready_seconds'] for run in runs if run['ready_seconds'] is not None]),
+            'import_seconds': summarize([run['startup_seconds'] for run in runs if run['startup_seconds'] is not None]),
+            'not_ready': sum(1 for run in runs if run['ready_seconds'] is None),
+            'dependencies': runs[-1]['dependencies'],
+        }
+        live, ready = startup['live_seconds'] or {}, startup['ready_seconds'] or {}
+        print(f"startup  {len(runs)} runs  live p50 {live.get('p50', 0):.3f}s  ready p50 {ready.get('p50', 0):.3f}s  "
+              f"not ready {startup['not_ready']}")
+
+    sys.path.insert(0, here)
+    import app
+
+    gemini = GeminiStandIn(args.llm_latency)
+    app._call_gemini = gemini
+    app.mongo_writer = app.MongoWriter(lambda: MongoStandIn(args.mongo_latency), 'benchmark')
+
+    files_url, api_url, servers = start_servers(app, document_dir)
+    runner = Runner(api_url, files_url, document_dir, kinds, args)
+
+    results = []
+    log = open(os.devnull, 'w') if not args.verbose else None
+    if log:
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    for concurrency in levels:
+        for endpoint in endpoints:
+            with contextlib.redirect_stdout(log) if log else contextlib.nullcontext():
+                result = runner.run(endpoint, concurrency)
+            results.append(result)
+            latency = result['latency'] or {}
+            print(f"{endpoint:>6} c={concurrency:<3} {result['documents']:>4} docs  "
+                  f"{result['docs_per_sec']:.2f} docs/sec  p50 {latency.get('p50', 0):.3f}s  "
+                  f"p95 {latency.get('p95', 0):.3f}s  p99 {latency.get('p99', 0):.3f}s  errors {result['errors']}")
+
+    report = {
+        'commit': git_commit(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {
+            **vars(args),
+            'cpu_count': os.cpu_count(),
+            'OCR_PROCESSES': app.OCR_PROCESSES,
+            'OCR_WORKERS': app.OCR_WORKERS,
+            'LLM_WORKERS': app.LLM_WORKERS,
+            'PDF_TEXT_LAYER': app.PDF_TEXT_LAYER,
+        },
+        'gemini_calls': gemini.calls,
+        'startup': startup,
+        'results': results,
+    }
+    for server in servers:
+        server.shutdown()
+    if log:
+        log.close()
+
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+    if baseline:
+        compare(results, startup, baseline)
+
+
+if __name__ == '__main__':
+    main()
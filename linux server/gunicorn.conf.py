@@ -0,0 +1,38 @@
+"""
+Production serving config. Run from this directory:
+
+    gunicorn app:app
+
+Every setting can be overridden with the environment variables below.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:5003")
+
+# Threaded workers: requests mostly wait on OCR processes, Gemini and downloads.
+# Async job records live in JOB_DB_PATH, so a job can be polled on any worker.
+workers = int(os.environ.get("WEB_WORKERS", 2))
+# app.py splits server-wide limits such as GEMINI_RPM between the workers
+os.environ["WEB_WORKERS"] = str(workers)
+worker_class = "gthread"
+threads = int(os.environ.get("WEB_THREADS", 8))
+
+# Recycle workers now and then so leaks can't accumulate
+max_requests = int(os.environ.get("WEB_MAX_REQUESTS", 500))
+max_requests_jitter = int(os.environ.get("WEB_MAX_REQUESTS_JITTER", 50))
+
+# Requests cancel their own work at REQUEST_TIMEOUT; this only catches a worker
+# that stopped responding altogether
+timeout = int(float(os.environ.get("REQUEST_TIMEOUT", 120))) + 30
+graceful_timeout = int(os.environ.get("WEB_GRACEFUL_TIMEOUT", 30))
+
+# Each worker has its own OCR pool; split the cores between them
+os.environ.setdefault("OCR_PROCESSES", str(max(1, multiprocessing.cpu_count() // workers)))
+
+# No preload: app.py starts the MongoDB writer and warm-up threads at import,
+# which must happen in each worker
+preload_app = False
+
+accesslog = "-"
+errorlog = "-"
@@ -0,0 +1,37 @@
+"""
+Scores a whole cohort against every career path in skills.json in one
+vectorized pass and writes the ranked results to a JSON file.
+
+Usage:
+    python3 score_cohort.py --output department_scores.json
+    python3 score_cohort.py --students student_ids.txt --top-k 5 --output cse_scores.json
+
+student_ids.txt holds one student id per line. Without --students every
+student in the local student store is scored.
+"""
+import argparse
+import json
+
+from app import score_cohort, ROADMAP_TOP_K
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rank best-fit careers and missing skills for a cohort.")
+    parser.add_argument('--students', help="File with one student id per line (default: all stored students)")
+    parser.add_argument('--top-k', type=int, default=ROADMAP_TOP_K, help="Careers to keep per student")
+    parser.add_argument('--output', default='cohort_scores.json', help="Where to write the results")
+    args = parser.parse_args()
+
+    student_ids = None
+    if args.students:
+        with open(args.students, 'r') as f:
+            student_ids = [line.strip() for line in f if line.strip()]
+
+    results = score_cohort(student_ids, args.top_k)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Scored {results['student_count']} students in {results['elapsed_seconds']}s, results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
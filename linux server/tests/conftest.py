@@ -0,0 +1,31 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# app reads its configuration at import time, so point every store at a
+# scratch directory (and away from the legacy JSON files) before importing it
+_data_dir = tempfile.mkdtemp(prefix='certificate-tests-')
+for name, filename in (('STUDENT_DB_PATH', 'student_data.sqlite3'), ('JOB_DB_PATH', 'jobs.sqlite3'),
+                       ('OCR_CACHE_PATH', 'ocr_cache.sqlite3'), ('LLM_CACHE_PATH', 'llm_cache.sqlite3')):
+    os.environ[name] = os.path.join(_data_dir, filename)
+os.environ['SKILLS_CATALOG_PATH'] = os.path.join(SERVER_DIR, 'skills.json')
+os.environ.setdefault('GEMINI_API_KEY', 'test')
+os.chdir(_data_dir)
+sys.path.insert(0, SERVER_DIR)
+
+import app as server  # noqa: E402
+
+
+@pytest.fixture
+def store(tmp_path):
+    return server.StudentStore(str(tmp_path / 'students.sqlite3'))
+
+
+@pytest.fixture
+def client(store, monkeypatch):
+    monkeypatch.setattr(server, 'student_store', store)
+    return server.app.test_client()
@@ -0,0 +1,71 @@
+from conftest import server
+
+
+def certificate(course, category='Course', issuer='Coursera', **fields):
+    return {'course': course, 'category': category, 'issuer': issuer, **fields}
+
+
+def counts(aggregates, kind):
+    return {entry['name']: entry['count'] for entry in aggregates[kind]}
+
+
+def rebuilt_aggregates(store):
+    """What the triggers should have produced, recomputed from the rows."""
+    conn = store._connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        server.StudentStore._rebuild_aggregates(conn)
+        return store.aggregates()
+    finally:
+        conn.execute("ROLLBACK")
+
+
+def test_aggregates_follow_inserts(store):
+    store.add_certificates([('S1', certificate('Python', issuer='Coursera'), ['Python', 'SQL']),
+                            ('S1', certificate('Cloud', 'Internship', ' coursera '), ['AWS']),
+                            ('S2', certificate('ML', issuer='NPTEL'), ['python'])])
+    aggregates = store.aggregates()
+    assert counts(aggregates, 'issuer') == {'Coursera': 2, 'NPTEL': 1}
+    assert counts(aggregates, 'category') == {'Course': 2, 'Internship': 1}
+    assert counts(aggregates, 'skill') == {'Python': 2, 'SQL': 1, 'AWS': 1}
+    assert aggregates['totals'] == {'students': 2, 'certificates': 3, 'skill_entries': 4}
+    assert aggregates == rebuilt_aggregates(store)
+
+
+def test_aggregates_follow_deletes(store):
+    store.add_certificates([('S1', certificate('Python'), ['Python']),
+                            ('S2', certificate('ML', issuer='NPTEL'), ['ML'])])
+    store.apply_patch([{'op': 'remove_certificate', 'student_id': 'S2', 'index': 0},
+                       {'op': 'remove_skill', 'student_id': 'S2', 'skill': 'ml'}])
+    aggregates = store.aggregates()
+    assert counts(aggregates, 'issuer') == {'Coursera': 1}
+    assert counts(aggregates, 'skill') == {'Python': 1}
+    assert aggregates['totals'] == {'students': 1, 'certificates': 1, 'skill_entries': 1}
+    assert aggregates == rebuilt_aggregates(store)
+
+
+def test_aggregates_follow_replaces(store):
+    store.add_certificates([('S1', certificate('Python'), ['Python']),
+                            ('S2', certificate('ML', issuer='NPTEL'), ['ML'])])
+    store.apply_patch([{'op': 'set_certificates', 'student_id': 'S1',
+                        'certificates': [certificate('Go', 'Workshop', 'Udemy')]},
+                       {'op': 'set_skills', 'student_id': 'S1', 'skills': ['Go', 'Docker']}])
+    assert counts(store.aggregates(), 'issuer') == {'NPTEL': 1, 'Udemy': 1}
+
+    store.replace_certificates({'S3': [certificate('Java', issuer='Oracle')]})
+    store.replace_skills({'S3': ['Java']})
+    aggregates = store.aggregates()
+    assert counts(aggregates, 'issuer') == {'Oracle': 1}
+    assert counts(aggregates, 'skill') == {'Java': 1}
+    assert aggregates['totals'] == {'students': 1, 'certificates': 1, 'skill_entries': 1}
+    assert aggregates == rebuilt_aggregates(store)
+
+
+def test_cohort_aggregates(store):
+    store.add_certificates([('S1', certificate('Python'), ['Python']),
+                            ('S2', certificate('ML', issuer='NPTEL'), ['Python', 'ML']),
+                            ('S3', certificate('Java', issuer='Oracle'), ['Java'])])
+    cohort = store.aggregates(student_ids=['S1', 'S2'])
+    assert counts(cohort, 'skill') == {'Python': 2, 'ML': 1}
+    assert counts(cohort, 'issuer') == {'Coursera': 1, 'NPTEL': 1}
+    assert cohort['totals'] == {'students': 2, 'certificates': 2, 'skill_entries': 3}
@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+from conftest import server
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    """Stands in for download, OCR and the LLM; records what reached storage."""
+    calls = {'deadlines': [], 'stored': []}
+
+    def download(document_url):
+        calls['deadlines'].append(server.request_deadline.get())
+        if 'broken' in document_url:
+            raise server.ProcessingError('Download failed', 502)
+        return server.DocumentSource('certificate.png', data=document_url.encode(), document_url=document_url)
+    monkeypatch.setattr(server, 'download_document_from_url', download)
+    monkeypatch.setattr(server, 'ocr_downloaded_document', lambda document, student_id: ('text', None))
+    monkeypatch.setattr(server, 'analyze_certificate', lambda text, student_id, document_url: {
+        'student_id': student_id, 'document_url': document_url, 'skills': ['Python']})
+    monkeypatch.setattr(server, 'persist_certificates', lambda certificates, fingerprints: calls['stored'].extend(
+        certificate['document_url'] for certificate in certificates))
+    return calls
+
+
+def run_batch(client, urls):
+    response = client.post('/process_certificates_batch', json={
+        'documents': [{'document_url': url, 'student_id': 'S1'} for url in urls]})
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_items_are_processed_then_stored_together(client, pipeline):
+    events = run_batch(client, ['https://x/a.png', 'https://x/broken.png', 'https://x/c.png'])
+    items, summary = sorted(events[:-1], key=lambda event: event['index']), events[-1]
+    assert [event['status'] for event in items] == ['processed', 'error', 'processed']
+    assert items[1]['error_status'] == 502
+    assert sorted(pipeline['stored']) == ['https://x/a.png', 'https://x/c.png']
+    assert summary == {'status': 'complete', 'total': 3, 'succeeded': 2, 'duplicates': 0, 'failed': 1, 'stored': 2}
+
+
+def test_failed_store_is_reported_in_the_summary(client, pipeline, monkeypatch):
+    def fail(certificates, fingerprints):
+        raise RuntimeError('disk full')
+    monkeypatch.setattr(server, 'persist_certificates', fail)
+    events = run_batch(client, ['https://x/a.png'])
+    assert events[0]['status'] == 'processed'
+    assert events[-1]['stored'] == 0 and 'disk full' in events[-1]['error']
+
+
+def test_items_get_deadlines_and_return_their_slots(client, pipeline):
+    free_slots = server.job_slots._value
+    run_batch(client, [f'https://x/{i}.png' for i in range(5)])
+    assert len(pipeline['deadlines']) == 5 and all(pipeline['deadlines'])
+    assert server.job_slots._value == free_slots
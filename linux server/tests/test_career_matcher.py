@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+from conftest import server
+
+CAREERS = [
+    {'title': 'Data Scientist', 'skills': ['Python Programming', 'Machine Learning', 'Statistics', 'SQL']},
+    {'title': 'Risk Analyst', 'skills': ['Risk Management', 'Financial Modeling', 'Excel']},
+    {'title': 'ML Engineer', 'skills': ['TensorFlow/PyTorch', 'Kubernetes', 'Python Programming']},
+    {'title': 'Untitled', 'skills': []},
+]
+
+
+@pytest.fixture
+def matcher():
+    return server.CareerMatcher(CAREERS)
+
+
+def test_ranks_careers_by_coverage(matcher):
+    matches = matcher.match(['Python', 'Machine Learning', 'SQL'], top_k=2)
+    assert [match['career_title'] for match in matches] == ['Data Scientist', 'ML Engineer']
+    assert matches[0] == {'career_title': 'Data Scientist', 'coverage': 0.75,
+                          'existing_skills': ['Python', 'Machine Learning', 'SQL'], 'missing_skills': ['Statistics']}
+    assert matches[1]['coverage'] == round(1 / 3, 3)
+
+
+def test_aliases_alternatives_and_typos(matcher):
+    match = matcher.match(['PyTorch', 'k8s', 'Pyhton'], top_k=1)[0]
+    assert match['career_title'] == 'ML Engineer' and match['coverage'] == 1.0
+
+
+def test_generic_words_do_not_cover_a_skill():
+    # Across skills.json "design" is common, so it weighs little next to "circuit"
+    matcher = server.CareerMatcher.from_file(server.SKILLS_CATALOG_PATH)
+    for match in matcher.match(['Design'], top_k=1000):
+        covered = set(dict(matcher.careers)[match['career_title']]) - set(match['missing_skills'])
+        assert not any('circuit design' in skill.lower() for skill in covered)
+    assert matcher.match(['Circuit Design'])
+
+
+def test_missing_or_broken_catalog_means_no_careers(tmp_path):
+    assert server.CareerMatcher.from_file(str(tmp_path / 'missing.json')).match(['Python']) == []
+    broken = tmp_path / 'broken.json'
+    broken.write_text('[]')
+    assert server.CareerMatcher.from_file(str(broken)).careers == []
+
+
+def test_roadmap_uses_the_best_careers(matcher, monkeypatch, tmp_path):
+    catalog = tmp_path / 'skills.json'
+    catalog.write_text(json.dumps({'career_paths': CAREERS}))
+    monkeypatch.setattr(server, '_career_matcher', server.CareerMatcher.from_file(str(catalog)))
+    roadmap = server.generate_roadmap_for_student('S1', {'category': 'Course'}, ['Python', 'SQL'])
+    best = roadmap['potential_roadmaps'][0]
+    assert best['career_title'] == 'Data Scientist'
+    assert best['sequenced_roadmap'] == ['machine learning', 'statistics']
+
+    roadmap = server.generate_roadmap_for_student('S1', {'category': 'Course', 'course': 'Pottery'}, ['Pottery'])
+    assert roadmap['potential_roadmaps'][0]['career_title'] == 'Course Specialist'
@@ -0,0 +1,51 @@
+import random
+
+import pytest
+
+from conftest import server
+
+
+@pytest.fixture(scope='module')
+def matcher():
+    return server.CareerMatcher.from_file(server.SKILLS_CATALOG_PATH)
+
+
+@pytest.fixture(scope='module')
+def scorer(matcher):
+    return server.CohortScorer(matcher)
+
+
+def matcher_ranking(matcher, skills):
+    return [(career['career_title'], career['coverage']) for career in matcher.match(skills, 3)]
+
+
+def scorer_ranking(result):
+    return [(career['career_title'], career['match_score']) for career in result['best_fit_careers']]
+
+
+def test_pooled_tokens_do_not_cover_a_skill(matcher, scorer):
+    # "Risk" and "Management" only cover "Risk Management" as one skill
+    results, _ = scorer.score({'split': ['Risk', 'Management'], 'joined': ['Risk Management']})
+    assert scorer_ranking(results['split']) == matcher_ranking(matcher, ['Risk', 'Management'])
+    assert scorer_ranking(results['joined']) == matcher_ranking(matcher, ['Risk Management'])
+
+
+def test_scores_match_the_career_matcher(matcher, scorer):
+    rng = random.Random(7)
+    catalog = [skill for _, skills in matcher.careers for skill in skills]
+    students = {f'S{i}': rng.sample(catalog, rng.randint(1, 6)) for i in range(300)}
+    students['typed'] = ['Python', 'Machine Learning', 'SQL', 'Pyhton', 'k8s']
+    students['none'] = []
+    results, _ = scorer.score(students)
+    for student_id, skills in students.items():
+        expected = matcher.match(skills, 3)
+        assert scorer_ranking(results[student_id]) == matcher_ranking(matcher, skills), skills
+        assert results[student_id]['missing_skills'] == (expected[0]['missing_skills'] if expected else [])
+
+
+def test_top_missing_skills_count_students(scorer):
+    results, top_missing = scorer.score({'S1': ['Python'], 'S2': ['Python']})
+    best = results['S1']['missing_skills']
+    assert results['S2']['missing_skills'] == best
+    assert top_missing[:len(best)] == sorted(({'skill': skill, 'students': 2} for skill in best),
+                                             key=lambda entry: entry['skill'])
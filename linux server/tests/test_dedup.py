@@ -0,0 +1,126 @@
+import io
+
+import pytest
+
+from conftest import server
+
+TEMPLATE = """CERTIFICATE OF COMPLETION
+This is to certify that Priya Raman has successfully completed
+the online course {course} offered by the Department of Computer Science
+with a consolidated score of 82 percent over twelve weeks of study
+Issued on {date}
+Certificate ID: {id}
+Verify at https://example.edu/verify/{id}"""
+
+
+def certificate_text(course='Python for Data Science', date='15 January 2024', id='NPTEL24CS1234'):
+    return TEMPLATE.format(course=course, date=date, id=id)
+
+
+@pytest.fixture
+def screen(store, monkeypatch):
+    monkeypatch.setattr(server, 'student_store', store)
+
+    def screen(text, student_id='S1'):
+        return server.screen_text(text, student_id, {'sha256': None, 'phash': None})
+    return screen
+
+
+def store_certificate(store, fingerprints, **parsed):
+    store.add_certificate('S1', {'course': 'stored', **parsed}, [], fingerprints)
+
+
+def test_certificate_identity():
+    identity = server.certificate_identity(certificate_text())
+    assert identity == {'ids': ['NPTEL24CS1234'], 'dates': ['2024-01-15']}
+    assert server.certificate_identity('Awarded for Python') == {'ids': [], 'dates': []}
+
+
+def test_rescan_is_a_duplicate(store, screen):
+    store_certificate(store, screen(certificate_text()))
+    rescan = certificate_text().replace('COMPLETION', 'COMPLETI0N').replace('certify', 'certifv')
+    with pytest.raises(server.DuplicateCertificate) as duplicate:
+        screen(rescan)
+    assert duplicate.value.match == 'text'
+    assert duplicate.value.certificate == {'course': 'stored'}
+
+
+def test_sibling_certificates_are_kept(store, screen):
+    original = screen(certificate_text())
+    store_certificate(store, original)
+    siblings = [certificate_text(id='NPTEL24CS5678'),
+                certificate_text(course='Python for Data Analysis', date='2 March 2024', id='NPTEL24CS9012')]
+    for text in siblings:
+        assert server.minhash_similarity(original['minhash'], server.text_minhash(text)) >= server.MINHASH_THRESHOLD
+        assert screen(text)['identity']['ids'] != original['identity']['ids']
+
+
+def test_without_ids_dates_decide(store, screen):
+    text = certificate_text().replace('Certificate ID: NPTEL24CS1234\n', '').replace('/verify/NPTEL24CS1234', '')
+    store_certificate(store, screen(text))
+    assert screen(text.replace('15 January 2024', '15 February 2024'))
+    with pytest.raises(server.DuplicateCertificate):
+        screen(text)
+
+
+def test_legacy_fingerprint_falls_back_on_parsed_date(store, screen):
+    fingerprints = screen(certificate_text())
+    fingerprints['identity'] = None
+    store_certificate(store, fingerprints, date='2024-01-15')
+    assert screen(certificate_text(date='2 March 2024'))
+    with pytest.raises(server.DuplicateCertificate):
+        screen(certificate_text())
+
+
+def test_allow_duplicate_skips_the_check(store, screen):
+    store_certificate(store, screen(certificate_text()))
+    with server.allow_duplicate_scope(True):
+        assert screen(certificate_text())['identity']['ids'] == ['NPTEL24CS1234']
+
+
+def test_other_students_are_not_compared(store, screen):
+    store_certificate(store, screen(certificate_text()))
+    assert screen(certificate_text(), student_id='S2')
+
+
+def rendered(text, quality=None):
+    from PIL import Image, ImageDraw
+    image = Image.new('L', (900, 300), 255)
+    ImageDraw.Draw(image).multiline_text((20, 20), text, fill=0)
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=quality) if quality else image.save(buffer, 'PNG')
+    return server.DocumentSource('certificate.jpg' if quality else 'certificate.png', data=buffer.getvalue())
+
+
+def screen_upload(text, quality=None, student_id='S1'):
+    fingerprints = server.screen_document(rendered(text, quality), student_id)
+    return server.screen_text(text, student_id, fingerprints)
+
+
+def test_similar_image_of_a_sibling_is_kept(store, screen):
+    store_certificate(store, screen_upload(certificate_text()))
+    sibling = certificate_text(date='16 January 2024', id='NPTEL24CS1235')
+    fingerprints = server.screen_document(rendered(sibling), 'S1')
+    assert fingerprints['candidates'], 'template siblings should hash alike'
+    assert server.screen_text(sibling, 'S1', fingerprints)
+
+
+def test_reencoded_image_is_a_duplicate(store, screen):
+    store_certificate(store, screen_upload(certificate_text()))
+    fingerprints = server.screen_document(rendered(certificate_text(), quality=75), 'S1')
+    with pytest.raises(server.DuplicateCertificate) as duplicate:
+        # Too garbled for the text match; the image and ID still agree
+        server.screen_text('NPTEL certificate NPTEL24CS1234 15 January 2024', 'S1', fingerprints)
+    assert duplicate.value.match == 'image'
+
+
+def test_duplicate_upload_returns_the_stored_result(client, store):
+    document = rendered(certificate_text())
+    store.add_certificate('S1', {'course': 'stored'}, [], {'sha256': document.sha256()})
+    response = client.post('/process_certificate', data={
+        'student_id': 'S1', 'certificate': (io.BytesIO(document.data), 'certificate.png')})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['status'] == 'duplicate'
+    assert body['parsed_data'] == {'course': 'stored'}
+    assert body['duplicate'] == {'match': 'file', 'similarity': 1.0}
@@ -0,0 +1,98 @@
+import hashlib
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from conftest import server
+
+SMALL = b'\x89PNG small certificate'
+BIG = b'x' * (2 * 1024 * 1024)
+
+
+class Handler(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        Handler.requests.append((self.path, self.headers.get('If-None-Match')))
+        if self.path.startswith('/cached') and self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = BIG if self.path.startswith('/big') else SMALL + self.path.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        if self.path.startswith('/cached'):
+            self.send_header('ETag', '"v1"')
+        if not self.path.startswith('/streamed'):
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body if not self.path.startswith('/streamed') else BIG)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client gave up at the size limit
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def base_url():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{httpd.server_port}'
+    httpd.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def requests_seen():
+    Handler.requests.clear()
+    return Handler.requests
+
+
+def test_small_documents_stay_in_memory(base_url):
+    document = server.download_document_from_url(f'{base_url}/small')
+    assert document.data == SMALL + b'/small' and document.path is None
+    assert document.filename == 'small.png'
+    assert document.sha256() == hashlib.sha256(SMALL + b'/small').hexdigest()
+
+
+def test_bigger_documents_spill_to_a_temp_file(base_url, monkeypatch):
+    monkeypatch.setattr(server, 'SPOOL_MAX_KB', 1)
+    document = server.download_document_from_url(f'{base_url}/big.pdf')
+    try:
+        assert document.data is None and os.path.getsize(document.path) == len(BIG)
+    finally:
+        document.cleanup()
+    assert not os.path.exists(document.path)
+
+
+@pytest.mark.parametrize('path', ['/big.pdf', '/streamed.pdf'])
+def test_size_limit_from_header_or_while_streaming(base_url, monkeypatch, path):
+    monkeypatch.setattr(server, 'MAX_DOWNLOAD_MB', 1)
+    with pytest.raises(server.ProcessingError) as error:
+        server.download_document_from_url(base_url + path)
+    assert error.value.status_code == 413
+
+
+def test_not_modified_document_skips_the_transfer(base_url, requests_seen):
+    url = f'{base_url}/cached/one.png'
+    first = server.download_document_from_url(url)
+    server.ocr_cache.set(server.ocr_cache_key(first), {'text': 'Certificate text'})
+    second = server.download_document_from_url(url)
+    assert not second.has_content and second.sha256() == first.sha256()
+    assert requests_seen == [('/cached/one.png', None), ('/cached/one.png', '"v1"')]
+
+
+def test_not_modified_without_cached_text_downloads_again(base_url, requests_seen):
+    url = f'{base_url}/cached/two.png'
+    server.download_document_from_url(url)
+    document = server.download_document_from_url(url)
+    assert document.data == SMALL + b'/cached/two.png'
+    assert requests_seen == [('/cached/two.png', None), ('/cached/two.png', '"v1"'), ('/cached/two.png', None)]
+
+
+def test_connection_errors_are_processing_errors():
+    with pytest.raises(server.ProcessingError):
+        server.download_document_from_url('http://127.0.0.1:1/unreachable.png')
@@ -0,0 +1,97 @@
+import threading
+import time
+
+import pytest
+
+from conftest import server
+
+
+def client(rpm=60, burst=2, concurrency=4, retries=2):
+    return server.GeminiClient(rpm, burst, concurrency, retries, backoff_base=0.01, backoff_max=0.02)
+
+
+class FlakyModel:
+    """generate_content raises the given errors in turn, then answers "ok"."""
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def generate_content(self, prompt, request_options=None):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+
+def test_bucket_allows_the_burst_then_refills():
+    gemini = client(rpm=60, burst=2)
+    assert gemini.acquire('interactive', block=False) and gemini.acquire('interactive', block=False)
+    assert not gemini.acquire('interactive', block=False)
+    time.sleep(1.1)
+    assert gemini.acquire('interactive', block=False)
+
+
+def test_concurrency_slots_are_released():
+    gemini = client(rpm=0, concurrency=1)
+    assert gemini.acquire('interactive')
+    assert not gemini.acquire('interactive', block=False)
+    gemini.release()
+    assert gemini.acquire('interactive', block=False)
+
+
+def test_interactive_callers_go_before_bulk():
+    gemini = client(rpm=0, concurrency=1)
+    gemini.acquire('interactive')
+    order = []
+
+    def call(priority):
+        gemini.acquire(priority)
+        order.append(priority)
+        gemini.release()
+    bulk = threading.Thread(target=call, args=('bulk',))
+    bulk.start()
+    time.sleep(0.1)
+    interactive = threading.Thread(target=call, args=('interactive',))
+    interactive.start()
+    time.sleep(0.1)
+    gemini.release()
+    bulk.join(2)
+    interactive.join(2)
+    assert order == ['interactive', 'bulk']
+
+
+def test_waiting_for_quota_respects_the_deadline():
+    gemini = client(rpm=1, burst=1)
+    gemini.acquire('interactive')
+    gemini.release()
+    with server.deadline_scope(time.time() + 0.2), pytest.raises(server.DeadlineExceeded):
+        gemini.acquire('interactive')
+
+
+def test_transient_errors_are_retried():
+    exceptions = server.google_exceptions
+    model = FlakyModel(exceptions.ServiceUnavailable('busy'), exceptions.InternalServerError('oops'))
+    assert client(rpm=0).generate(model, 'prompt') == 'ok'
+    assert model.calls == 3
+
+
+def test_rate_limit_empties_the_bucket():
+    gemini = client(rpm=60, burst=5)
+    model = FlakyModel(server.google_exceptions.TooManyRequests('quota'))
+    assert gemini.generate(model, 'prompt') == 'ok'
+    assert not gemini.acquire('interactive', block=False)
+
+
+def test_gives_up_with_503_after_the_retries():
+    exceptions = server.google_exceptions
+    model = FlakyModel(*[exceptions.ServiceUnavailable('busy')] * 3)
+    with pytest.raises(server.ProcessingError) as error:
+        client(rpm=0, retries=2).generate(model, 'prompt')
+    assert error.value.status_code == 503 and model.calls == 3
+
+
+def test_other_errors_are_not_retried():
+    model = FlakyModel(server.google_exceptions.InvalidArgument('bad prompt'))
+    with pytest.raises(server.google_exceptions.InvalidArgument):
+        client(rpm=0).generate(model, 'prompt')
+    assert model.calls == 1
@@ -0,0 +1,64 @@
+import pytest
+
+from conftest import server
+
+CERTIFICATE = """NPTEL
+CERTIFICATE OF COMPLETION
+This is to certify that Priya Raman
+has successfully completed the course
+Python for Data Science
+Issued on 15 January 2024"""
+
+
+@pytest.fixture
+def extractor(store, monkeypatch):
+    """An extractor trained on three Gemini results per course."""
+    monkeypatch.setattr(server, 'student_store', store)
+    gemini_results = [
+        ('Python for Data Science', 'NPTEL', 'Course', ['Python', 'Pandas']),
+        ('Cloud Computing Internship', 'Amazon Web Services', 'Internship', ['AWS']),
+        ('Smart India Hackathon', 'Ministry of Education', 'Hackathon', ['Teamwork']),
+    ]
+    store.add_certificates([
+        (f'S{i}', {'course': course, 'issuer': issuer, 'category': category, 'skills': skills}, skills)
+        for i in range(3) for course, issuer, category, skills in gemini_results
+    ])
+    extractor = server.LocalExtractor(threshold=0.9, min_seen=3, retrain_seconds=3600)
+    extractor.train()
+    return extractor
+
+
+def test_known_certificate_skips_gemini(extractor):
+    assert extractor.extract(CERTIFICATE) == {
+        'name': 'Priya Raman', 'course': 'Python for Data Science', 'issuer': 'NPTEL',
+        'date': '15 January 2024', 'category': 'Course', 'skills': ['Python', 'Pandas'], 'extraction': 'local'}
+
+
+@pytest.mark.parametrize('text', [
+    CERTIFICATE.replace('Python for Data Science', 'Deep Learning'),  # unknown course
+    CERTIFICATE.replace('NPTEL\n', 'Coursera\n'),  # unknown issuer
+    CERTIFICATE.replace('This is to certify that Priya Raman', 'Well done'),  # no name
+    CERTIFICATE.replace('Issued on 15 January 2024', 'From 15 January 2024 to 20 March 2024'),  # two dates
+])
+def test_falls_back_to_gemini_when_unsure(extractor, text):
+    assert extractor.extract(text) is None
+
+
+def test_a_labelled_date_wins_over_others(extractor):
+    parsed = extractor.extract(CERTIFICATE + '\nValid until 15 January 2026')
+    assert parsed['date'] == '15 January 2024'
+
+
+def test_courses_seen_too_rarely_are_unknown(extractor, store):
+    store.add_certificate('S9', {'course': 'Deep Learning', 'issuer': 'NPTEL', 'category': 'Course',
+                                 'skills': ['PyTorch']}, ['PyTorch'])
+    extractor.train()
+    assert extractor.extract(CERTIFICATE.replace('Python for Data Science', 'Deep Learning')) is None
+
+
+def test_local_results_do_not_train_the_extractor(extractor, store):
+    local = dict(extractor.extract(CERTIFICATE), course='Deep Learning')
+    for i in range(3):
+        store.add_certificate(f'L{i}', local, local['skills'])
+    extractor.train()
+    assert extractor.extract(CERTIFICATE.replace('Python for Data Science', 'Deep Learning')) is None
@@ -0,0 +1,59 @@
+import pytest
+
+from conftest import server
+
+
+def certificate(course, category='Course', issuer='Coursera', **fields):
+    return {'course': course, 'category': category, 'issuer': issuer, **fields}
+
+
+def test_failed_write_rolls_back(store):
+    store.add_certificate('S1', certificate('Python'), ['Python'])
+    version = store.data_version()
+    with pytest.raises(server.ProcessingError):
+        store.apply_patch([{'op': 'add_skill', 'student_id': 'S1', 'skill': 'Go'},
+                           {'op': 'remove_certificate', 'student_id': 'S1', 'index': 5}])
+    assert store.get_skills('S1') == ['Python']
+    assert store.data_version() == version
+
+
+def test_patch_with_stale_version_conflicts(store):
+    store.add_certificate('S1', certificate('Python'), ['Python'])
+    version = store.student_version('S1')
+    store.apply_patch([{'op': 'add_skill', 'student_id': 'S1', 'skill': 'SQL'}], {'S1': version})
+    with pytest.raises(server.VersionConflict) as conflict:
+        store.apply_patch([{'op': 'add_skill', 'student_id': 'S1', 'skill': 'Go'}], {'S1': version})
+    assert conflict.value.versions == {'S1': store.student_version('S1')}
+    assert store.get_skills('S1') == ['Python', 'SQL']
+
+
+def test_merge_patch_endpoint(client, store):
+    store.add_certificate('S1', certificate('Python'), ['Python'])
+    version = store.student_version('S1')
+    response = client.patch('/update_student_data', content_type='application/merge-patch+json',
+                            json={'skills_data': {'S1': ['Go']}, 'expected_versions': {'S1': version}})
+    assert response.status_code == 200
+    assert store.get_skills('S1') == ['Go']
+
+    response = client.patch('/update_student_data', content_type='application/merge-patch+json',
+                            json={'skills_data': {'S1': None}, 'expected_versions': {'S1': version}})
+    assert response.status_code == 409
+    assert response.get_json()['versions'] == {'S1': store.student_version('S1')}
+    assert store.get_skills('S1') == ['Go']
+
+
+def test_operations_touch_only_named_students(store):
+    store.add_certificates([('S1', certificate('Python', document_url='https://x/a.png'), ['Python']),
+                            ('S2', certificate('SQL'), ['SQL'])])
+    untouched = store.student_version('S2')
+    versions = store.apply_patch([{'op': 'remove_certificate', 'student_id': 'S1', 'document_url': 'https://x/a.png'},
+                                  {'op': 'set_skills', 'student_id': 'S1', 'skills': ['Go', 'go']}])
+    assert versions == {'S1': store.student_version('S1')}
+    assert store.get_certificates('S1') == [] and store.get_skills('S1') == ['Go']
+    assert store.student_version('S2') == untouched
+
+
+def test_malformed_operation_is_a_400(client):
+    response = client.patch('/update_student_data', json={'operations': [{'op': 'rename', 'student_id': 'S1'}]})
+    assert response.status_code == 400
+    assert 'Operation 0' in response.get_json()['error']
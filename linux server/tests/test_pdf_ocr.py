@@ -0,0 +1,80 @@
+import pytest
+
+from conftest import server
+
+
+def skipped_marker(first, last):
+    return f'[OCR skipped on page(s) {first}-{last}]' if last != first else f'[OCR skipped on page(s) {first}]'
+
+
+def fake_ocrmypdf(page_count):
+    """
+    Writes the sidecar the way ocrmypdf merges it: one chunk per OCRed page
+    ("text of page N") and one marker per run of skipped pages.
+    """
+    def ocr(input_file, output_file, sidecar, pages=None, **options):
+        wanted = {int(page) for page in pages.split(',')} if pages else set(range(1, page_count + 1))
+        chunks = []
+        for page in range(1, page_count + 1):
+            if page in wanted:
+                chunks.append(f'text of page {page}')
+            elif page - 1 in wanted or page == 1:
+                chunks.append([page, page])
+            else:
+                chunks[-1][1] = page
+        with open(sidecar, 'w') as stream:
+            stream.write('\f'.join(chunk if isinstance(chunk, str) else skipped_marker(*chunk) for chunk in chunks))
+    return ocr
+
+
+@pytest.fixture
+def five_page_pdf(monkeypatch):
+    ocr = fake_ocrmypdf(5)
+    monkeypatch.setattr(server, 'run_in_process_group', lambda fn, *args, **kwargs: ocr(*args, **kwargs))
+    return 'certificate.pdf'
+
+
+@pytest.mark.parametrize('page', [0, 1, 2, 4])
+def test_single_page_gets_its_own_text(five_page_pdf, page):
+    assert server.ocr_pdf_page(five_page_pdf, page) == f'text of page {page + 1}'
+
+
+def test_skip_markers_are_dropped(five_page_pdf):
+    assert server.ocr_pdf_pages(five_page_pdf, [0, 2]) == 'text of page 1\ftext of page 3'
+    assert server.ocr_pdf_pages(five_page_pdf).count('\f') == 4
+
+
+@pytest.fixture
+def scanned_pdf(monkeypatch):
+    """A 3-page scan without a text layer; records the pages of each OCR round."""
+    rounds = []
+    page_texts = {0: 'CERTIFICATE', 1: 'Awarded to Priya Raman\nIssued on 15 January 2024', 2: 'Terms'}
+
+    def run_round(request_key, fn, tasks, deadline):
+        rounds.append([page for _, page in tasks])
+        return [page_texts[page] for _, page in tasks]
+    monkeypatch.setattr(server, 'read_pdf_text_layer', lambda document: None)
+    monkeypatch.setattr(server, 'count_pdf_pages', lambda document: 3)
+    monkeypatch.setattr(server.ocr_scheduler, 'map', run_round)
+    monkeypatch.setattr(server, 'PDF_OCR_ROUND_PAGES', 4)
+    return server.DocumentSource('scan.pdf', data=b'%PDF-'), page_texts, rounds
+
+
+def test_first_page_is_ocred_alone(scanned_pdf):
+    document, page_texts, rounds = scanned_pdf
+    assert server.extract_pdf_text(document) == 'CERTIFICATE\f' + page_texts[1] + '\fTerms'
+    assert rounds == [[0], [1, 2]]
+
+
+def test_early_stop_after_the_first_page(scanned_pdf):
+    document, page_texts, rounds = scanned_pdf
+    page_texts[0] = page_texts[1]
+    server.extract_pdf_text(document)
+    assert rounds == [[0]]
+
+
+def test_one_round_without_early_stop(scanned_pdf, monkeypatch):
+    document, _, rounds = scanned_pdf
+    monkeypatch.setattr(server, 'PDF_OCR_EARLY_STOP', False)
+    server.extract_pdf_text(document)
+    assert rounds == [[0, 1, 2]]
@@ -0,0 +1,39 @@
+from conftest import server
+
+
+def test_ornaments_noise_and_repeats_are_dropped():
+    text = ('|| ~~~ CERTIFICATE OF COMPLETION ~~~ ||\n'
+            'i l | ; , . : l i\n'
+            '   This   is to certify that   \n'
+            'Priya Raman\n'
+            '=====================\n'
+            'www.example.edu\n'
+            'www.example.edu\n'
+            'Certificate of Completion')
+    assert server.compact_ocr_text(text) == ('CERTIFICATE OF COMPLETION\nThis is to certify that\n'
+                                             'Priya Raman\nwww.example.edu')
+
+
+def test_initials_survive_the_noise_filter():
+    assert server.clean_ocr_line('S K R Sharma') == 'S K R Sharma'
+    assert server.clean_ocr_line('a e i o u') == ''
+    assert server.clean_ocr_line('Data & AI') == 'Data & AI'
+
+
+def test_long_text_keeps_the_field_lines_in_order():
+    filler = [f'Module {i} covered topics such as loops, functions and recursion' for i in range(60)]
+    text = '\n'.join(['Certificate of Completion', 'Awarded to Priya Raman'] + filler + ['Issued on 15 January 2024'])
+    compacted = server.compact_ocr_text(text, max_tokens=50)
+    lines = compacted.splitlines()
+    assert len(compacted) <= 200
+    assert lines[0] == 'Certificate of Completion'
+    assert 'Awarded to Priya Raman' in lines and lines[-1] == 'Issued on 15 January 2024'
+
+
+def test_cache_key_follows_the_compacted_prompt(monkeypatch):
+    prompts = []
+    monkeypatch.setattr(server, 'call_gemini_cached', lambda key, prompt: prompts.append(key) or {'name': 'x'})
+    server.parse_and_classify_with_gemini('Certificate  of Completion\n~~~~\nAwarded to Priya Raman')
+    server.parse_and_classify_with_gemini('Certificate of Completion\nAwarded to Priya Raman\n| |')
+    assert prompts[0] == prompts[1]
+    assert prompts[0] == server.llm_cache_key('extract', 'Certificate of Completion\nAwarded to Priya Raman')
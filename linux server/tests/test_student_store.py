@@ -0,0 +1,74 @@
+import threading
+
+import pytest
+
+from conftest import server
+
+
+def certificate(course, category='Course', issuer='Coursera', **fields):
+    return {'course': course, 'category': category, 'issuer': issuer, **fields}
+
+
+def test_add_certificates_is_one_transaction(store):
+    store.add_certificates([('S1', certificate('Python'), ['Python']),
+                            ('S2', certificate('SQL'), ['SQL', 'python'])])
+    assert store.get_certificates('S1') == [certificate('Python')]
+    assert store.get_skills('S2') == ['SQL', 'python']
+    assert store.student_version('S1') == store.student_version('S2') == store.data_version()
+
+
+def test_failed_transaction_writes_nothing(store):
+    store.add_certificate('S1', certificate('Python'), ['Python'])
+    version = store.data_version()
+    with pytest.raises(TypeError):
+        store.add_certificates([('S1', certificate('SQL'), ['SQL']), ('S2', object(), [])])
+    assert store.get_certificates('S1') == [certificate('Python')]
+    assert store.get_skills('S1') == ['Python']
+    assert store.data_version() == version
+
+
+def test_skills_merge_case_insensitively(store):
+    store.add_certificate('S1', certificate('Python'), ['Python', 'SQL'])
+    store.add_certificate('S1', certificate('Data'), ['python', 'Pandas'])
+    assert store.get_skills('S1') == ['Python', 'SQL', 'Pandas']
+
+
+def test_concurrent_writers_lose_nothing(store):
+    def add(worker):
+        for i in range(10):
+            store.add_certificate(f'S{worker}', certificate(f'Course {i}'), [f'Skill {worker}-{i}'])
+    threads = [threading.Thread(target=add, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for worker in range(4):
+        assert len(store.get_certificates(f'S{worker}')) == 10
+        assert len(store.get_skills(f'S{worker}')) == 10
+
+
+def test_roadmaps_and_versions(store):
+    store.add_certificate('S1', certificate('Python'), ['Python'])
+    before = store.student_version('S1')
+    store.set_roadmaps({'S1': {'career_title': 'Data Engineer'}})
+    assert store.get_roadmap('S1') == {'career_title': 'Data Engineer'}
+    assert store.get_roadmap('S2') is None
+    assert store.student_version('S1') > before
+
+
+def test_snapshot_reloads_after_a_write(store):
+    store.add_certificate('S1', certificate('Python'), ['Python'])
+    version, certificates, skills = store.snapshot()
+    assert store.snapshot()[1] is certificates
+    store.add_certificate('S2', certificate('SQL'), ['SQL'])
+    assert store.snapshot()[0] > version and store.snapshot()[2]['S2'] == ['SQL']
+
+
+def test_legacy_json_files_are_imported_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'student_detailed_data.json').write_text('{"S1": [{"course": "Python"}]}')
+    (tmp_path / 'student_skills.json').write_text('{"S1": ["Python"]}')
+    server.StudentStore('students.sqlite3')
+    store = server.StudentStore('students.sqlite3')
+    assert store.get_certificates('S1') == [{'course': 'Python'}]
+    assert store.get_skills('S1') == ['Python']
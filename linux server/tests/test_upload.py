@@ -0,0 +1,14 @@
+import io
+
+from conftest import server
+
+
+def test_upload_timings_include_the_store(client, store, monkeypatch):
+    monkeypatch.setattr(server, 'extract_text_from_document', lambda document: 'Certificate text')
+    monkeypatch.setattr(server, 'analyze_certificate_text', lambda text: {'course': 'Python', 'skills': ['Python']})
+    response = client.post('/process_certificate', data={
+        'student_id': 'S1', 'timings': '1', 'certificate': (io.BytesIO(b'image'), 'certificate.png')})
+    assert response.status_code == 200
+    assert 'store' in response.get_json()['timings']
+    assert store.get_skills('S1') == ['Python']
+    assert 'certificate_stage_seconds_count{stage="store"}' in server.metrics.render()